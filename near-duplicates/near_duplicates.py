@@ -0,0 +1,265 @@
+import argparse
+import os
+import pickle
+import re
+import time
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+__all__ = ['INDEX_PATH', 'SIMILARITY_THRESHOLD', 'minhash_signatures', 'NearDuplicateIndex']
+
+# installed from `near-duplicates/` by the ingestion of the markup site and by `quotes-ml`, so both of them compare the quotes
+# with the same signatures and can share the persisted index
+
+# kept next to the raw dumps, `ingest.py` adds every quote it stores
+INDEX_PATH = Path(os.getenv('NEAR_DUPLICATES_INDEX_PATH', './data/near-duplicates.npz'))
+
+# signatures are only comparable when they are computed with the same parameters, the index refuses to load otherwise
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 120
+BANDS = 20
+ROWS = NUM_PERMUTATIONS // BANDS
+SEED = 42
+
+# estimated Jaccard similarity of the shingles; with 20 bands of 6 rows a pair at the threshold becomes a candidate
+# with a probability of 0.92, a pair at 0.4 with a probability of 0.08
+SIMILARITY_THRESHOLD = float(os.getenv('NEAR_DUPLICATES_THRESHOLD', 0.7))
+
+# a bucket shared by more quotes than that is a degenerate one (e.g. empty texts), the rest of it is not compared
+MAX_BUCKET_CANDIDATES = 100
+# recent inserts are scanned linearly, the rest of the index is kept sorted by the band keys
+DELTA_SIZE = 4096
+SIGNATURE_BATCH_SIZE = 256
+
+NON_WORD_PATTERN = re.compile(r'[\W_]+')
+
+_random = np.random.default_rng(SEED)
+# multiply-shift hashing, the upper 32 bits of `a * x + b` with an odd `a`
+PERMUTATION_A = _random.integers(1, 2 ** 63, NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+PERMUTATION_B = _random.integers(0, 2 ** 63, NUM_PERMUTATIONS, dtype=np.uint64)
+# polynomial hashes of the shingles and of the bands, all of the arithmetic wraps around 2 ** 64
+SHINGLE_POWERS = np.array([pow(1_000_003, power, 2 ** 64) for power in range(SHINGLE_SIZE)], dtype=np.uint64)
+BAND_POWERS = np.array([pow(2 ** 32 + 15, power, 2 ** 64) for power in range(ROWS)], dtype=np.uint64)
+
+
+def _normalize(text: str) -> str:
+    # reposts differ in case, punctuation, emoji and `ё`, none of which should make a quote new
+    return NON_WORD_PATTERN.sub(' ', text.casefold().replace('ё', 'е')).strip().ljust(SHINGLE_SIZE)
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # concatenation of `range(start, start + count)` for every pair
+    first_positions = np.cumsum(counts) - counts
+    return np.repeat(starts - first_positions, counts) + np.arange(counts.sum())
+
+
+def _shingle_hashes(texts: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+    # hashes of the character shingles of all the texts, and the position of the first shingle of every text
+    normalized = [_normalize(text) for text in texts]
+    code_points = np.frombuffer(''.join(normalized).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+    lengths = np.fromiter(map(len, normalized), dtype=np.int64, count=len(normalized))
+    shingle_counts = lengths - SHINGLE_SIZE + 1
+    shingle_starts = _ranges(np.cumsum(lengths) - lengths, shingle_counts)
+
+    windows = np.lib.stride_tricks.sliding_window_view(code_points, SHINGLE_SIZE)[shingle_starts]
+    return (windows * SHINGLE_POWERS).sum(axis=1), np.cumsum(shingle_counts) - shingle_counts
+
+
+def minhash_signatures(texts: Sequence[str]) -> np.ndarray:
+    signatures = np.empty((len(texts), NUM_PERMUTATIONS), dtype=np.uint32)
+
+    # the permuted hashes of a batch take `NUM_PERMUTATIONS` times the memory of its shingles
+    for start in range(0, len(texts), SIGNATURE_BATCH_SIZE):
+        hashes, first_shingles = _shingle_hashes(texts[start:start + SIGNATURE_BATCH_SIZE])
+        permuted = ((PERMUTATION_A[:, None] * hashes[None, :] + PERMUTATION_B[:, None]) >> np.uint64(32)).astype(np.uint32)
+        signatures[start:start + len(first_shingles)] = np.minimum.reduceat(permuted, first_shingles, axis=1).T
+
+    return signatures
+
+
+def _band_keys(signatures: np.ndarray) -> np.ndarray:
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    return (bands * BAND_POWERS).sum(axis=2)
+
+
+class NearDuplicateIndex:
+    # MinHash signatures with LSH banding: quotes are candidates when all rows of at least one of their bands coincide,
+    # and a candidate is a near-duplicate when the share of the coinciding signature values reaches the threshold
+    def __init__(self, keys: Sequence[str] = (), signatures: np.ndarray | None = None, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.keys: list[str] = []
+        self.positions: dict[str, int] = {}
+
+        # rows are appended to a buffer that grows geometrically, rows before `_merged` are sorted by the band keys
+        self._buffer = np.empty((DELTA_SIZE, NUM_PERMUTATIONS), dtype=np.uint32)
+        self._merged = 0
+        self._sorted_keys = np.empty((BANDS, 0), dtype=np.uint64)
+        self._sorted_rows = np.empty((BANDS, 0), dtype=np.int64)
+        self._delta_band_keys = np.empty((0, BANDS), dtype=np.uint64)
+
+        if signatures is not None:
+            self.add(keys, signatures)
+
+    @classmethod
+    def load(cls, path: Path = INDEX_PATH, threshold: float = SIMILARITY_THRESHOLD):
+        with np.load(path) as arrays:
+            if tuple(arrays['parameters']) != (SHINGLE_SIZE, NUM_PERMUTATIONS, BANDS, SEED):
+                raise ValueError(f'{path} has been built with other parameters, remove it to rebuild the index')
+
+            return cls(arrays['keys'].tolist(), arrays['signatures'], threshold)
+
+    def save(self, path: Path = INDEX_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        temporary_path = path.with_suffix('.tmp.npz')
+        np.savez(temporary_path, keys=np.array(self.keys, dtype=np.str_), signatures=self.signatures,
+                 parameters=np.array([SHINGLE_SIZE, NUM_PERMUTATIONS, BANDS, SEED]))
+        os.replace(temporary_path, path)
+
+    @property
+    def signatures(self) -> np.ndarray:
+        return self._buffer[:len(self.keys)]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.positions
+
+    def add(self, keys: Sequence[str], signatures: np.ndarray):
+        # the quotes are added as they are, even if they are near-duplicates of each other, see `add_new`
+        size = len(self.keys)
+
+        if size + len(keys) > len(self._buffer):
+            buffer = np.empty((max(2 * len(self._buffer), size + len(keys)), NUM_PERMUTATIONS), dtype=np.uint32)
+            buffer[:size] = self._buffer[:size]
+            self._buffer = buffer
+
+        self._buffer[size:size + len(keys)] = signatures
+        self.positions.update((key, size + offset) for offset, key in enumerate(keys))
+        self.keys.extend(keys)
+        self._delta_band_keys = np.concatenate([self._delta_band_keys, _band_keys(signatures)])
+
+        if len(self._delta_band_keys) >= DELTA_SIZE:
+            self._merge()
+
+    def _merge(self):
+        # the sorted delta is appended to the sorted rows, the stable sort (timsort) merges two sorted runs in linear time
+        delta_keys = self._delta_band_keys.T
+        delta_order = np.argsort(delta_keys, axis=1)
+
+        band_keys = np.concatenate([self._sorted_keys, np.take_along_axis(delta_keys, delta_order, axis=1)], axis=1)
+        rows = np.concatenate([self._sorted_rows, delta_order + self._merged], axis=1)
+        order = np.argsort(band_keys, axis=1, kind='stable')
+
+        self._sorted_keys = np.take_along_axis(band_keys, order, axis=1)
+        self._sorted_rows = np.take_along_axis(rows, order, axis=1)
+        self._merged = len(self.keys)
+        self._delta_band_keys = np.empty((0, BANDS), dtype=np.uint64)
+
+    def _candidates(self, band_keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # pairs of a query and an indexed row sharing a bucket in at least one of the bands
+        queries, rows = [], []
+
+        for band in range(BANDS):
+            lower = np.searchsorted(self._sorted_keys[band], band_keys[:, band], side='left')
+            counts = np.minimum(np.searchsorted(self._sorted_keys[band], band_keys[:, band], side='right') - lower,
+                                MAX_BUCKET_CANDIDATES)
+            queries.append(np.repeat(np.arange(len(band_keys)), counts))
+            rows.append(self._sorted_rows[band][_ranges(lower, counts)])
+
+            delta_queries, delta_rows = np.nonzero(band_keys[:, band, None] == self._delta_band_keys[None, :, band])
+            queries.append(delta_queries)
+            rows.append(delta_rows + self._merged)
+
+        # every pair once, however many bands it shares
+        size = max(len(self.keys), 1)
+        pairs = np.unique(np.concatenate(queries).astype(np.int64) * size + np.concatenate(rows))
+
+        return pairs // size, pairs % size
+
+    def query(self, signatures: np.ndarray) -> list[tuple[str, float] | None]:
+        # the most similar indexed quote for every signature, if it is similar enough
+        matches = [None] * len(signatures)
+        queries, rows = self._candidates(_band_keys(signatures))
+
+        similarities = (signatures[queries] == self._buffer[rows]).mean(axis=1)
+        similar = similarities >= self.threshold
+        queries, rows, similarities = queries[similar], rows[similar], similarities[similar]
+
+        # the best candidate goes first within every query
+        order = np.lexsort((-similarities, queries))
+        _, first_candidates = np.unique(queries[order], return_index=True)
+
+        for candidate in order[first_candidates]:
+            matches[queries[candidate]] = self.keys[rows[candidate]], float(similarities[candidate])
+
+        return matches
+
+    def add_new(self, keys: Sequence[str], signatures: np.ndarray) -> list[tuple[str, float] | None]:
+        # adds the quotes that are neither near-duplicates of the indexed ones nor of the earlier quotes of the batch,
+        # returns the match of every other quote
+        matches = self.query(signatures)
+        band_keys = _band_keys(signatures)
+        buckets = [{} for _ in range(BANDS)]
+        new_quotes = []
+
+        for index in (index for index, match in enumerate(matches) if match is None):
+            candidates = sorted({candidate for band in range(BANDS) for candidate in buckets[band].get(band_keys[index, band], ())})
+
+            if candidates:
+                similarities = (signatures[candidates] == signatures[index]).mean(axis=1)
+                best_candidate = int(np.argmax(similarities))
+
+                if similarities[best_candidate] >= self.threshold:
+                    matches[index] = keys[candidates[best_candidate]], float(similarities[best_candidate])
+                    continue
+
+            new_quotes.append(index)
+            for band in range(BANDS):
+                buckets[band].setdefault(band_keys[index, band], []).append(index)
+
+        if new_quotes:
+            self.add([keys[index] for index in new_quotes], signatures[new_quotes])
+
+        return matches
+
+
+def run_benchmark(quotes_count: int, threshold: float):
+    # the pickled quotes of the training data, indexed the way `ingest.py` does it
+    texts = []
+    for filename in sorted(Path('./data').glob('*.pkl')):
+        with open(filename, 'rb') as data_file:
+            texts.extend(pickle.load(data_file))
+
+    texts = list(dict.fromkeys(texts))[:quotes_count]
+
+    initial_time = time.perf_counter()
+    signatures = minhash_signatures(texts)
+    signatures_time = time.perf_counter() - initial_time
+
+    index = NearDuplicateIndex(threshold=threshold)
+    initial_time = time.perf_counter()
+    matches = [match for start in range(0, len(texts), 1000)
+               for match in index.add_new([str(key) for key in range(start, min(start + 1000, len(texts)))],
+                                          signatures[start:start + 1000])]
+    index_time = time.perf_counter() - initial_time
+
+    print(f'Signatures of {len(texts)} quotes in {signatures_time:.2f} seconds ({len(texts) / signatures_time:.0f} quotes/sec)')
+    print(f'Indexed in {index_time:.2f} seconds ({len(texts) / index_time:.0f} quotes/sec), '
+          f'{len(texts) - len(index)} near-duplicates')
+
+    for position, match in [(position, match) for position, match in enumerate(matches) if match is not None][:5]:
+        print(f'{match[1]:.2f} {texts[position]!r}\n     {texts[int(match[0])]!r}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Near-duplicates among the pickled quotes of ./data')
+    parser.add_argument('--quotes', type=int, default=None, help='all of the quotes by default')
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD)
+    args = parser.parse_args()
+
+    run_benchmark(args.quotes, args.threshold)
@@ -0,0 +1,149 @@
+import secrets
+from datetime import timedelta
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import abort
+
+import metrics
+from quote_feed import discard_feed, queue_refill, queue_trim, served_count
+from quote_queries import next_position, NSFW_THRESHOLD, position_quote_id
+from session_store import RedisHashSession
+from sync_index import index_sync_token
+
+# the handling of the requests shared by `main.py` and `asgi.py`: the apps only read the requests and talk to Mongo and Redis
+# in between these steps; the Redis writes of a request are queued on the pipeline of its session, which is sent together
+# with the session update
+
+__all__ = ['NSFW_MARKED', 'nsfw_filter_requested', 'nsfw_threshold', 'remember_nsfw_filter', 'require_annotator',
+           'checked_quote_action', 'reported', 'vote_counted', 'vote_rejected', 'requested_sync_token', 'synced',
+           'start_annotation', 'feed_quote', 'refilled_quote', 'served_quote', 'moved_forward']
+
+NSFW_MARKED = 'Successfully marked the quote as NSFW!'
+
+
+def nsfw_filter_requested(args: MultiDict) -> bool:
+    return args.get('nsfw_filter', 'false').lower() == 'true'
+
+
+def nsfw_threshold(nsfw_filter: bool) -> int | None:
+    return NSFW_THRESHOLD if nsfw_filter else None
+
+
+def remember_nsfw_filter(session: RedisHashSession, args: MultiDict):
+    if nsfw_filter_requested(args):
+        session['nsfw_always_on'] = True
+
+
+def require_annotator(session: RedisHashSession):
+    if session.get('name') is None:
+        abort(403)
+
+
+def checked_quote_action(session: RedisHashSession, form: MultiDict, *fields: str) -> list[str]:
+    # the requested fields followed by the id of the quote, which has to be the current quote of the session; `get_quote`
+    # stores the position of the quote it has served, so there is no need to look it up again
+    values = [form.get(field) for field in (*fields, 'internal_id')]
+
+    if None in values:
+        abort(400)
+
+    position = session.get('quotes_iterator')
+    if session.get('name') is None or position is None or position_quote_id(position) != values[-1]:
+        abort(403)
+
+    return values
+
+
+def reported(session: RedisHashSession) -> str:
+    session.increment('vote_streak')
+    return 'Successfully reported the quote!'
+
+
+def vote_counted(session: RedisHashSession, skip: bool) -> dict:
+    session.increment('vote_streak')
+
+    if not skip:
+        # the quote has left the collection, move past it
+        session['quotes_iterator'] = next_position(session['quotes_iterator'])
+
+    return {'skip': skip}
+
+
+def vote_rejected(session: RedisHashSession) -> tuple[dict, int]:
+    # the vote is lost, the client is told so and moves past the quote, which drops it from the feed on the next `get_quote`
+    session['quotes_iterator'] = next_position(session['quotes_iterator'])
+    return {'skip': False}, 409
+
+
+def requested_sync_token(session: RedisHashSession, form: MultiDict) -> str | None:
+    # the token of the account to take the progress from; without one, the client asks for the token of its own account
+    require_annotator(session)
+    return form.get('token')
+
+
+def synced(session: RedisHashSession, value: dict | None) -> str:
+    # `value` is the session the token resolves to
+    if value is None:
+        abort(400)
+
+    session['quotes_iterator'] = value['quotes_iterator']
+    session['vote_streak'] = value['vote_streak']
+
+    discard_feed(session.pipeline, session.sid)
+
+    return 'Successfully synchronized accounts!'
+
+
+def start_annotation(session: RedisHashSession, args: MultiDict) -> tuple[bool, bool]:
+    # whether the NSFW filter is on and whether the annotator is new
+    new_user = session.get('name') is None
+
+    if new_user:
+        session['name'] = secrets.token_hex(4)
+        session['vote_streak'] = 0
+
+    nsfw_filter = nsfw_filter_requested(args) or session.get('nsfw_always_on') is not None
+
+    if nsfw_filter:
+        # quotes served from the prefetched feed have not skipped anything, a refill reports what it has skipped
+        metrics.record_nsfw_skipped(0)
+
+    return nsfw_filter, new_user
+
+
+def feed_quote(session: RedisHashSession, key: str, feed: list[tuple], starting_point: str,
+               ttl: timedelta) -> tuple[str, str, str, int, str] | None:
+    # the current quote of the prefetched feed, None once the feed is used up and has to be refilled
+    served = served_count(feed, starting_point)
+
+    if served == len(feed):
+        return None
+
+    if served:
+        queue_trim(session.pipeline, key, served, ttl)
+
+    return feed[served]
+
+
+def refilled_quote(session: RedisHashSession, key: str, feed: list[tuple], ttl: timedelta) -> tuple[str, str, str, int, str] | None:
+    queue_refill(session.pipeline, key, feed, ttl)
+    return feed[0] if feed else None
+
+
+def served_quote(session: RedisHashSession, quote: tuple[str, str, str, int, str] | None, new_user: bool, session_key: str,
+                 ttl: timedelta) -> dict:
+    if quote is None:
+        abort(404)
+
+    text, channel_name, channel_link, nsfw, position = quote
+    session['quotes_iterator'] = position
+
+    index_sync_token(session.pipeline, session['name'], session_key, ttl)
+
+    return {'text': text, 'internal_id': position_quote_id(position), 'new_user': new_user, 'channel_name': channel_name,
+            'channel_link': channel_link, 'nsfw': nsfw, 'vote_streak': session['vote_streak']}
+
+
+def moved_forward(session: RedisHashSession, starting_point: str) -> str:
+    session['quotes_iterator'] = next_position(starting_point)
+    return 'Successfully moved iterator forwards!'
@@ -0,0 +1,260 @@
+import asyncio
+import os
+import secrets
+from contextlib import suppress
+from datetime import timedelta
+
+import msgpack
+import redis
+import redis.asyncio
+from quart import abort, Quart, redirect, render_template, request, Response, session
+from quart.sessions import SessionInterface
+
+import async_db
+import async_vote_buffer
+import metrics
+from annotation import checked_quote_action, feed_quote, moved_forward, NSFW_MARKED, nsfw_threshold, refilled_quote, \
+    remember_nsfw_filter, reported, require_annotator, requested_sync_token, served_quote, start_annotation, synced, vote_counted, \
+    vote_rejected
+from quote_feed import feed_key, load_feed, PREFETCH_SIZE
+from quote_queries import QuoteProcessedError
+from session_store import decode_fields, queue_migration, RedisHashSession, SESSION_KEY_PREFIX
+from sync_index import sync_key
+from vote_batches import WRITE_BEHIND
+
+# the asyncio counterpart of `main.py`, served by uvicorn workers when `SERVING_MODE=async` (see `gunicorn.conf.py`);
+# the routes, the sessions and the Redis keys are the same, so both modes can serve the same users, and the handling of
+# the requests is shared through `annotation`, only the I/O differs
+
+REDIS_ADDRESS = os.getenv('REDIS_ADDRESS')
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
+
+# connections are shared by all the requests of a worker, a request waits at most `REDIS_TIMEOUT` seconds for a free one
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT', 5))
+
+SESSION_ID_LENGTH = 32  # same as Flask-Session
+
+redis_pool = redis.asyncio.BlockingConnectionPool.from_url(
+    f'redis://default:{REDIS_PASSWORD}@{REDIS_ADDRESS}', max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT, connection_class=metrics.InstrumentedAsyncRedisConnection)
+redis_conn = redis.asyncio.Redis(connection_pool=redis_pool)
+
+
+class AsyncRedisHashSessionInterface(SessionInterface):
+    # the same hashes as `session_store.RedisHashSessionInterface`, with the same cookie
+    def __init__(self, client: redis.asyncio.Redis, key_prefix: str = SESSION_KEY_PREFIX, permanent: bool = True):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.permanent = permanent
+
+    async def _retrieve_session_data(self, store_id: str) -> dict | None:
+        try:
+            return decode_fields(await self.client.hgetall(store_id)) or None
+        except redis.ResponseError:
+            raw_value, ttl = await self.client.get(store_id), await self.client.pttl(store_id)
+            if raw_value is None:
+                return None
+
+            value = msgpack.unpackb(raw_value)
+
+            pipeline = self.client.pipeline()
+            queue_migration(pipeline, store_id, value, ttl)
+            await pipeline.execute()
+
+            return value
+
+    async def open_session(self, app: Quart, request) -> RedisHashSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        saved_session_data = sid and await self._retrieve_session_data(self.key_prefix + sid)
+
+        if saved_session_data:
+            session = RedisHashSession(saved_session_data, sid=sid)
+        else:
+            # unknown and expired ids are not reused
+            session = RedisHashSession(sid=secrets.token_urlsafe(SESSION_ID_LENGTH), permanent=self.permanent)
+
+        session.pipeline = self.client.pipeline()
+        return session
+
+    async def save_session(self, app: Quart, session: RedisHashSession, response: Response | None):
+        store_id = self.key_prefix + session.sid
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+
+        if response is not None and session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                session.pipeline.delete(store_id)
+                if response is not None:
+                    response.delete_cookie(name, domain=domain, path=path)
+        else:
+            session.queue_update(store_id, app.permanent_session_lifetime)
+
+            if response is not None and self.should_set_cookie(app, session):
+                response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                    httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                    secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+        if len(session.pipeline):
+            await session.pipeline.execute()
+
+
+app = Quart(__name__)
+# what Talisman sets up for `main.py`
+app.config['SESSION_COOKIE_SECURE'] = True
+app.config['SESSION_COOKIE_HTTPONLY'] = True
+app.session_interface = AsyncRedisHashSessionInterface(redis_conn)
+metrics.init_asgi_app(app, redis_conn)
+
+# the task of the worker that writes the buffered votes, see `start_vote_flusher`
+vote_flusher: asyncio.Task | None = None
+
+
+@app.before_request
+async def force_https():
+    if request.is_secure or request.headers.get('X-Forwarded-Proto', 'http') == 'https' or app.debug or app.testing:
+        return None
+
+    return redirect(request.url.replace('http://', 'https://', 1))
+
+
+@app.after_request
+async def add_security_headers(response: Response) -> Response:
+    response.headers['Strict-Transport-Security'] = 'max-age=31556926; includeSubDomains'
+    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
+
+    return response
+
+
+@app.before_serving
+async def start_vote_flusher():
+    global vote_flusher
+
+    if WRITE_BEHIND:
+        vote_flusher = asyncio.create_task(async_vote_buffer.run_flusher(redis_conn))
+
+
+@app.after_serving
+async def close_pools():
+    if vote_flusher is not None:
+        vote_flusher.cancel()
+        with suppress(asyncio.CancelledError):
+            await vote_flusher
+
+    await redis_pool.disconnect()
+    async_db.client.close()
+
+
+async def apply_vote(vote: str, internal_id: str) -> bool:
+    if not WRITE_BEHIND:
+        return await async_db.apply_vote(vote, internal_id)
+
+    return await async_vote_buffer.buffer_vote(redis_conn, vote, internal_id)
+
+
+async def apply_nsfw(internal_id: str):
+    if not WRITE_BEHIND:
+        return await async_db.apply_nsfw(internal_id)
+
+    await async_vote_buffer.buffer_nsfw(redis_conn, internal_id)
+
+
+async def next_quote(starting_point: str, nsfw_filter: bool, ttl: timedelta) -> tuple[str, str, str, int, str] | None:
+    key = feed_key(session.sid, nsfw_filter)
+    quote = feed_quote(session, key, load_feed(await redis_conn.lrange(key, 0, -1)), starting_point, ttl)
+
+    if quote is not None:
+        return quote
+
+    feed = await async_db.get_quotes_batch(starting_point, PREFETCH_SIZE, nsfw_threshold(nsfw_filter))
+    return refilled_quote(session, key, feed, ttl)
+
+
+async def resolve_sync_token(token: str) -> dict | None:
+    # see `sync_index.resolve_sync_token`
+    session_key = await redis_conn.get(sync_key(token))
+
+    if session_key is None:
+        return None
+
+    value = await app.session_interface._retrieve_session_data(session_key.decode())
+
+    if value is None:
+        await redis_conn.delete(sync_key(token))
+        return None
+
+    if value.get('name') != token:
+        return None
+
+    return value
+
+
+@app.route('/')
+async def index():
+    remember_nsfw_filter(session, request.args)
+    return await render_template('index.html')
+
+
+@app.route('/report', methods=['POST'])
+async def report():
+    mongo_id, = checked_quote_action(session, await request.form)
+    await async_db.add_reported_quote(mongo_id)
+
+    return reported(session)
+
+
+@app.route('/mark_nsfw', methods=['POST'])
+async def mark_nsfw():
+    mongo_id, = checked_quote_action(session, await request.form)
+    await apply_nsfw(mongo_id)
+
+    return NSFW_MARKED
+
+
+@app.route('/vote', methods=['POST'])
+async def vote():
+    vote_value, mongo_id = checked_quote_action(session, await request.form, 'vote')
+
+    try:
+        skip = await apply_vote(vote_value, mongo_id)
+    except ValueError:
+        abort(400)
+    except QuoteProcessedError:
+        return vote_rejected(session)
+
+    return vote_counted(session, skip)
+
+
+@app.route('/sync_data', methods=['POST'])
+async def sync_data():
+    data_token = requested_sync_token(session, await request.form)
+
+    if data_token is None:
+        return {'token': session['name']}
+
+    return synced(session, await resolve_sync_token(data_token))
+
+
+@app.route('/get_quote', methods=['GET'])
+async def get_quote():
+    nsfw_filter, new_user = start_annotation(session, request.args)
+
+    starting_point = session.get('quotes_iterator') or await async_db.first_position()
+    quote = await next_quote(starting_point, nsfw_filter, app.permanent_session_lifetime)
+
+    return served_quote(session, quote, new_user, app.session_interface.key_prefix + session.sid, app.permanent_session_lifetime)
+
+
+@app.route('/proceed', methods=['GET'])
+async def proceed():
+    require_annotator(session)
+    return moved_forward(session, session.get('quotes_iterator') or await async_db.first_position())
+
+
+if __name__ == '__main__':
+    # development server only, in production the app is served by gunicorn with uvicorn workers (see gunicorn.conf.py)
+    app.run('0.0.0.0', int(os.getenv('PORT', 80)))
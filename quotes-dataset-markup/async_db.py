@@ -0,0 +1,106 @@
+import os
+from contextlib import suppress
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# the queries, the positions and the vote rules are the same as in the synchronous `db`
+from quote_queries import (clamp_votes, content_hash_clash, duplicate_merge, MONGO_URI, OBJECT_ID_LENGTH, position_query,
+                           position_range_query, processed_insert, quote_position, QUOTES_ORDER, QuoteProcessedError, RANK_DIGITS,
+                           TOUCH, vote_increment, without_bookkeeping)
+from metrics import MongoCommandCounter, record_nsfw_skipped
+
+__all__ = ['get_first_quote_id', 'first_position', 'get_quotes_batch', 'add_reported_quote', 'apply_vote',
+           'apply_nsfw', 'settle_quote', 'client']
+
+# a worker serves all of its requests through a single pool, requests wait for a free connection when it is exhausted
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+# how long a request waits for a free connection, for the server to be selected and for a reply
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', 10000))
+
+# the client attaches to the event loop of the worker on the first command
+client = AsyncIOMotorClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE,
+                            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                            connectTimeoutMS=MONGO_TIMEOUT_MS, socketTimeoutMS=MONGO_TIMEOUT_MS,
+                            event_listeners=[MongoCommandCounter()])
+
+current_quotes_collection = client['quotes-dataset']['current-quotes']
+processed_quotes_collection = client['quotes-dataset']['processed-quotes']
+reported_quotes_collection = client['quotes-dataset']['reported-quotes']
+
+
+async def get_first_quote_id() -> str:
+    return str((await current_quotes_collection.find_one({}, {'_id': 1}, sort=[('_id', 1)]))['_id'])
+
+
+async def first_position() -> str:
+    if QUOTES_ORDER == 'uncertainty':
+        return '0' * (RANK_DIGITS + OBJECT_ID_LENGTH)
+
+    return await get_first_quote_id()
+
+
+async def get_quotes_batch(starting_point: str, limit: int,
+                           nsfw_threshold: int | None = None) -> list[tuple[str, str, str, int, str]]:
+    query, sort = position_query(starting_point)
+    if nsfw_threshold is not None:
+        query['nsfw'] = {'$lt': nsfw_threshold}
+
+    quotes = await current_quotes_collection.find(query).sort(sort).limit(limit).to_list(None)
+
+    if nsfw_threshold is not None and quotes:
+        hidden_query = {**position_range_query(starting_point, quote_position(quotes[-1])), 'nsfw': {'$gte': nsfw_threshold}}
+        record_nsfw_skipped(await current_quotes_collection.count_documents(hidden_query))
+
+    return [(quote['text'], quote['channel_name'], quote['channel_link'], quote['nsfw'], quote_position(quote)) for quote in quotes]
+
+
+async def add_reported_quote(internal_id: str):
+    reported_quote = await current_quotes_collection.find_one({'_id': ObjectId(internal_id)})
+
+    if reported_quote is None:
+        return
+
+    with suppress(DuplicateKeyError):
+        await reported_quotes_collection.update_one({'_id': reported_quote['_id']},
+                                                    {'$setOnInsert': without_bookkeeping(reported_quote), **TOUCH},
+                                                    upsert=True)
+
+
+async def apply_nsfw(internal_id: str):
+    await current_quotes_collection.update_one({'_id': ObjectId(internal_id)}, {'$inc': {'nsfw': 1}, **TOUCH})
+
+
+async def _finalize_quote(current_quote: dict):
+    try:
+        await processed_quotes_collection.update_one({'_id': current_quote['_id']}, processed_insert(current_quote), upsert=True)
+    except DuplicateKeyError as error:
+        if content_hash_clash(error):
+            await processed_quotes_collection.update_one(*duplicate_merge(current_quote))
+
+    await current_quotes_collection.delete_one({'_id': current_quote['_id']})
+
+
+async def apply_vote(vote: str, internal_id: str) -> bool:
+    internal_id = ObjectId(internal_id)
+    increment = vote_increment(vote)
+
+    current_quote = await current_quotes_collection.find_one_and_update({'_id': internal_id}, {'$inc': increment, **TOUCH},
+                                                                        return_document=ReturnDocument.AFTER)
+
+    if current_quote is None:
+        raise QuoteProcessedError(f'Quote {internal_id} has already been processed')
+
+    return await settle_quote(current_quote)
+
+
+async def settle_quote(current_quote: dict) -> bool:
+    if clamp_votes(current_quote):
+        await _finalize_quote(current_quote)
+        return False
+
+    return True
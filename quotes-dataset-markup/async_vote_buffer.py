@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from contextlib import suppress
+
+import redis
+import redis.asyncio
+from redis.exceptions import LockNotOwnedError
+
+from async_db import current_quotes_collection, settle_quote
+from vote_batches import (BATCH_ID_FIELD, buffer_full, BUFFER_KEY, FLUSH_INTERVAL, FLUSHING_KEY, LOCK_KEY, LOCK_TIMEOUT,
+                          new_batch_id, queue_increment, vote_field, VoteBatch)
+
+__all__ = ['buffer_vote', 'buffer_nsfw', 'flush_votes', 'run_flusher']
+
+# the asyncio counterpart of `vote_buffer` for `asgi.py`, on the same keys and with the same batches, written through motor
+
+logger = logging.getLogger(__name__)
+
+# wakes up the flusher of the worker before its interval when the buffer is full
+_flush_requested = asyncio.Event()
+
+
+async def _buffer_increment(redis_conn: redis.asyncio.Redis, internal_id: str, field: str):
+    pipeline = redis_conn.pipeline()
+    queue_increment(pipeline, internal_id, field)
+
+    if buffer_full(await pipeline.execute()):
+        _flush_requested.set()
+
+
+async def buffer_vote(redis_conn: redis.asyncio.Redis, vote: str, internal_id: str) -> bool:
+    await _buffer_increment(redis_conn, internal_id, vote_field(vote))
+
+    return True
+
+
+async def buffer_nsfw(redis_conn: redis.asyncio.Redis, internal_id: str):
+    await _buffer_increment(redis_conn, internal_id, 'nsfw')
+
+
+async def _discard_batch(redis_conn: redis.asyncio.Redis, batch_id: str):
+    async with redis_conn.pipeline() as pipeline:
+        try:
+            await pipeline.watch(FLUSHING_KEY)
+            if await pipeline.hget(FLUSHING_KEY, BATCH_ID_FIELD) == batch_id.encode():
+                pipeline.multi()
+                pipeline.delete(FLUSHING_KEY)
+                await pipeline.execute()
+        except redis.WatchError:
+            pass
+
+
+async def flush_votes(redis_conn: redis.asyncio.Redis) -> int:
+    # see `vote_buffer.flush_votes`
+    lock = redis_conn.lock(LOCK_KEY, timeout=LOCK_TIMEOUT)
+    if not await lock.acquire(blocking=False):
+        return 0
+
+    try:
+        if not await redis_conn.exists(FLUSHING_KEY):
+            try:
+                await redis_conn.rename(BUFFER_KEY, FLUSHING_KEY)
+            except redis.ResponseError:
+                return 0
+
+        await redis_conn.hsetnx(FLUSHING_KEY, BATCH_ID_FIELD, new_batch_id())
+        batch = VoteBatch.from_fields(await redis_conn.hgetall(FLUSHING_KEY))
+
+        if batch.increments:
+            await current_quotes_collection.bulk_write(batch.operations(), ordered=False)
+            await lock.reacquire()
+
+        if voted_ids := batch.voted_ids():
+            async for current_quote in current_quotes_collection.find({'_id': {'$in': voted_ids}}):
+                await settle_quote(current_quote)
+            await lock.reacquire()
+
+        await _discard_batch(redis_conn, batch.batch_id)
+
+        return len(batch.increments)
+    finally:
+        with suppress(LockNotOwnedError):
+            await lock.release()
+
+
+async def run_flusher(redis_conn: redis.asyncio.Redis):
+    while True:
+        with suppress(TimeoutError):
+            await asyncio.wait_for(_flush_requested.wait(), FLUSH_INTERVAL)
+        _flush_requested.clear()
+
+        try:
+            await flush_votes(redis_conn)
+        except Exception:
+            logger.exception('Flushing of buffered votes failed')
@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+import time
+from contextlib import suppress
+
+import redis
+import schedule
+from redis.exceptions import LockNotOwnedError
+
+from db_backup import create_backup
+
+REDIS_ADDRESS = os.getenv('REDIS_ADDRESS')
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
+
+LOCK_KEY = 'backup:lock'
+LOCK_TIMEOUT = 30 * 60
+METRICS_KEY = 'backup:metrics'
+
+redis_conn = redis.from_url(f'redis://default:{REDIS_PASSWORD}@{REDIS_ADDRESS}')
+logger = logging.getLogger(__name__)
+
+
+def _record_metrics(metrics: dict):
+    # the web process reads the last run from here, so it does not have to import the backup machinery
+    flat_metrics = {'started_at': metrics['started_at'], 'duration_seconds': metrics['duration_seconds']}
+    for collection_name, collection_metrics in metrics['collections'].items():
+        flat_metrics[f'{collection_name}_documents'] = collection_metrics['documents']
+        flat_metrics[f'{collection_name}_bytes'] = collection_metrics['bytes']
+
+    redis_conn.hset(METRICS_KEY, mapping=flat_metrics)
+
+
+def run_backup():
+    # several worker dynos may be running at the same time (e.g. during a deploy), only one of them does the job
+    lock = redis_conn.lock(LOCK_KEY, timeout=LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        logger.info('Skipping backup: another worker is already running it')
+        return
+
+    try:
+        metrics = create_backup(incremental=True)
+        _record_metrics(metrics)
+        logger.info('Backup finished: %s', json.dumps(metrics))
+    except Exception:
+        # a failed run is retried on the next one, the schedule loop keeps going
+        logger.exception('Backup failed')
+    finally:
+        # the lock expires if the backup runs longer than `LOCK_TIMEOUT`, another worker may hold it by now
+        with suppress(LockNotOwnedError):
+            lock.release()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    schedule.every().hour.do(run_backup)
+
+    while True:
+        schedule.run_pending()
+        time.sleep(1)
@@ -0,0 +1,214 @@
+import argparse
+import os
+import pickle
+import random
+import statistics
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+
+# the harness runs against local servers or in-memory stand-ins, `main` and `db` are only imported once the stand-ins
+# are installed, since they connect on import
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017/')
+os.environ.setdefault('REDIS_ADDRESS', 'localhost:6379')
+
+LOAD_DATABASE = 'quotes-dataset-load'
+DATA_DIR = Path(__file__).parent.parent / 'data'
+NSFW_SHARE = 0.05
+
+# what an annotator does with a quote, in the same way `index.html` does it
+ACTIONS = {'vote': 0.8, 'mark_nsfw': 0.05, 'report': 0.05, 'skip': 0.05, 'sync': 0.05}
+
+
+class _Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = Lock()
+
+    def record(self, endpoint: str, latency: float, status: int):
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+            if status >= 500:
+                self.errors[endpoint] += 1
+
+
+class _Annotator:
+    def __init__(self, app, recorder: _Recorder, rng: random.Random):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.rng = rng
+        self.nsfw_filter = rng.random() < 0.9  # the filter is on by default in the client
+        self.internal_id = None
+
+    def _request(self, endpoint: str, method: str, path: str, data: dict | None = None):
+        initial_time = time.perf_counter()
+        # Talisman redirects plain HTTP to HTTPS
+        response = self.client.open(path, method=method, data=data, base_url='https://localhost')
+        self.recorder.record(endpoint, time.perf_counter() - initial_time, response.status_code)
+
+        return response
+
+    def get_quote(self) -> bool:
+        response = self._request('get_quote', 'GET', f'/get_quote?nsfw_filter={str(self.nsfw_filter).lower()}')
+
+        if response.status_code != 200:
+            # the collection has been annotated completely
+            return False
+
+        self.internal_id = response.get_json()['internal_id']
+        return True
+
+    def proceed(self) -> bool:
+        self._request('proceed', 'GET', '/proceed')
+        return self.get_quote()
+
+    def act(self, sync_tokens: list[str]) -> bool:
+        action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+
+        match action:
+            case 'vote':
+                response = self._request('vote', 'POST', '/vote',
+                                         {'internal_id': self.internal_id, 'vote': self.rng.choice(('positive', 'negative'))})
+                if response.status_code == 200 and response.get_json()['skip']:
+                    return self.proceed()
+                return self.get_quote()
+            case 'mark_nsfw':
+                self._request('mark_nsfw', 'POST', '/mark_nsfw', {'internal_id': self.internal_id})
+                return True
+            case 'report':
+                self._request('report', 'POST', '/report', {'internal_id': self.internal_id})
+                return self.proceed()
+            case 'skip':
+                return self.proceed()
+            case 'sync':
+                # either shares its own token or continues from the progress of somebody else
+                if sync_tokens and self.rng.random() < 0.5:
+                    self._request('sync_data', 'POST', '/sync_data', {'token': self.rng.choice(sync_tokens)})
+                    return self.get_quote()
+
+                sync_tokens.append(self._request('sync_data', 'POST', '/sync_data').get_json()['token'])
+                return True
+
+
+def _install_stand_ins(use_mongomock: bool, use_fakeredis: bool):
+    # the clients are replaced before the modules of the site create theirs
+    if use_mongomock:
+        import pymongo
+
+        from stand_ins import serialized_mongomock_client
+
+        pymongo.MongoClient = serialized_mongomock_client
+
+    if use_fakeredis:
+        import fakeredis
+        import redis
+
+        # all the clients share the same data, their commands are not counted by the metrics though
+        server = fakeredis.FakeServer()
+        redis.from_url = lambda url, **kwargs: fakeredis.FakeRedis(server=server)
+
+
+def _use_load_database():
+    import db
+    import main
+    import vote_buffer
+
+    database = db.client[LOAD_DATABASE]
+
+    db.current_quotes_collection = vote_buffer.current_quotes_collection = database['current-quotes']
+    db.processed_quotes_collection = database['processed-quotes']
+    db.reported_quotes_collection = database['reported-quotes']
+
+    main.app.config['SESSION_REDIS'].flushdb()
+
+
+def seed_quotes(quotes_count: int, use_mongomock: bool, rng: random.Random):
+    import db
+
+    texts = []
+    for filename in sorted(DATA_DIR.glob('*.pkl')):
+        with open(filename, 'rb') as data_file:
+            texts.extend(pickle.load(data_file))
+
+    texts = list(dict.fromkeys(texts))[:quotes_count]
+
+    for collection in (db.current_quotes_collection, db.processed_quotes_collection, db.reported_quotes_collection):
+        collection.delete_many({})
+
+    db.current_quotes_collection.insert_many([
+        {'text': text, 'positive_votes': 0, 'negative_votes': 0, 'nsfw': db.NSFW_THRESHOLD if rng.random() < NSFW_SHARE else 0,
+         'channel_link': '', 'channel_name': '', 'content_hash': db.content_hash(text)} for text in texts])
+
+    if not use_mongomock:
+        from indexes import ensure_indexes
+
+        ensure_indexes()
+
+
+def _run_annotator(annotator: _Annotator, actions: int, sync_tokens: list[str]):
+    if not annotator.get_quote():
+        return
+
+    for _ in range(actions):
+        if not annotator.act(sync_tokens):
+            return
+
+
+def _print_report(recorder: _Recorder, elapsed_time: float, concurrency: str):
+    total_requests = sum(len(latencies) for latencies in recorder.latencies.values())
+    print(concurrency)
+    print(f'{"endpoint":<12}{"requests":>10}{"req/sec":>10}{"p50, ms":>10}{"p95, ms":>10}{"p99, ms":>10}{"errors":>8}')
+
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        print(f'{endpoint:<12}{len(latencies):>10}{len(latencies) / elapsed_time:>10.0f}{percentiles[49] * 1000:>10.2f}'
+              f'{percentiles[94] * 1000:>10.2f}{percentiles[98] * 1000:>10.2f}{recorder.errors[endpoint]:>8}')
+
+    print(f'{total_requests} requests in {elapsed_time:.2f} seconds ({total_requests / elapsed_time:.0f} requests/sec)')
+
+
+def run_benchmark(annotators: int, actions: int, quotes_count: int, use_mongomock: bool, use_fakeredis: bool, seed: int):
+    rng = random.Random(seed)
+    _install_stand_ins(use_mongomock, use_fakeredis)
+
+    import main
+    import vote_buffer
+
+    # the annotators and the flusher run concurrently on the stand-in too, but it executes their Mongo commands one at a time
+    concurrency = f'{annotators} concurrent annotators, ' + ('Mongo commands serialized by mongomock' if use_mongomock
+                                                             else 'Mongo commands in parallel')
+    if vote_buffer.WRITE_BEHIND:
+        concurrency += ', votes buffered in Redis'
+
+    _use_load_database()
+    seed_quotes(quotes_count, use_mongomock, rng)
+
+    recorder = _Recorder()
+    sync_tokens = []
+    simulated_annotators = [_Annotator(main.app, recorder, random.Random(seed + index)) for index in range(annotators)]
+
+    initial_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=annotators) as executor:
+        list(executor.map(lambda annotator: _run_annotator(annotator, actions, sync_tokens), simulated_annotators))
+
+    _print_report(recorder, time.perf_counter() - initial_time, concurrency)
+
+    if sum(recorder.errors.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the annotation flow with concurrent simulated annotators')
+    parser.add_argument('--annotators', type=int, default=32)
+    parser.add_argument('--actions', type=int, default=100, help='quotes every annotator goes through')
+    parser.add_argument('--quotes', type=int, default=5000, help='quotes seeded from ./data/*.pkl')
+    parser.add_argument('--mongomock', action='store_true',
+                        help='use an in-memory stand-in instead of `MONGO_URI`, which runs the Mongo commands one at a time')
+    parser.add_argument('--fakeredis', action='store_true', help='use an in-memory stand-in instead of `REDIS_ADDRESS`')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    run_benchmark(args.annotators, args.actions, args.quotes, args.mongomock, args.fakeredis, args.seed)
@@ -0,0 +1,120 @@
+import argparse
+import importlib.util
+import os
+import pickle
+import time
+from pathlib import Path
+from types import ModuleType
+
+# revisions of quotes.py older than the lazy profanity scorer load the checker on import otherwise
+os.environ.setdefault('PRODUCTION', '1')
+
+import quotes  # noqa: E402
+
+DATA_DIR = Path(__file__).parent.parent / 'data'
+DEFAULT_DATASET = DATA_DIR / 'funny_quotes.pkl'
+# the normalization `quotes.py` has to reproduce, see `test_quotes.py`
+REFERENCE_PATH = Path(__file__).parent / 'reference_quotes.py'
+BENCHMARKED_SOURCES = ('LetovoQuote', 'MyxaQuote', 'HSEQuote')
+
+
+def load_module(path: Path) -> ModuleType:
+    spec = importlib.util.spec_from_file_location(Path(path).stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def load_texts(dataset_path: Path) -> list[str]:
+    with open(dataset_path, 'rb') as dataset_file:
+        texts = pickle.load(dataset_file)
+
+    # the pickled quotes are already cleaned, so the author tag they were posted with is restored
+    return [f'{text}\n#Преподаватель' for text in texts]
+
+
+def tagged_variants(texts: list[str]) -> list[str]:
+    # tags at the start, in the middle and glued together, as they appear in the raw dumps
+    variants = []
+
+    for text in texts:
+        middle = text.find(' ', len(text) // 2)
+        variants.append(text)
+        variants.append(f'#ёлкин {text}')
+        variants.append(f'{text[:middle]} #Иванов_И.И.\t{text[middle:]}' if middle != -1 else f'{text}#a#b')
+        variants.append(f'  — {text}\n\n#Петров #ЁЖИК#мисс\n')
+
+    return variants
+
+
+def _normalize_or_none(quote_class: type, text: str) -> tuple[str, str] | None:
+    try:
+        quote = quote_class(text)
+    except AssertionError:
+        return None
+
+    return quote.text, quote.tags
+
+
+def mismatches(texts: list[str], baseline: ModuleType) -> list[tuple[str, str]]:
+    # the sources and texts that `quotes.py` normalizes (or rejects) unlike the baseline does
+    differences = []
+
+    for source in quotes.__all__:
+        quote_class = getattr(quotes, source)
+        if not isinstance(quote_class, type) or not hasattr(baseline, source):
+            continue
+
+        differences.extend((source, text) for text in texts
+                           if _normalize_or_none(quote_class, text) != _normalize_or_none(getattr(baseline, source), text))
+
+    return differences
+
+
+def _one_by_one(quote_class: type, texts: list[str]) -> int:
+    accepted = 0
+
+    for text in texts:
+        try:
+            quote_class(text)
+            accepted += 1
+        except AssertionError:
+            continue
+
+    return accepted
+
+
+def _measure(label: str, normalize, texts: list[str], repeats: int):
+    timings = []
+
+    for _ in range(repeats):
+        initial_time = time.perf_counter()
+        accepted = normalize(texts)
+        timings.append(time.perf_counter() - initial_time)
+
+    print(f'{label:<40} {len(texts) / min(timings):>12,.0f} quotes/sec ({accepted} accepted)')
+
+
+def run_benchmark(dataset_path: Path, baseline_path: Path, repeats: int):
+    texts = load_texts(dataset_path)
+    baseline = load_module(baseline_path)
+
+    for source in BENCHMARKED_SOURCES:
+        _measure(f'{source} (baseline)', lambda batch: _one_by_one(getattr(baseline, source), batch), texts, repeats)
+
+        quote_class = getattr(quotes, source)
+        _measure(f'{source}', lambda batch: _one_by_one(quote_class, batch), texts, repeats)
+        _measure(f'{source}.from_texts', lambda batch: len(quote_class.from_texts(batch)), texts, repeats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the quote normalization pipeline')
+    parser.add_argument('--dataset', type=Path, default=DEFAULT_DATASET)
+    parser.add_argument('--baseline', type=Path, default=REFERENCE_PATH,
+                        help='path to another revision of quotes.py to compare against, '
+                             'e.g. the output of `git show HEAD~1:quotes-dataset-markup/quotes.py`')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    run_benchmark(args.dataset, args.baseline, args.repeats)
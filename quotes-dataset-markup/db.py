@@ -1,19 +1,28 @@
-import os
+import ast
 import random
+import re
 from contextlib import suppress
+from hashlib import sha1
 from pathlib import Path
-from typing import Iterator
+from typing import Iterator, TextIO, TYPE_CHECKING
 
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from pymongo.errors import DuplicateKeyError
 
+from metrics import MongoCommandCounter, record_nsfw_skipped
+from quote_queries import (clamp_votes, content_hash_clash, duplicate_merge, MONGO_URI, next_position, NSFW_THRESHOLD,
+                           OBJECT_ID_LENGTH, position_query, position_quote_id, position_range_query, processed_insert,
+                           quote_position, QUOTES_ORDER, QuoteProcessedError, RANK_DIGITS, TOUCH, vote_increment, without_bookkeeping)
 from quotes import *
 
-__all__ = ['get_first_quote_id', 'get_quote_from_collection', 'add_reported_quote', 'apply_vote', 'apply_nsfw', 'client']
+if TYPE_CHECKING:
+    from near_duplicates import NearDuplicateIndex
 
-MONGO_CLUSTER_ADDRESS = os.getenv('MONGO_CLUSTER_ADDRESS')
-MONGO_ADMIN_PASSWORD = os.getenv('MONGO_ADMIN_PASSWORD')
+__all__ = ['SOURCE_MAPPING', 'content_hash', 'quote_document', 'drop_near_duplicates', 'iter_vk_dataset', 'get_first_quote_id',
+           'get_quote_from_collection', 'NSFW_THRESHOLD', 'QUOTES_ORDER', 'first_position', 'next_position', 'position_quote_id',
+           'get_quotes_batch', 'add_reported_quote', 'QuoteProcessedError', 'apply_vote', 'apply_nsfw',
+           'settle_quote', 'TOUCH', 'client']
 
 SOURCE_MAPPING = {
     'letovo': LetovoQuote,
@@ -32,60 +41,92 @@ SOURCE_MAPPING = {
     'msu': MSUQuote
 }
 
-VOTES_THRESHOLD = 3
+# the dumps are Python reprs of lists of strings
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^'\\\n]|\\.)*'" r'|"(?:[^"\\\n]|\\.)*"', re.DOTALL)
+LIST_SEPARATORS_PATTERN = re.compile(r'[\s\[\],]*')
+READ_CHUNK_SIZE = 1 << 16
 
 random.seed(42)
 
-client = MongoClient(f'mongodb+srv://admin:{MONGO_ADMIN_PASSWORD}@{MONGO_CLUSTER_ADDRESS}/')
+client = MongoClient(MONGO_URI, event_listeners=[MongoCommandCounter()])
 
 current_quotes_collection = client['quotes-dataset']['current-quotes']
 processed_quotes_collection = client['quotes-dataset']['processed-quotes']
 reported_quotes_collection = client['quotes-dataset']['reported-quotes']
 
 
-def load_homogeneous_dataset(source: str, quotes: list[GenericQuote]):
+def content_hash(text: str) -> str:
+    return sha1(text.encode('utf-8')).hexdigest()
+
+
+def quote_document(quote: GenericQuote, **fields) -> dict:
+    return {'text': quote.text, 'positive_votes': 0, 'negative_votes': 0, 'nsfw': 0, 'channel_link': quote.channel_link,
+            'channel_name': quote.channel_name, 'content_hash': content_hash(quote.text), **fields}
+
+
+def drop_near_duplicates(quotes: list[GenericQuote], index: 'NearDuplicateIndex') -> list[GenericQuote]:
+    # the quotes that are not near-duplicates of the indexed ones or of each other, they are added to the index
+    from near_duplicates import minhash_signatures  # numpy is only needed for the ingestion, not by the site
+
+    if not quotes:
+        return quotes
+
+    matches = index.add_new([content_hash(quote.text) for quote in quotes], minhash_signatures([quote.text for quote in quotes]))
+    return [quote for quote, match in zip(quotes, matches) if match is None]
+
+
+def load_homogeneous_dataset(source: str, quotes: list[GenericQuote], near_duplicate_index: 'NearDuplicateIndex | None' = None):
     source_class = SOURCE_MAPPING[source]
-    inserted_quotes = []
 
     for quote in quotes:
         if not isinstance(quote, source_class):
             raise ValueError(f'Found quote of {type(quote)} instead of the expected {source_class}')
 
-        inserted_quotes.append({'text': quote.text, 'positive_votes': 0, 'negative_votes': 0, 'channel_link': quote.channel_link,
-                                'channel_name': quote.channel_name})
+    load_dataset(quotes, near_duplicate_index)
 
-    current_quotes_collection.insert_many(inserted_quotes, ordered=False)
 
+def load_dataset(quotes: list[GenericQuote], near_duplicate_index: 'NearDuplicateIndex | None' = None):
+    if near_duplicate_index is not None:
+        quotes = drop_near_duplicates(quotes, near_duplicate_index)
 
-def load_dataset(quotes: list[GenericQuote]):
-    inserted_quotes = []
+    current_quotes_collection.insert_many([quote_document(quote) for quote in quotes], ordered=False)
 
-    for quote in quotes:
-        inserted_quotes.append({'text': quote.text, 'positive_votes': 0, 'negative_votes': 0, 'channel_link': quote.channel_link,
-                                'channel_name': quote.channel_name})
 
-    current_quotes_collection.insert_many(inserted_quotes, ordered=False)
+def _iter_string_literals(dataset_file: TextIO) -> Iterator[str]:
+    # reads the dump chunk by chunk and only ever evaluates string literals
+    buffer, position, exhausted = '', 0, False
 
+    while True:
+        position = LIST_SEPARATORS_PATTERN.match(buffer, position).end()
+        string_literal = STRING_LITERAL_PATTERN.match(buffer, position)
 
-def prepare_vk_dataset(dataset_filename: str, source: str) -> list[GenericQuote]:
-    vk_dataset = []
-    source_class = SOURCE_MAPPING[source]
+        if string_literal is not None:
+            yield ast.literal_eval(string_literal.group())
+            position = string_literal.end()
+            continue
+
+        if exhausted:
+            if position < len(buffer):
+                raise ValueError(f'Unexpected data in the dataset: {buffer[position:position + 50]!r}')
+            return
+
+        chunk = dataset_file.read(READ_CHUNK_SIZE)
+        exhausted = not chunk
+        buffer, position = buffer[position:] + chunk, 0
 
+
+def iter_vk_dataset(dataset_filename: str) -> Iterator[str]:
     with open(Path('./data') / dataset_filename, encoding='utf-8') as dataset_file:
-        quotes = eval(dataset_file.read())
+        yield from _iter_string_literals(dataset_file)
 
-    for quote_text in quotes:
-        try:
-            vk_dataset.append(source_class(quote_text))
-        except AssertionError:
-            # TODO: implement some logging
-            continue
 
-    return vk_dataset
+def prepare_vk_dataset(dataset_filename: str, source: str) -> list[GenericQuote]:
+    # the rejected quotes are logged by `normalize_texts`
+    return SOURCE_MAPPING[source].from_texts(iter_vk_dataset(dataset_filename))
 
 
 def get_first_quote_id() -> str:
-    return str(current_quotes_collection.find_one()['_id'])
+    return str(current_quotes_collection.find_one({}, {'_id': 1}, sort=[('_id', 1)])['_id'])
 
 
 def get_quote_from_collection(starting_point: str) -> Iterator[tuple[str, str, str, int, str]]:
@@ -93,81 +134,74 @@ def get_quote_from_collection(starting_point: str) -> Iterator[tuple[str, str, s
         yield quote['text'], quote['channel_name'], quote['channel_link'], quote['nsfw'], str(quote['_id'])
 
 
+def first_position() -> str:
+    if QUOTES_ORDER == 'uncertainty':
+        return '0' * (RANK_DIGITS + OBJECT_ID_LENGTH)
+
+    return get_first_quote_id()
+
+
+def get_quotes_batch(starting_point: str, limit: int, nsfw_threshold: int | None = None) -> list[tuple[str, str, str, int, str]]:
+    # quotes from the position `starting_point` onwards, each with its own position in place of the id
+    query, sort = position_query(starting_point)
+    if nsfw_threshold is not None:
+        query['nsfw'] = {'$lt': nsfw_threshold}
+
+    quotes = list(current_quotes_collection.find(query).sort(sort).limit(limit))
+
+    if nsfw_threshold is not None and quotes:
+        # the hidden quotes the filter has stepped over, counted on the index within the range that has just been served
+        hidden_query = {**position_range_query(starting_point, quote_position(quotes[-1])), 'nsfw': {'$gte': nsfw_threshold}}
+        record_nsfw_skipped(current_quotes_collection.count_documents(hidden_query))
+
+    return [(quote['text'], quote['channel_name'], quote['channel_link'], quote['nsfw'], quote_position(quote)) for quote in quotes]
+
+
 def add_reported_quote(internal_id: str):
     reported_quote = current_quotes_collection.find_one({'_id': ObjectId(internal_id)})
 
+    if reported_quote is None:
+        return
+
     with suppress(DuplicateKeyError):
-        reported_quotes_collection.insert_one(reported_quote)
+        reported_quotes_collection.update_one({'_id': reported_quote['_id']},
+                                              {'$setOnInsert': without_bookkeeping(reported_quote), **TOUCH}, upsert=True)
 
 
 def apply_nsfw(internal_id: str):
-    current_quotes_collection.update_one({'_id': ObjectId(internal_id)}, {'$inc': {'nsfw': 1}})
+    current_quotes_collection.update_one({'_id': ObjectId(internal_id)}, {'$inc': {'nsfw': 1}, **TOUCH})
+
+
+def _finalize_quote(current_quote: dict):
+    # the first finalizing voter inserts the quote, concurrent ones leave it as is,
+    # so the move can be safely repeated by everyone who has crossed the threshold
+    try:
+        processed_quotes_collection.update_one({'_id': current_quote['_id']}, processed_insert(current_quote), upsert=True)
+    except DuplicateKeyError as error:
+        if content_hash_clash(error):
+            processed_quotes_collection.update_one(*duplicate_merge(current_quote))
+
+    current_quotes_collection.delete_one({'_id': current_quote['_id']})
 
 
 def apply_vote(vote: str, internal_id: str) -> bool:
-    # TODO: handle cases when entry is not found
     internal_id = ObjectId(internal_id)
+    increment = vote_increment(vote)
 
-    match vote:
-        case 'positive':
-            current_quotes_collection.update_one({'_id': internal_id}, {'$inc': {'positive_votes': 1}})
-        case 'negative':
-            current_quotes_collection.update_one({'_id': internal_id}, {'$inc': {'negative_votes': 1}})
-        case _:
-            raise ValueError(f'Unknown vote type: {vote}')
+    current_quote = current_quotes_collection.find_one_and_update({'_id': internal_id}, {'$inc': increment, **TOUCH},
+                                                                  return_document=ReturnDocument.AFTER)
 
-    current_quote = current_quotes_collection.find_one({'_id': internal_id})
+    if current_quote is None:
+        # the quote has already been processed by other voters, the vote is not counted
+        raise QuoteProcessedError(f'Quote {internal_id} has already been processed')
 
-    if current_quote['positive_votes'] > VOTES_THRESHOLD // 2:  # assuming that VOTES_THRESHOLD is an odd number
-        current_quote['positive_votes'] = VOTES_THRESHOLD - current_quote['negative_votes']
+    return settle_quote(current_quote)
 
-    if current_quote['negative_votes'] > VOTES_THRESHOLD // 2:
-        current_quote['negative_votes'] = VOTES_THRESHOLD - current_quote['positive_votes']
 
-    votes = current_quote['positive_votes'] + current_quote['negative_votes']
-    if votes >= VOTES_THRESHOLD:
-        current_quotes_collection.delete_one({'_id': internal_id})
-        processed_quotes_collection.insert_one(current_quote)
+def settle_quote(current_quote: dict) -> bool:
+    if clamp_votes(current_quote):
+        _finalize_quote(current_quote)
         return False
 
     return True
 
-
-if __name__ == '__main__':
-    # TODO: implement tests
-
-    dataset = []
-
-    with open('data/letovo_quotes.json', encoding='utf-8') as data_file:
-        letovo_quotes = json.load(data_file)
-
-    for quote_object in letovo_quotes:
-        try:
-            dataset.append(LetovoQuote(quote_object['text']))
-        except AssertionError:
-            continue
-
-    dataset += prepare_vk_dataset('citatnik_myxa.txt', 'myxa')
-    dataset += prepare_vk_dataset('hseteachers.txt', 'hse')
-    dataset += prepare_vk_dataset('fefu_quotes.txt', 'fefu')
-    dataset += prepare_vk_dataset('glagolit_ksu.txt', 'ksu')
-    dataset += prepare_vk_dataset('isu_quotes.txt', 'isu')
-    dataset += prepare_vk_dataset('mgtupage.txt', 'mgtu')
-    dataset += prepare_vk_dataset('prepod_mipt.txt', 'mipt')
-    dataset += prepare_vk_dataset('public80867350.txt', 'sgu')
-    dataset += prepare_vk_dataset('public170539958.txt', 'vkletovo')
-    dataset += prepare_vk_dataset('quotes_nstu.txt', 'nstu')
-    dataset += prepare_vk_dataset('sfeduquotes.txt', 'sfedu')
-    dataset += prepare_vk_dataset('urfusay.txt', 'urfu')
-    dataset += prepare_vk_dataset('ustami_msu.txt', 'msu')
-
-    expletive_quotes = search_profanity(dataset, exclude=False)
-    expletive_documents = [{'text': quote.text, 'positive_votes': 0, 'negative_votes': 5, 'nsfw': 5} for quote in expletive_quotes]
-    # processed_quotes_collection.insert_many(expletive_documents)
-
-    # dataset = search_profanity(dataset, exclude=True)
-
-    # random.shuffle(dataset)
-    # load_dataset(dataset)
-
-    ...
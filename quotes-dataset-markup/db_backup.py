@@ -1,11 +1,14 @@
+import argparse
+import gzip
 import json
 import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, UTC
 from hashlib import md5
 from pathlib import Path
-from typing import Iterable
+from typing import BinaryIO, Iterable
 
 import boto3
 from boto3.s3.transfer import TransferConfig
@@ -22,57 +25,124 @@ processed_quotes_collection = client['quotes-dataset']['processed-quotes']
 reported_quotes_collection = client['quotes-dataset']['reported-quotes']
 
 COLLECTIONS = {'current': current_quotes_collection, 'processed': processed_quotes_collection, 'reported': reported_quotes_collection}
-BUCKET_NAME = 'quotes-dataset-backup'
+# an increment only holds the upserted documents, so a collection that loses documents (every finalized quote is removed from
+# the current ones) could not be restored from a full backup and its increments, it is always backed up in full
+INCREMENTAL_COLLECTIONS = ('processed', 'reported')
+backup_state_collection = client['quotes-dataset']['backup-state']
+BUCKET_NAME = os.getenv('BACKUP_BUCKET_NAME', 'quotes-dataset-backup')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', 'https://storage.yandexcloud.net')
 
 session = boto3.session.Session()
 s3 = session.client(
     service_name='s3',
-    endpoint_url='https://storage.yandexcloud.net'
+    endpoint_url=S3_ENDPOINT_URL
 )
 
 MB = 1024 ** 2
 transfer_config = TransferConfig(multipart_threshold=100 * MB)
 
+EXPORT_BATCH_SIZE = 1000
+DELETE_BATCH_SIZE = 1000  # limit of a single `delete_objects` request
+S3_WORKERS = 8
 
-def _create_local_backup(collection: str, filename: str):
-    with open(filename, 'w', encoding='utf-8') as backup_file:
-        json.dump(json.loads(dumps(COLLECTIONS[collection].find(), ensure_ascii=False)), backup_file, ensure_ascii=False)
 
+class _HashingWriter:
+    # sits between the compressor and the file, so the md5 of the uploaded object is known without re-reading it
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.md5 = md5()
 
-def _get_last_collection_file(collection_name: str) -> str | None:
-    bucket_objects = s3.list_objects_v2(Bucket=BUCKET_NAME)['Contents']
-    bucket_objects.sort(key=lambda content: content['LastModified'], reverse=True)
+    def write(self, data: bytes) -> int:
+        self.md5.update(data)
+        return self.file.write(data)
 
-    for key in bucket_objects:
-        if key['Key'].startswith(f'backups/{collection_name}'):
-            return key['Key']
+    def flush(self):
+        self.file.flush()
+
+
+def _write_ndjson(filename: str, documents: Iterable[dict]) -> tuple[str, int]:
+    documents_count = 0
+
+    with open(filename, 'wb') as raw_file:
+        hashing_writer = _HashingWriter(raw_file)
+
+        # fixed mtime and empty name keep the archive byte-identical for identical contents
+        with gzip.GzipFile(filename='', mode='wb', fileobj=hashing_writer, mtime=0) as backup_file:
+            for document in documents:
+                backup_file.write(dumps(document, ensure_ascii=False).encode('utf-8'))
+                backup_file.write(b'\n')
+                documents_count += 1
+
+    return hashing_writer.md5.hexdigest(), documents_count
+
+
+def _get_high_water_mark(collection_name: str, day: str) -> dict | None:
+    # increments are only chained within a day, since older backups are cleared anyway
+    return backup_state_collection.find_one({'_id': collection_name, 'day': day})
+
+
+def _save_high_water_mark(collection_name: str, day: str, high_water_mark: dict):
+    backup_state_collection.update_one({'_id': collection_name}, {'$set': {'day': day, **high_water_mark}}, upsert=True)
+
+
+def _create_local_backup(collection_name: str, filename: str, high_water_mark: dict | None = None) -> tuple[str, int, dict]:
+    collection = COLLECTIONS[collection_name]
+    # the server time before the export, so that the documents modified while it runs are exported by the next increment
+    # (the writes stamp `updated_at` with the server clock too)
+    started_at = client.admin.command('hello')['localTime']
+    query = {}
+
+    # without a `last_id` the collection was empty at the time of the previous backup, so every document is a new one
+    if high_water_mark is not None and high_water_mark['last_id'] is not None:
+        query = {'$or': [{'_id': {'$gt': high_water_mark['last_id']}}]}
+
+        # documents modified at the very moment of the previous backup are exported once again, which is harmless
+        if high_water_mark['last_update'] is not None:
+            query['$or'].append({'updated_at': {'$gte': high_water_mark['last_update']}})
+
+    last_id = high_water_mark['last_id'] if high_water_mark is not None else None
+
+    def tracked_documents():
+        nonlocal last_id
 
+        for document in collection.find(query).sort('_id').batch_size(EXPORT_BATCH_SIZE):
+            last_id = document['_id'] if last_id is None else max(last_id, document['_id'])
 
-def _get_local_md5(filename: str) -> str:
-    file_md5 = md5()
+            yield document
 
-    with open(filename, 'rb') as file:
-        file_md5.update(file.read())
+    file_md5, documents_count = _write_ndjson(filename, tracked_documents())
 
-    return file_md5.hexdigest()
+    # a mark is saved for an empty collection as well, so that the next backup of the day is an increment
+    return file_md5, documents_count, {'last_id': last_id, 'last_update': started_at}
 
 
-def _get_remote_md5(filename: str) -> str:
-    key = s3.get_object(Bucket=BUCKET_NAME, Key=filename)
+def _list_remote_backups() -> list[dict]:
+    paginator = s3.get_paginator('list_objects_v2')
 
-    return key['ETag'][1:-1]
+    return [content for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix='backups/') for content in page.get('Contents', [])]
 
 
-def _write_duplicate_message(filename: str):
-    duplicate_message = {'message': 'Current backup is the exact copy of the previous one', 'md5': _get_local_md5(filename)}
+def _get_last_collection_file(bucket_objects: list[dict], collection_name: str, backup_type: str) -> dict | None:
+    # a full backup is only compared with full backups and an increment with increments
+    collection_prefix = f'backups/{collection_name}_collection_{backup_type}-'
+    collection_objects = [content for content in bucket_objects if content['Key'].startswith(collection_prefix)]
 
-    with open(filename, 'w', encoding='utf-8') as duplicate_backup_file:
-        json.dump(duplicate_message, duplicate_backup_file)
+    return max(collection_objects, key=lambda content: content['LastModified'], default=None)
+
+
+def _write_duplicate_message(filename: str, file_md5: str):
+    duplicate_message = {'message': 'Current backup is the exact copy of the previous one', 'md5': file_md5}
+
+    _write_ndjson(filename, [duplicate_message])
+
+
+def _upload_file(filename: str):
+    s3.upload_file(filename, BUCKET_NAME, filename, Config=transfer_config)
 
 
 def _upload_files(filenames: Iterable[str]):
-    for filename in filenames:
-        s3.upload_file(filename, BUCKET_NAME, filename, Config=transfer_config)
+    with ThreadPoolExecutor(max_workers=S3_WORKERS) as executor:
+        list(executor.map(_upload_file, filenames))
 
 
 def _clear_local_backups():
@@ -80,42 +150,83 @@ def _clear_local_backups():
         file.unlink()
 
 
-def _clear_outdated_remote_backups():
-    filename_pattern = re.compile(r'backups/\w+-(\d{2}-\w{3})-\d{2}-\d{2}\.json')
+def _delete_remote_files(keys: list[str]):
+    s3.delete_objects(Bucket=BUCKET_NAME, Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+
+
+def _clear_outdated_remote_backups(bucket_objects: list[dict]):
+    # the seconds are optional, the older backups were named up to the minute
+    filename_pattern = re.compile(r'backups/\w+-(\d{2}-\w{3})-\d{2}-\d{2}(?:-\d{2})?\.(?:json|ndjson\.gz)')
     today = datetime.now(UTC).strftime('%d-%b')
 
-    bucket_objects = s3.list_objects_v2(Bucket=BUCKET_NAME)['Contents']
+    outdated_keys = []
     for key in bucket_objects:
-        date = re.match(filename_pattern, key['Key']).group(1)
-        if date != today:
-            s3.delete_object(Bucket=BUCKET_NAME, Key=key['Key'])
+        filename_match = re.match(filename_pattern, key['Key'])
+        if filename_match is not None and filename_match.group(1) != today:
+            outdated_keys.append(key['Key'])
+
+    batches = [outdated_keys[start:start + DELETE_BATCH_SIZE] for start in range(0, len(outdated_keys), DELETE_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=S3_WORKERS) as executor:
+        list(executor.map(_delete_remote_files, batches))
 
 
-def create_backup():
+def create_backup(incremental: bool = False) -> dict:
     initial_time = time.perf_counter()
 
-    formatted_date = datetime.now(UTC).strftime('%d-%b-%H-%M')
-    collection_filename = {collection_name: f'backups/{collection_name}_collection_backup-{formatted_date}.json'
-                           for collection_name in COLLECTIONS.keys()}
+    now = datetime.now(UTC)
+    # with the seconds, so that two backups started within the same minute do not overwrite each other
+    formatted_date, day = now.strftime('%d-%b-%H-%M-%S'), now.strftime('%d-%b')
+    collection_backup_type = {}
+    collection_filename = {}
+    collection_md5 = {}
+    collection_high_water_mark = {}
+    collection_metrics = {}
 
     for collection_name in COLLECTIONS.keys():
-        _create_local_backup(collection_name, collection_filename[collection_name])
+        # the first backup of the day is always a full one, the following ones only contain the changes since the previous one
+        incremental_collection = incremental and collection_name in INCREMENTAL_COLLECTIONS
+        high_water_mark = _get_high_water_mark(collection_name, day) if incremental_collection else None
+        backup_type = 'backup' if high_water_mark is None else 'increment'
+        local_filename = f'backups/{collection_name}_collection_{backup_type}-{formatted_date}.ndjson.gz'
+
+        file_md5, documents_count, new_high_water_mark = _create_local_backup(collection_name, local_filename, high_water_mark)
+
+        collection_backup_type[collection_name] = backup_type
+        collection_filename[collection_name] = local_filename
+        collection_md5[collection_name] = file_md5
+        collection_high_water_mark[collection_name] = new_high_water_mark
+        collection_metrics[collection_name] = {'incremental': high_water_mark is not None, 'documents': documents_count,
+                                               'bytes': os.path.getsize(local_filename)}
+
+    # the listing already carries the ETags, there is no need to request them (or the objects themselves) one by one;
+    # ETags of multipart uploads are not md5 sums, so such backups are never considered duplicates
+    bucket_objects = _list_remote_backups()
 
     for collection_name in COLLECTIONS.keys():
-        representative_filename = _get_last_collection_file(collection_name)
-        assert representative_filename is not None
-        local_filename = collection_filename[collection_name]
+        representative_file = _get_last_collection_file(bucket_objects, collection_name, collection_backup_type[collection_name])
+        if representative_file is None:
+            continue
 
-        if _get_local_md5(local_filename) == _get_remote_md5(representative_filename):
-            _write_duplicate_message(local_filename)
+        if collection_md5[collection_name] == representative_file['ETag'][1:-1]:
+            _write_duplicate_message(collection_filename[collection_name], collection_md5[collection_name])
 
     _upload_files(collection_filename.values())
+
+    # the marks are only moved once the backups have been uploaded
+    for collection_name, high_water_mark in collection_high_water_mark.items():
+        _save_high_water_mark(collection_name, day, high_water_mark)
+
     _clear_local_backups()
-    _clear_outdated_remote_backups()
+    _clear_outdated_remote_backups(bucket_objects)
 
     final_time = time.perf_counter()
-    print(f'Procedure of backup took {final_time - initial_time:.2f} seconds')
+
+    return {'started_at': now.timestamp(), 'duration_seconds': final_time - initial_time, 'collections': collection_metrics}
 
 
 if __name__ == '__main__':
-    create_backup()
+    parser = argparse.ArgumentParser(description='Back up the quotes collections to the object storage')
+    parser.add_argument('--incremental', action='store_true', help='only export documents changed since the previous backup')
+    args = parser.parse_args()
+
+    print(json.dumps(create_backup(incremental=args.incremental), indent=2))
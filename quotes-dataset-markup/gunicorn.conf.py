@@ -0,0 +1,27 @@
+import os
+import shutil
+
+# read by gunicorn from the working directory, the command line options are in the Procfile
+
+# has to be set before the workers import `prometheus_client`, see `metrics.py`
+METRICS_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/markup-metrics')
+
+# `SERVING_MODE=async` serves the asyncio app of `asgi.py` with uvicorn workers instead of the WSGI app of `main.py`,
+# every worker then handles its requests concurrently on a single thread (`--threads` is ignored)
+if os.getenv('SERVING_MODE') == 'async':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'main:app'
+
+
+def on_starting(server):
+    # samples of the previous run would be merged into the new ones otherwise
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
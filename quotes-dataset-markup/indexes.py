@@ -0,0 +1,126 @@
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from pymongo.collection import Collection
+
+from db import current_quotes_collection, NSFW_THRESHOLD, processed_quotes_collection, reported_quotes_collection, TOUCH
+
+__all__ = ['merge_duplicates', 'merge_duplicate_hashes', 'ensure_indexes', 'audit_query_plans']
+
+HASHED_COLLECTIONS = (current_quotes_collection, processed_quotes_collection, reported_quotes_collection)
+CONTENT_HASH_INDEX = 'content_hash_1'
+COUNTED_FIELDS = ('positive_votes', 'negative_votes', 'nsfw')
+
+
+def merge_duplicates(collection: Collection, kept_id: ObjectId, duplicate_ids: list[ObjectId]):
+    # the duplicates are removed and their votes and NSFW marks are added to the kept document
+    duplicates = list(collection.find({'_id': {'$in': duplicate_ids}}, dict.fromkeys(COUNTED_FIELDS, 1)))
+    increment = {field: sum(duplicate.get(field, 0) for duplicate in duplicates) for field in COUNTED_FIELDS}
+
+    collection.update_one({'_id': kept_id}, {'$inc': increment, **TOUCH})
+    collection.delete_many({'_id': {'$in': duplicate_ids}})
+
+
+def merge_duplicate_hashes(collection: Collection) -> int:
+    # documents stored before the hashes were unique may share one, the oldest of them is kept
+    duplicate_groups = collection.aggregate([{'$match': {'content_hash': {'$exists': True}}},
+                                             {'$group': {'_id': '$content_hash', 'ids': {'$push': '$_id'}}},
+                                             {'$match': {'ids.1': {'$exists': True}}}], allowDiskUse=True)
+
+    merged_count = 0
+    for duplicate_group in duplicate_groups:
+        kept_id, *duplicate_ids = sorted(duplicate_group['ids'])
+        merge_duplicates(collection, kept_id, duplicate_ids)
+
+        print(f'{collection.name}: merged {", ".join(map(str, duplicate_ids))} into {kept_id} ({duplicate_group["_id"]})')
+        merged_count += len(duplicate_ids)
+
+    return merged_count
+
+
+def ensure_indexes():
+    # `create_index` does nothing for the indexes that already exist, so this runs on every release
+    # feeds with the NSFW filter walk an index that only holds the clean quotes, already in `_id` order
+    current_quotes_collection.create_index([('_id', ASCENDING), ('nsfw', ASCENDING)], name='feed_nsfw_filtered',
+                                           partialFilterExpression={'nsfw': {'$lt': NSFW_THRESHOLD}})
+    # the uncertainty order, `nsfw` is included so that the filtered feed does not fetch the hidden quotes
+    current_quotes_collection.create_index([('serving_rank', ASCENDING), ('_id', ASCENDING), ('nsfw', ASCENDING)])
+    # the quotes `quotes-ml/uncertainty.py` has not scored with the current model yet
+    current_quotes_collection.create_index('scored_by')
+
+    for collection in HASHED_COLLECTIONS:
+        # otherwise the unique index cannot be built, once it exists no new duplicates can appear
+        if CONTENT_HASH_INDEX not in collection.index_information():
+            merge_duplicate_hashes(collection)
+
+        # documents inserted before the hashes were introduced do not have one, hence the partial indexes
+        collection.create_index('content_hash', unique=True, partialFilterExpression={'content_hash': {'$exists': True}})
+        # incremental backups and the export of the annotated quotes
+        collection.create_index('updated_at')
+
+
+def _hot_queries() -> dict[str, tuple]:
+    # the queries run on every request or by every worker pass, with arbitrary but valid values
+    some_id = ObjectId()
+    uncertainty_query = {'$or': [{'serving_rank': 0, '_id': {'$gte': some_id}}, {'serving_rank': {'$gt': 0}}]}
+    since = datetime.now(timezone.utc)
+
+    return {
+        'first quote': (current_quotes_collection, {}, [('_id', ASCENDING)], 1),
+        'feed': (current_quotes_collection, {'_id': {'$gte': some_id}}, [('_id', ASCENDING)], 20),
+        'feed, NSFW filter': (current_quotes_collection, {'_id': {'$gte': some_id}, 'nsfw': {'$lt': NSFW_THRESHOLD}},
+                              [('_id', ASCENDING)], 20),
+        'uncertainty feed': (current_quotes_collection, uncertainty_query, [('serving_rank', ASCENDING), ('_id', ASCENDING)], 20),
+        'uncertainty feed, NSFW filter': (current_quotes_collection, {**uncertainty_query, 'nsfw': {'$lt': NSFW_THRESHOLD}},
+                                          [('serving_rank', ASCENDING), ('_id', ASCENDING)], 20),
+        'unscored quotes': (current_quotes_collection, {'scored_by': {'$ne': '0' * 12}}, None, 256),
+        'skipped NSFW quotes': (current_quotes_collection,
+                                {'_id': {'$gte': some_id, '$lte': some_id}, 'nsfw': {'$gte': NSFW_THRESHOLD}}, None, 0),
+        'vote': (current_quotes_collection, {'_id': some_id}, None, 0),
+        'flushed votes': (current_quotes_collection, {'_id': {'$in': [some_id]}}, None, 0),
+        'report': (reported_quotes_collection, {'_id': some_id}, None, 0),
+        'duplicates, current': (current_quotes_collection, {'content_hash': {'$in': ['0' * 40]}}, None, 0),
+        'duplicates, processed': (processed_quotes_collection, {'content_hash': {'$in': ['0' * 40]}}, None, 0),
+        'duplicates, reported': (reported_quotes_collection, {'content_hash': {'$in': ['0' * 40]}}, None, 0),
+        'incremental backup': (processed_quotes_collection, {'$or': [{'_id': {'$gt': some_id}}, {'updated_at': {'$gte': since}}]},
+                               [('_id', ASCENDING)], 0)
+    }
+
+
+def _plan_stages(plan) -> set[str]:
+    # the layout of the plans differs between the server versions, so every nested stage is collected
+    if isinstance(plan, list):
+        return set().union(*map(_plan_stages, plan)) if plan else set()
+
+    if not isinstance(plan, dict):
+        return set()
+
+    stages = {plan['stage']} if isinstance(plan.get('stage'), str) else set()
+    return stages.union(*map(_plan_stages, plan.values()))
+
+
+def audit_query_plans() -> list[str]:
+    # names of the hot queries that would scan a whole collection
+    collection_scans = []
+
+    for name, (collection, query, sort, limit) in _hot_queries().items():
+        cursor = collection.find(query)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+
+        stages = _plan_stages(cursor.limit(limit).explain()['queryPlanner']['winningPlan'])
+        print(f'{name:<32} {", ".join(sorted(stages))}')
+
+        if 'COLLSCAN' in stages:
+            collection_scans.append(name)
+
+    return collection_scans
+
+
+if __name__ == '__main__':
+    ensure_indexes()
+
+    if collection_scans := audit_query_plans():
+        raise SystemExit(f'Collection scans in: {", ".join(collection_scans)}')
@@ -0,0 +1,236 @@
+import argparse
+import logging
+import os
+import random
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import batched, cycle
+from pathlib import Path
+from typing import Iterator
+
+import ijson
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from db import content_hash, current_quotes_collection, drop_near_duplicates, iter_vk_dataset, processed_quotes_collection, \
+    quote_document, reported_quotes_collection, SOURCE_MAPPING
+from indexes import ensure_indexes, merge_duplicates
+from near_duplicates import INDEX_PATH, minhash_signatures, NearDuplicateIndex
+from profanity import nsfw_seed, PROFANITY_THRESHOLD
+from quotes import normalize_texts, score_profanity
+
+SOURCE_FILES = {
+    'letovo': 'letovo_quotes.json',
+    'myxa': 'citatnik_myxa.txt',
+    'hse': 'hseteachers.txt',
+    'fefu': 'fefu_quotes.txt',
+    'ksu': 'glagolit_ksu.txt',
+    'isu': 'isu_quotes.txt',
+    'mgtu': 'mgtupage.txt',
+    'mipt': 'prepod_mipt.txt',
+    'sgu': 'public80867350.txt',
+    'vkletovo': 'public170539958.txt',
+    'nstu': 'quotes_nstu.txt',
+    'sfedu': 'sfeduquotes.txt',
+    'urfu': 'urfusay.txt',
+    'msu': 'ustami_msu.txt'
+}
+
+EXPLETIVE_VOTES = 5
+HASH_BACKFILL_BATCH_SIZE = 1000
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _iter_source_texts(source: str) -> Iterator[str]:
+    if source == 'letovo':
+        # the export is a single JSON array, it is parsed as it is read instead of being loaded at once
+        with open(Path('./data') / SOURCE_FILES[source], 'rb') as data_file:
+            yield from ijson.items(data_file, 'item.text')
+    else:
+        yield from iter_vk_dataset(SOURCE_FILES[source])
+
+
+def _interleave(sources: list[str], batch_size: int) -> Iterator[tuple[str, tuple[str, ...]]]:
+    # quotes are served in insertion order, so the sources are mixed instead of being loaded one after another
+    streams = {source: batched(_iter_source_texts(source), batch_size) for source in sources}
+
+    for source in cycle(sources):
+        if not streams:
+            return
+
+        if source not in streams:
+            continue
+
+        batch = next(streams[source], None)
+        if batch is None:
+            del streams[source]
+            continue
+
+        yield source, batch
+
+
+def _backfill_hashes(collection: Collection, hashes: dict[ObjectId, str]):
+    try:
+        collection.bulk_write([UpdateOne({'_id': document_id}, {'$set': {'content_hash': document_hash}})
+                               for document_id, document_hash in hashes.items()], ordered=False)
+    except BulkWriteError as error:
+        if any(write_error['code'] != DUPLICATE_KEY_ERROR for write_error in error.details['writeErrors']):
+            raise
+
+        # once the unique index exists, a text that is already stored under another hashed document is merged into it
+        for write_error in error.details['writeErrors']:
+            duplicate_id = write_error['op']['q']['_id']
+            kept_document = collection.find_one({'content_hash': hashes[duplicate_id]}, {'_id': 1})
+            merge_duplicates(collection, kept_document['_id'], [duplicate_id])
+
+
+def prepare_collections():
+    # documents inserted before the hashes were introduced get one, so that they are deduplicated against as well
+    for collection in (current_quotes_collection, processed_quotes_collection, reported_quotes_collection):
+        missing_hashes = collection.find({'content_hash': {'$exists': False}}, {'text': 1})
+
+        for documents in batched(missing_hashes, HASH_BACKFILL_BATCH_SIZE):
+            _backfill_hashes(collection, {document['_id']: content_hash(document['text']) for document in documents})
+
+    ensure_indexes()
+
+
+def load_near_duplicate_index() -> NearDuplicateIndex:
+    index = NearDuplicateIndex.load() if INDEX_PATH.exists() else NearDuplicateIndex()
+
+    # quotes stored before the index was introduced, or by runs that have not saved it, are indexed as they are
+    missing_hashes = set()
+    for collection in (current_quotes_collection, processed_quotes_collection, reported_quotes_collection):
+        missing_hashes.update(document['content_hash'] for document in collection.find({}, {'content_hash': 1, '_id': 0})
+                              if document['content_hash'] not in index)
+
+    for collection in (current_quotes_collection, processed_quotes_collection, reported_quotes_collection):
+        for hashes in batched(sorted(missing_hashes), HASH_BACKFILL_BATCH_SIZE):
+            documents = [document for document in collection.find({'content_hash': {'$in': hashes}}, {'content_hash': 1, 'text': 1})
+                         if document['content_hash'] not in index]
+            if documents:
+                index.add([document['content_hash'] for document in documents],
+                          minhash_signatures([document['text'] for document in documents]))
+
+    return index
+
+
+def _known_hashes(hashes: list[str]) -> set[str]:
+    known_hashes = set()
+
+    for collection in (current_quotes_collection, processed_quotes_collection, reported_quotes_collection):
+        known_hashes.update(document['content_hash']
+                            for document in collection.find({'content_hash': {'$in': hashes}}, {'content_hash': 1, '_id': 0}))
+
+    return known_hashes
+
+
+def _insert_documents(collection, documents: list[dict]) -> int:
+    if not documents:
+        return 0
+
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as error:
+        # quotes inserted concurrently by another run are reported as duplicate keys
+        return error.details['nInserted']
+
+
+def _store_batch(source: str, raw_count: int, normalized_future: Future, check_profanity: bool,
+                 near_duplicate_index: NearDuplicateIndex | None, statistics: Counter):
+    source_class = SOURCE_MAPPING[source]
+    quotes = [source_class.from_normalized(*normalized_text) for normalized_text in normalized_future.result()
+              if normalized_text is not None]
+
+    statistics[f'{source}.read'] += raw_count
+    statistics[f'{source}.rejected'] += raw_count - len(quotes)
+
+    unique_quotes = {content_hash(quote.text): quote for quote in quotes}
+    known_hashes = _known_hashes(list(unique_quotes.keys()))
+    new_quotes = [quote for quote_hash, quote in unique_quotes.items() if quote_hash not in known_hashes]
+    random.shuffle(new_quotes)
+
+    statistics[f'{source}.duplicate'] += len(quotes) - len(new_quotes)
+
+    if near_duplicate_index is not None:
+        # the same quote reposted by another source, with other punctuation or a slightly different wording
+        distinct_quotes = drop_near_duplicates(new_quotes, near_duplicate_index)
+        statistics[f'{source}.near_duplicate'] += len(new_quotes) - len(distinct_quotes)
+        new_quotes = distinct_quotes
+
+    scores = score_profanity(new_quotes) if check_profanity else [0.0] * len(new_quotes)
+
+    expletive_documents, clean_documents = [], []
+    for quote, score in zip(new_quotes, scores):
+        if score >= PROFANITY_THRESHOLD:
+            nsfw = nsfw_seed(score, EXPLETIVE_VOTES)
+            expletive_documents.append(quote_document(quote, negative_votes=EXPLETIVE_VOTES, nsfw=nsfw, profanity=score))
+        else:
+            clean_documents.append(quote_document(quote, profanity=score))
+
+    statistics[f'{source}.expletive'] += _insert_documents(processed_quotes_collection, expletive_documents)
+    statistics[f'{source}.accepted'] += _insert_documents(current_quotes_collection, clean_documents)
+
+
+def _configure_logging():
+    # the quotes rejected by the normalization are logged in the worker processes
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+
+def ingest(sources: list[str], batch_size: int, workers: int, check_profanity: bool, check_near_duplicates: bool) -> Counter:
+    prepare_collections()
+    near_duplicate_index = load_near_duplicate_index() if check_near_duplicates else None
+    statistics = Counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_configure_logging) as executor:
+        # at most a couple of batches per worker are in flight, so memory use does not depend on the size of the dumps
+        pending = deque()
+
+        for source, texts in _interleave(sources, batch_size):
+            pending.append((source, len(texts), executor.submit(normalize_texts, texts, SOURCE_MAPPING[source].steps)))
+
+            if len(pending) >= 2 * workers:
+                _store_batch(*pending.popleft(), check_profanity, near_duplicate_index, statistics)
+
+        while pending:
+            _store_batch(*pending.popleft(), check_profanity, near_duplicate_index, statistics)
+
+    if near_duplicate_index is not None:
+        near_duplicate_index.save()
+
+    return statistics
+
+
+def _print_report(sources: list[str], statistics: Counter, elapsed_time: float):
+    columns = ('read', 'accepted', 'rejected', 'duplicate', 'near_duplicate', 'expletive')
+    print(f'{"source":<10}' + ''.join(f'{column:>15}' for column in columns))
+
+    for source in sources:
+        print(f'{source:<10}' + ''.join(f'{statistics[f"{source}.{column}"]:>15}' for column in columns))
+
+    total_read = sum(statistics[f'{source}.read'] for source in sources)
+    print(f'Ingested {total_read} quotes in {elapsed_time:.2f} seconds ({total_read / elapsed_time:.0f} quotes/sec)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the raw quote dumps from ./data into the markup collections')
+    parser.add_argument('sources', nargs='*', help=f'sources to ingest, all of them by default ({", ".join(SOURCE_FILES)})')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--skip-profanity', action='store_true', help='do not move expletive quotes out of the markup')
+    parser.add_argument('--keep-near-duplicates', action='store_true', help='only drop the exact duplicates')
+    args = parser.parse_args()
+
+    if unknown_sources := set(args.sources) - SOURCE_FILES.keys():
+        parser.error(f'unknown sources: {", ".join(sorted(unknown_sources))}')
+
+    args.sources = args.sources or list(SOURCE_FILES.keys())
+    _configure_logging()
+
+    initial_time = time.perf_counter()
+    ingestion_statistics = ingest(args.sources, args.batch_size, args.workers, not args.skip_profanity,
+                                  not args.keep_near_duplicates)
+    _print_report(args.sources, ingestion_statistics, time.perf_counter() - initial_time)
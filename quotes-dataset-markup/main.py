@@ -1,18 +1,25 @@
 import os
-import secrets
-import time
-from functools import wraps
-from threading import Thread
+from datetime import timedelta
 
-import msgpack
 import redis
-import schedule
-from flask import abort, Flask, jsonify, render_template, request, session
-from flask_session import Session
+from flask import abort, Flask, render_template, request, session
 from flask_talisman import Talisman
 
-from db import add_reported_quote, apply_nsfw, apply_vote, get_first_quote_id, get_quote_from_collection
-from db_backup import create_backup
+import metrics
+from annotation import checked_quote_action, feed_quote, moved_forward, NSFW_MARKED, nsfw_threshold, refilled_quote, \
+    remember_nsfw_filter, reported, require_annotator, requested_sync_token, served_quote, start_annotation, synced, vote_counted, \
+    vote_rejected
+from db import add_reported_quote, first_position, get_quotes_batch, QuoteProcessedError
+from quote_feed import feed_key, load_feed, PREFETCH_SIZE
+from session_store import RedisHashSessionInterface
+from sync_index import resolve_sync_token
+from vote_batches import WRITE_BEHIND
+
+if WRITE_BEHIND:
+    # the votes are buffered in Redis and written to Mongo in batches by the flusher thread
+    from vote_buffer import buffer_nsfw as apply_nsfw, buffer_vote as apply_vote, start_flusher
+else:
+    from db import apply_nsfw, apply_vote
 
 REDIS_ADDRESS = os.getenv('REDIS_ADDRESS')
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
@@ -20,160 +27,87 @@ REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
 app = Flask(__name__)
 app.config['SESSION_PERMANENT'] = True
 app.config['SESSION_TYPE'] = 'redis'
-app.config['SESSION_REDIS'] = redis.from_url(f'redis://default:{REDIS_PASSWORD}@{REDIS_ADDRESS}')
-Session(app)
+app.config['SESSION_REDIS'] = redis.from_url(f'redis://default:{REDIS_PASSWORD}@{REDIS_ADDRESS}',
+                                             connection_class=metrics.InstrumentedRedisConnection)
+app.session_interface = RedisHashSessionInterface(app, app.config['SESSION_REDIS'], permanent=app.config['SESSION_PERMANENT'])
 Talisman(app, content_security_policy=None)
+metrics.init_app(app, app.config['SESSION_REDIS'])
 
-NSFW_THRESHOLD = 1
+if WRITE_BEHIND:
+    start_flusher()
 
 
-def current_quote_id(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        quotes_iterator_start = session.get('quotes_iterator', get_first_quote_id())
-        quotes_iterator = get_quote_from_collection(quotes_iterator_start)
-        *_, _id = next(quotes_iterator)
+def next_quote(starting_point: str, nsfw_filter: bool, ttl: timedelta) -> tuple[str, str, str, int, str] | None:
+    key = feed_key(session.sid, nsfw_filter)
+    quote = feed_quote(session, key, load_feed(app.config['SESSION_REDIS'].lrange(key, 0, -1)), starting_point, ttl)
 
-        return func(_id, *args, **kwargs)
+    if quote is not None:
+        return quote
 
-    return wrapper
+    return refilled_quote(session, key, get_quotes_batch(starting_point, PREFETCH_SIZE, nsfw_threshold(nsfw_filter)), ttl)
 
 
 @app.route('/')
 def index():
-    nsfw_filter = request.args.get('nsfw_filter', 'false').lower() == 'true'
-    if nsfw_filter:
-        session['nsfw_always_on'] = True
-
+    remember_nsfw_filter(session, request.args)
     return render_template('index.html')
 
 
 @app.route('/report', methods=['POST'])
-@current_quote_id
-def report(quote_id: str):
-    mongo_id = request.form.get('internal_id')
-
-    if mongo_id is None:
-        abort(400)
-
-    if session.get('name') is None or quote_id != mongo_id:
-        return abort(403)
-
+def report():
+    mongo_id, = checked_quote_action(session, request.form)
     add_reported_quote(mongo_id)
 
-    session['vote_streak'] += 1
-
-    return 'Successfully reported the quote!'
+    return reported(session)
 
 
 @app.route('/mark_nsfw', methods=['POST'])
-@current_quote_id
-def mark_nsfw(quote_id: str):
-    mongo_id = request.form.get('internal_id')
-
-    if mongo_id is None:
-        abort(400)
-
-    if session.get('name') is None or quote_id != mongo_id:
-        return abort(403)
-
+def mark_nsfw():
+    mongo_id, = checked_quote_action(session, request.form)
     apply_nsfw(mongo_id)
 
-    return 'Successfully marked the quote as NSFW!'
+    return NSFW_MARKED
 
 
 @app.route('/vote', methods=['POST'])
-@current_quote_id
-def vote(quote_id: str):
-    vote_value = request.form.get('vote')
-    mongo_id = request.form.get('internal_id')
-
-    if vote_value is None or mongo_id is None:
-        abort(400)
-
-    if session.get('name') is None or quote_id != mongo_id:
-        return abort(403)
+def vote():
+    vote_value, mongo_id = checked_quote_action(session, request.form, 'vote')
 
     try:
         skip = apply_vote(vote_value, mongo_id)
     except ValueError:
         abort(400)
+    except QuoteProcessedError:
+        return vote_rejected(session)
 
-    session['vote_streak'] += 1
-
-    return jsonify({'skip': skip})
+    return vote_counted(session, skip)
 
 
 @app.route('/sync_data', methods=['POST'])
 def sync_data():
-    if session.get('name') is None:
-        return abort(403)
-
-    data_token = request.form.get('token')
+    data_token = requested_sync_token(session, request.form)
 
     if data_token is None:
-        return jsonify({'token': session.get('name')})
-
-    redis_conn = app.config['SESSION_REDIS']
-    keys = redis_conn.keys('*')
-    values = redis_conn.mget(keys)
+        return {'token': session['name']}
 
-    for raw_value in values:
-        value = msgpack.unpackb(raw_value)
-        if value['name'] == data_token:
-            session['quotes_iterator'] = value['quotes_iterator']
-            session['vote_streak'] = value['vote_streak']
-            break
-    else:
-        return abort(400)
-
-    return 'Successfully synchronized accounts!'
+    return synced(session, resolve_sync_token(app.config['SESSION_REDIS'], data_token))
 
 
 @app.route('/get_quote', methods=['GET'])
 def get_quote():
-    nsfw_filter = request.args.get('nsfw_filter', 'false').lower() == 'true'
-    new_user = session.get('name') is None
-
-    if new_user:
-        session['name'] = secrets.token_hex(4)
-        session['vote_streak'] = 0
-
-    if session.get('nsfw_always_on') is not None:
-        nsfw_filter = True
+    nsfw_filter, new_user = start_annotation(session, request.args)
 
-    quotes_iterator_start = session.get('quotes_iterator', get_first_quote_id())
-    quotes_iterator = get_quote_from_collection(quotes_iterator_start)
+    quote = next_quote(session.get('quotes_iterator') or first_position(), nsfw_filter, app.permanent_session_lifetime)
 
-    text, channel_name, channel_link, nsfw, mongo_id = next(quotes_iterator)
-    if nsfw_filter:
-        while nsfw >= NSFW_THRESHOLD:
-            text, channel_name, channel_link, nsfw, mongo_id = next(quotes_iterator)
-
-    session['quotes_iterator'] = mongo_id
-
-    # TODO: should Mongo Cursor be tailed?
-    return jsonify(
-        {'text': text, 'internal_id': mongo_id, 'new_user': new_user, 'channel_name': channel_name, 'channel_link': channel_link,
-         'nsfw': nsfw, 'vote_streak': session['vote_streak']})
+    return served_quote(session, quote, new_user, app.session_interface.key_prefix + session.sid, app.permanent_session_lifetime)
 
 
 @app.route('/proceed', methods=['GET'])
 def proceed():
-    if session.get('name') is None:
-        return abort(403)
-
-    quotes_iterator_start = session.get('quotes_iterator', get_first_quote_id())
-    session['quotes_iterator'] = hex(int(quotes_iterator_start, 16) + 1)[2:].rjust(24, '0')
-
-    return 'Successfully moved iterator forwards!'
+    require_annotator(session)
+    return moved_forward(session, session.get('quotes_iterator') or first_position())
 
 
 if __name__ == '__main__':
-    Thread(target=app.run, args=('0.0.0.0', int(os.getenv('PORT', 80)))).start()
-
-    schedule.every().hour.do(create_backup)
-
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    # development server only, in production the app is served by gunicorn (see Procfile)
+    app.run('0.0.0.0', int(os.getenv('PORT', 80)))
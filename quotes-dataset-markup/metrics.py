@@ -0,0 +1,249 @@
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import redis
+import redis.asyncio
+from flask import abort, Flask, request, Response
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, Counter, generate_latest, Histogram, multiprocess, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+
+__all__ = ['MongoCommandCounter', 'InstrumentedRedisConnection', 'InstrumentedAsyncRedisConnection', 'record_nsfw_skipped',
+           'init_app', 'init_asgi_app']
+
+# set by `gunicorn.conf.py`, every worker writes its samples there and `/metrics` merges them
+MULTIPROCESS_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+# `/metrics` requires `Authorization: Bearer <token>` when it is set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+BACKUP_METRICS_KEY = 'backup:metrics'  # written by `backup_worker.py`
+
+COMMAND_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+
+REQUEST_LATENCY = Histogram('markup_request_duration_seconds', 'Time spent handling a request, including the session',
+                            ['endpoint'], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+REQUEST_MONGO_COMMANDS = Histogram('markup_request_mongo_commands', 'Mongo commands sent while handling a request',
+                                   ['endpoint'], buckets=COMMAND_BUCKETS)
+REQUEST_REDIS_COMMANDS = Histogram('markup_request_redis_commands', 'Redis commands sent while handling a request',
+                                   ['endpoint'], buckets=COMMAND_BUCKETS)
+NSFW_SKIPPED = Histogram('markup_nsfw_skipped_quotes', 'Quotes hidden by the NSFW filter that a `get_quote` request skipped over',
+                         buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+
+MONGO_COMMANDS = Counter('markup_mongo_commands', 'Mongo commands sent by the process', ['command'])
+MONGO_COMMAND_LATENCY = Histogram('markup_mongo_command_duration_seconds', 'Round trip of Mongo commands', ['command'],
+                                  buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+REDIS_COMMANDS = Counter('markup_redis_commands', 'Redis commands sent by the process', ['command'])
+
+
+@dataclass
+class _RequestStats:
+    endpoint: str | None = None
+    mongo_commands: int = 0
+    redis_commands: int = 0
+    nsfw_skipped: int | None = None
+
+
+# commands sent outside of a request (the vote flusher, the backup worker) only go to the per-process counters
+_request_stats: ContextVar[_RequestStats | None] = ContextVar('request_stats', default=None)
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    # the events of synchronous commands are published by the thread that runs the command
+    def started(self, event: monitoring.CommandStartedEvent):
+        MONGO_COMMANDS.labels(event.command_name).inc()
+
+        if (stats := _request_stats.get()) is not None:
+            stats.mongo_commands += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+
+def _count_redis_command(args: tuple):
+    command = args[0].decode() if isinstance(args[0], bytes) else str(args[0])
+    REDIS_COMMANDS.labels(command.upper()).inc()
+
+    if (stats := _request_stats.get()) is not None:
+        stats.redis_commands += 1
+
+
+class InstrumentedRedisConnection(redis.Connection):
+    # pipelines pack every command separately as well, so this counts commands rather than round trips
+    def pack_command(self, *args):
+        _count_redis_command(args)
+        return super().pack_command(*args)
+
+
+class InstrumentedAsyncRedisConnection(redis.asyncio.Connection):
+    def pack_command(self, *args):
+        _count_redis_command(args)
+        return super().pack_command(*args)
+
+
+def record_nsfw_skipped(count: int):
+    if (stats := _request_stats.get()) is not None:
+        stats.nsfw_skipped = (stats.nsfw_skipped or 0) + count
+
+
+def _backup_metric_families(fields: dict[bytes, bytes]):
+    backup_metrics = {field.decode(): float(value) for field, value in fields.items()}
+
+    if not backup_metrics:
+        return
+
+    yield GaugeMetricFamily('markup_backup_started_at_seconds', 'Start of the last backup',
+                            value=backup_metrics.pop('started_at'))
+    yield GaugeMetricFamily('markup_backup_duration_seconds', 'Duration of the last backup',
+                            value=backup_metrics.pop('duration_seconds'))
+
+    for kind in ('documents', 'bytes'):
+        family = GaugeMetricFamily(f'markup_backup_{kind}', f'{kind.capitalize()} exported by the last backup',
+                                   labels=['collection'])
+        for field, value in backup_metrics.items():
+            if field.endswith(f'_{kind}'):
+                family.add_metric([field.removesuffix(f'_{kind}')], value)
+
+        yield family
+
+
+class _BackupMetricsCollector:
+    def __init__(self, redis_conn: redis.Redis):
+        self.redis_conn = redis_conn
+
+    def describe(self) -> list:
+        # without it `REGISTRY.register` calls `collect` to learn the metric names, which would query Redis on import
+        return []
+
+    def collect(self):
+        yield from _backup_metric_families(self.redis_conn.hgetall(BACKUP_METRICS_KEY))
+
+
+class _ReadBackupMetricsCollector:
+    # the backup results already read by the caller, for the apps that cannot query Redis while collecting
+    def __init__(self, fields: dict[bytes, bytes]):
+        self.fields = fields
+
+    def describe(self) -> list:
+        return []
+
+    def collect(self):
+        yield from _backup_metric_families(self.fields)
+
+
+def _observe_request(stats: _RequestStats, duration: float):
+    endpoint = stats.endpoint or 'unmatched'
+    REQUEST_LATENCY.labels(endpoint).observe(duration)
+    REQUEST_MONGO_COMMANDS.labels(endpoint).observe(stats.mongo_commands)
+    REQUEST_REDIS_COMMANDS.labels(endpoint).observe(stats.redis_commands)
+
+    if stats.nsfw_skipped is not None:
+        NSFW_SKIPPED.observe(stats.nsfw_skipped)
+
+
+class _RequestMetricsMiddleware:
+    # wraps the whole WSGI call, so the session load and save done by Flask-Session are measured too
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        initial_time = time.perf_counter()
+
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            _request_stats.reset(token)
+            _observe_request(stats, time.perf_counter() - initial_time)
+
+
+class _AsgiRequestMetricsMiddleware:
+    # the request handler runs in a task created within this call, so it sees the same stats object
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.asgi_app(scope, receive, send)
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        initial_time = time.perf_counter()
+
+        try:
+            return await self.asgi_app(scope, receive, send)
+        finally:
+            _request_stats.reset(token)
+            _observe_request(stats, time.perf_counter() - initial_time)
+
+
+def _metrics_collector(redis_conn: redis.Redis) -> _BackupMetricsCollector:
+    backup_collector = _BackupMetricsCollector(redis_conn)
+    if MULTIPROCESS_DIR is None:
+        REGISTRY.register(backup_collector)
+
+    return backup_collector
+
+
+def _authorized(authorization: str | None) -> bool:
+    return METRICS_TOKEN is None or authorization == f'Bearer {METRICS_TOKEN}'
+
+
+def _generate_metrics(backup_collector: _BackupMetricsCollector | _ReadBackupMetricsCollector | None) -> bytes:
+    registry = REGISTRY
+    if MULTIPROCESS_DIR is not None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        if backup_collector is not None:
+            registry.register(backup_collector)
+
+    return generate_latest(registry)
+
+
+def init_app(app: Flask, redis_conn: redis.Redis):
+    app.wsgi_app = _RequestMetricsMiddleware(app.wsgi_app)
+    backup_collector = _metrics_collector(redis_conn)
+
+    @app.before_request
+    def remember_endpoint():
+        if (stats := _request_stats.get()) is not None:
+            stats.endpoint = request.endpoint
+
+    @app.route('/metrics')
+    def metrics():
+        if not _authorized(request.headers.get('Authorization')):
+            abort(403)
+
+        return Response(_generate_metrics(backup_collector), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_asgi_app(app, redis_conn: redis.asyncio.Redis):
+    # the same metrics for the app of `asgi.py`; the backup results are read before the collection, which cannot await
+    from quart import abort as quart_abort, request as quart_request, Response as QuartResponse
+
+    app.asgi_app = _AsgiRequestMetricsMiddleware(app.asgi_app)
+
+    @app.before_request
+    async def remember_endpoint():
+        if (stats := _request_stats.get()) is not None:
+            stats.endpoint = quart_request.endpoint
+
+    @app.route('/metrics')
+    async def metrics():
+        if not _authorized(quart_request.headers.get('Authorization')):
+            quart_abort(403)
+
+        backup_collector = _ReadBackupMetricsCollector(await redis_conn.hgetall(BACKUP_METRICS_KEY))
+
+        if MULTIPROCESS_DIR is not None:
+            return QuartResponse(_generate_metrics(backup_collector), mimetype=CONTENT_TYPE_LATEST)
+
+        # the process registry is shared with the other collectors, so the backup results are appended separately
+        backup_registry = CollectorRegistry()
+        backup_registry.register(backup_collector)
+
+        return QuartResponse(_generate_metrics(None) + generate_latest(backup_registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from hashlib import sha1
+from itertools import batched
+from pathlib import Path
+from typing import Sequence
+
+__all__ = ['PROFANITY_THRESHOLD', 'score_texts', 'nsfw_seed']
+
+PROFANITY_THRESHOLD = 0.5
+PROFANITY_BATCH_SIZE = int(os.getenv('PROFANITY_BATCH_SIZE', 256))
+PROFANITY_WORKERS = int(os.getenv('PROFANITY_WORKERS', 1))
+PROFANITY_CACHE_PATH = Path(os.getenv('PROFANITY_CACHE_PATH', Path(__file__).parent / 'profanity_cache.sqlite3'))
+
+SQLITE_VARIABLES_LIMIT = 900
+
+_checker = None
+
+
+def _get_checker():
+    # the model takes a while to load, so it is only loaded by the processes that actually score something
+    global _checker
+
+    if _checker is None:
+        from check_swear import SwearingCheck
+
+        _checker = SwearingCheck()
+
+    return _checker
+
+
+def _score_batch(texts: Sequence[str]) -> list[float]:
+    return [float(probability) for probability in _get_checker().predict_proba(list(texts))]
+
+
+def _text_hash(text: str) -> str:
+    return sha1(text.encode('utf-8')).hexdigest()
+
+
+def _open_cache() -> sqlite3.Connection:
+    cache = sqlite3.connect(PROFANITY_CACHE_PATH)
+    cache.execute('CREATE TABLE IF NOT EXISTS scores (text_hash TEXT PRIMARY KEY, score REAL NOT NULL)')
+
+    return cache
+
+
+def _cached_scores(cache: sqlite3.Connection, hashes: list[str]) -> dict[str, float]:
+    cached_scores = {}
+
+    for hashes_chunk in batched(hashes, SQLITE_VARIABLES_LIMIT):
+        placeholders = ', '.join('?' * len(hashes_chunk))
+        cached_scores.update(cache.execute(f'SELECT text_hash, score FROM scores WHERE text_hash IN ({placeholders})', hashes_chunk))
+
+    return cached_scores
+
+
+def score_texts(texts: Sequence[str], batch_size: int = PROFANITY_BATCH_SIZE, workers: int = PROFANITY_WORKERS) -> list[float]:
+    # probability of every text being profane, texts that have been scored before are taken from the cache
+    hashes = [_text_hash(text) for text in texts]
+
+    cache = _open_cache()
+
+    with closing(cache), cache:
+        scores = _cached_scores(cache, list(set(hashes)))
+
+        unscored_texts = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in scores}
+        batches = list(batched(unscored_texts.items(), batch_size))
+
+        if workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                batch_scores = executor.map(_score_batch, [[text for _, text in batch] for batch in batches])
+        else:
+            batch_scores = map(_score_batch, [[text for _, text in batch] for batch in batches])
+
+        for batch, new_scores in zip(batches, batch_scores):
+            new_entries = [(text_hash, score) for (text_hash, _), score in zip(batch, new_scores)]
+            cache.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?)', new_entries)
+            scores.update(new_entries)
+
+    return [scores[text_hash] for text_hash in hashes]
+
+
+def nsfw_seed(score: float, max_votes: int) -> int:
+    # number of NSFW marks a quote starts with, so that confidently profane quotes are hidden by the filter right away
+    return round(score * max_votes) if score >= PROFANITY_THRESHOLD else 0
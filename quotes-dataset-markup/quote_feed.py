@@ -0,0 +1,57 @@
+import os
+from datetime import timedelta
+
+import msgpack
+import redis
+
+from quote_queries import QUOTES_ORDER
+
+# the per-session feeds of prefetched quotes in Redis; `main.py` and `asgi.py` fill them from Mongo with their own clients
+
+__all__ = ['FEED_PREFIX', 'PREFETCH_SIZE', 'feed_key', 'load_feed', 'served_count', 'queue_trim', 'queue_refill', 'discard_feed']
+
+FEED_PREFIX = 'feed:'
+PREFETCH_SIZE = int(os.getenv('QUOTE_FEED_PREFETCH_SIZE', 20))
+
+
+def feed_key(session_id: str, nsfw_filter: bool) -> str:
+    # feeds of the other serving order hold positions of another format
+    return f'{FEED_PREFIX}{session_id}:{int(nsfw_filter)}' + (':ranked' if QUOTES_ORDER == 'uncertainty' else '')
+
+
+def served_count(feed: list[tuple], starting_point: str) -> int:
+    # positions have a fixed length, so they compare in the same order as the quotes are served (see `db.get_quotes_batch`);
+    # a position of an older format starts over, before the whole feed
+    if feed and len(starting_point) != len(feed[0][-1]):
+        return 0
+
+    served = 0
+    while served < len(feed) and feed[served][-1] < starting_point:
+        served += 1
+
+    return served
+
+
+def load_feed(raw_quotes: list[bytes]) -> list[tuple]:
+    return [tuple(msgpack.unpackb(raw_quote)) for raw_quote in raw_quotes]
+
+
+# every feed is a contiguous run of eligible quotes in the serving order, so everything before the iterator has already
+# been served and the first remaining entry is the current quote; the writes are queued on a pipeline of the caller.
+# Served entries are not rechecked against Mongo: a quote finalized by other annotators in the meantime is rejected by
+# `/vote` with 409, which moves the iterator past it, a quote hidden by the NSFW filter in the meantime is still served,
+# and a refill only reads the quotes that are live at that moment
+def queue_trim(pipeline: redis.client.Pipeline, key: str, served: int, ttl: timedelta | int):
+    pipeline.ltrim(key, served, -1)
+    pipeline.expire(key, ttl)
+
+
+def queue_refill(pipeline: redis.client.Pipeline, key: str, feed: list[tuple], ttl: timedelta | int):
+    pipeline.delete(key)
+    if feed:
+        pipeline.rpush(key, *(msgpack.packb(quote) for quote in feed))
+        pipeline.expire(key, ttl)
+
+
+def discard_feed(redis_conn: redis.Redis, session_id: str):
+    redis_conn.delete(feed_key(session_id, False), feed_key(session_id, True))
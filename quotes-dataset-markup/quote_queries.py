@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+# the settings, the positions, the vote rules and the Mongo queries shared by the synchronous `db` and the asyncio `async_db`;
+# unlike those, importing it does not create a client
+
+__all__ = ['MONGO_URI', 'VOTES_THRESHOLD', 'NSFW_THRESHOLD', 'QUOTES_ORDER', 'RANK_DIGITS', 'OBJECT_ID_LENGTH', 'TOUCH',
+           'QuoteProcessedError', 'next_position', 'position_quote_id', 'quote_position', 'position_query', 'position_range_query',
+           'vote_increment', 'clamp_votes', 'without_bookkeeping', 'content_hash_clash', 'duplicate_merge',
+           'processed_insert']
+
+MONGO_CLUSTER_ADDRESS = os.getenv('MONGO_CLUSTER_ADDRESS')
+MONGO_ADMIN_PASSWORD = os.getenv('MONGO_ADMIN_PASSWORD')
+MONGO_URI = os.getenv('MONGO_URI', f'mongodb+srv://admin:{MONGO_ADMIN_PASSWORD}@{MONGO_CLUSTER_ADDRESS}/')
+
+VOTES_THRESHOLD = 3
+# quotes marked as NSFW at least that many times are hidden by the filter
+NSFW_THRESHOLD = 1
+
+# `sequential` serves the quotes in `_id` order, `uncertainty` serves the quotes the classifier is least sure about first,
+# using the `serving_rank` written by `quotes-ml/uncertainty.py`: the scoring round, then the uncertainty, so that the quotes
+# scored later are served after the current round instead of behind the positions (unscored quotes are not served in this mode)
+QUOTES_ORDER = os.getenv('QUOTES_ORDER', 'sequential')
+RANK_DIGITS = 13
+OBJECT_ID_LENGTH = 24
+
+# every write sets `updated_at` on the server, so that incremental backups can pick up modified documents
+TOUCH = {'$currentDate': {'updated_at': True}}
+
+
+class QuoteProcessedError(LookupError):
+    pass
+
+
+# the position of a quote in the serving order is a fixed-width string, so positions compare in the same order as the quotes
+# are served: the hex `_id` in the sequential order, prefixed with the zero-padded rank in the uncertainty order
+def next_position(position: str) -> str:
+    return position[:-OBJECT_ID_LENGTH] + hex(int(position[-OBJECT_ID_LENGTH:], 16) + 1)[2:].rjust(OBJECT_ID_LENGTH, '0')
+
+
+def position_quote_id(position: str) -> str:
+    return position[-OBJECT_ID_LENGTH:]
+
+
+def quote_position(quote: dict) -> str:
+    if QUOTES_ORDER == 'uncertainty':
+        return f'{quote["serving_rank"]:0{RANK_DIGITS}d}{quote["_id"]}'
+
+    return str(quote['_id'])
+
+
+def _parse_position(position: str) -> tuple[int, ObjectId]:
+    # positions stored before the order was switched carry no rank, they start over, as do the positions that carry
+    # a bare uncertainty, which is below the first round
+    return int(position[:-OBJECT_ID_LENGTH] or 0), ObjectId(position_quote_id(position))
+
+
+def position_query(position: str) -> tuple[dict, list[tuple[str, int]]]:
+    rank, quote_id = _parse_position(position)
+
+    if QUOTES_ORDER == 'uncertainty':
+        query = {'$or': [{'serving_rank': rank, '_id': {'$gte': quote_id}}, {'serving_rank': {'$gt': rank}}]}
+
+        return query, [('serving_rank', 1), ('_id', 1)]
+
+    return {'_id': {'$gte': quote_id}}, [('_id', 1)]
+
+
+def position_range_query(first: str, last: str) -> dict:
+    # quotes between two positions, both included; every branch is a bounded range of the index
+    (first_rank, first_id), (last_rank, last_id) = _parse_position(first), _parse_position(last)
+
+    if QUOTES_ORDER != 'uncertainty':
+        return {'_id': {'$gte': first_id, '$lte': last_id}}
+
+    if first_rank == last_rank:
+        return {'serving_rank': first_rank, '_id': {'$gte': first_id, '$lte': last_id}}
+
+    return {'$or': [{'serving_rank': first_rank, '_id': {'$gte': first_id}},
+                    {'serving_rank': {'$gt': first_rank, '$lt': last_rank}},
+                    {'serving_rank': last_rank, '_id': {'$lte': last_id}}]}
+
+
+def vote_increment(vote: str) -> dict:
+    match vote:
+        case 'positive':
+            return {'positive_votes': 1}
+        case 'negative':
+            return {'negative_votes': 1}
+        case _:
+            raise ValueError(f'Unknown vote type: {vote}')
+
+
+def clamp_votes(current_quote: dict) -> bool:
+    # whether the quote has collected enough votes to leave the collection
+    if current_quote['positive_votes'] > VOTES_THRESHOLD // 2:  # assuming that VOTES_THRESHOLD is an odd number
+        current_quote['positive_votes'] = VOTES_THRESHOLD - current_quote['negative_votes']
+
+    if current_quote['negative_votes'] > VOTES_THRESHOLD // 2:
+        current_quote['negative_votes'] = VOTES_THRESHOLD - current_quote['positive_votes']
+
+    return current_quote['positive_votes'] + current_quote['negative_votes'] >= VOTES_THRESHOLD
+
+
+def without_bookkeeping(quote: dict) -> dict:
+    # `applied_batches` are the ids of the buffered vote batches, see `vote_batches`
+    return {key: value for key, value in quote.items() if key not in ('_id', 'updated_at', 'applied_batches')}
+
+
+def content_hash_clash(error: DuplicateKeyError) -> bool:
+    # concurrent finalizers of the same quote collide on `_id`, a processed quote with the same text collides on the hash
+    return 'content_hash' in (error.details or {}).get('keyPattern', {})
+
+
+def duplicate_merge(current_quote: dict) -> tuple[dict, dict]:
+    # the votes are added to the processed quote with the same text, only once even if the finalization is repeated
+    return ({'content_hash': current_quote['content_hash'], 'merged_ids': {'$ne': current_quote['_id']}},
+            {'$inc': {field: current_quote[field] for field in ('positive_votes', 'negative_votes', 'nsfw')},
+             '$push': {'merged_ids': current_quote['_id']}, **TOUCH})
+
+
+def processed_insert(current_quote: dict) -> dict:
+    # `updated_at` is only set together with the inserted document instead of by `TOUCH`, so a repeated finalization
+    # does not move it, otherwise the export of the annotated quotes would take the quote once more
+    return {'$setOnInsert': {**without_bookkeeping(current_quote), 'updated_at': datetime.now(timezone.utc)}}
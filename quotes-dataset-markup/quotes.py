@@ -1,72 +1,172 @@
+import json
+import logging
 import os
 import re
+from pathlib import Path
+from typing import Callable, Iterable, Self, Sequence
+
+from profanity import PROFANITY_THRESHOLD, score_texts
 
 __all__ = ['GenericQuote', 'LetovoQuote', 'MyxaQuote', 'HSEQuote', 'FEFUQuote', 'KSUQuote', 'ISUQuote', 'MGTUQuote', 'MIPTQuote',
-           'SGUQuote', 'VKLetovoQuote', 'NSTUQuote', 'SFEDUQuote', 'URFUQuote', 'MSUQuote', 'search_profanity']
+           'SGUQuote', 'VKLetovoQuote', 'NSTUQuote', 'SFEDUQuote', 'URFUQuote', 'MSUQuote', 'extract_tags', 'normalize_text',
+           'normalize_texts', 'score_profanity', 'search_profanity']
+
+# Implementation borrowed from the `validators` library
+LINK_PATTERN = re.compile(
+    # First character of the domain
+    r"(?:[a-z0-9]"
+    # Sub-domain
+    r"(?:[a-z0-9-]{0,61}"
+    # Hostname
+    r"[a-z0-9])?\.)"
+    # First 61 characters of the gTLD
+    r"+[a-z0-9][a-z0-9-_]{0,61}"
+    # Last character of the gTLD
+    r"[a-z]",
+    re.IGNORECASE
+)
+LEADING_DASH_PATTERN = re.compile(r'^ *[-–—−‒⁃]+ *', re.MULTILINE)
+DANGLING_DASH_PATTERN = re.compile(r'^— ', re.MULTILINE)
+DOUBLE_QUOTATION_PATTERN = re.compile(r'^"([^"]+)"$')
+SINGLE_QUOTATION_PATTERN = re.compile(r"^'([^'])+'$")
+BRACE_TAG_PATTERN = re.compile(r'\([^)]+\)$')
+TAG_PATTERN = re.compile(r'#([^ \n\t#]*)')
+
+JUNK_TAGS_PATH = Path(os.getenv('JUNK_TAGS_PATH', Path(__file__).parent / 'junk_tags.json'))
+
+
+def load_junk_tags(path: Path = JUNK_TAGS_PATH) -> list[str]:
+    with open(path, encoding='utf-8') as junk_tags_file:
+        return json.load(junk_tags_file)
+
+
+def compile_tag_matcher(tags: Iterable[str]) -> re.Pattern:
+    # longer tags go first, so that the reported tag is the most specific one
+    alternatives = sorted({re.escape(f'#{tag.lower()}') for tag in tags}, key=lambda alternative: (-len(alternative), alternative))
+
+    return re.compile('|'.join(alternatives) if alternatives else r'(?!)')
+
+
+JUNK_TAGS_MATCHER = compile_tag_matcher(load_junk_tags())
+
+logger = logging.getLogger(__name__)
+
+# every step takes the text and the list of tags extracted so far, and returns the new text;
+# quotes that should not get into the dataset are rejected with an AssertionError
+NormalizationStep = Callable[[str, list[str]], str]
+
+
+# Normalization steps
+def unify_dashes(text: str, tags: list[str]) -> str:
+    return LEADING_DASH_PATTERN.sub('— ', text)
+
+
+def remove_dangling_dash(text: str, tags: list[str]) -> str:
+    if text.count('—') == 1:
+        return DANGLING_DASH_PATTERN.sub('', text)
+
+    return text
+
+
+def extract_tags(text: str) -> tuple[str, list[str]]:
+    # a tag runs until the next space, tab, newline or hash; the text around the tags is stripped and glued back together
+    if '#' not in text:
+        return text, []
+
+    segments, tags = [], []
+    position = 0
+
+    for tag_match in TAG_PATTERN.finditer(text):
+        segments.append(text[position:tag_match.start()].strip())
+        tags.append(tag_match.group(1).capitalize().replace('ё', 'е'))
+        position = tag_match.end()
+
+    segments.append(text[position:].strip())
+
+    return ''.join(segments), tags
+
+
+def separate_tags(text: str, tags: list[str]) -> str:
+    text, extracted_tags = extract_tags(text)
+    tags.extend(extracted_tags)
+
+    return text
+
+
+def prohibit_links(text: str, tags: list[str]) -> str:
+    assert not LINK_PATTERN.search(text), 'Link found!'
+
+    return text
+
+
+def remove_quotation_marks(text: str, tags: list[str]) -> str:
+    text = DOUBLE_QUOTATION_PATTERN.sub(r'\1', text)
+    return SINGLE_QUOTATION_PATTERN.sub(r'\1', text)
 
-if os.getenv('PRODUCTION') is None:
-    from check_swear import SwearingCheck
 
-    profanity_checker = SwearingCheck()
+def remove_brace_tag(text: str, tags: list[str]) -> str:
+    return BRACE_TAG_PATTERN.sub('', text).strip()
+
+
+def remove_junk_tags(text: str, tags: list[str]) -> str:
+    junk_tag_match = JUNK_TAGS_MATCHER.search(text.lower())
+    assert junk_tag_match is None, f'Found junk tag: {junk_tag_match and junk_tag_match.group()!r}'
+
+    return text
+
+
+LETOVO_STEPS = (remove_junk_tags, unify_dashes, remove_dangling_dash, separate_tags)
+VK_STEPS = (prohibit_links, separate_tags, remove_quotation_marks, unify_dashes, remove_dangling_dash)
+HSE_STEPS = (prohibit_links, separate_tags, remove_brace_tag, remove_quotation_marks, unify_dashes, remove_dangling_dash)
+
+
+def normalize_text(text: str, steps: Sequence[NormalizationStep]) -> tuple[str, str]:
+    text = text.strip()
+    assert text, 'Text is empty!'
+    assert '#' in text, 'Text is most likely not a quote (does not contain hashtag)!'
+
+    tags = []
+    for step in steps:
+        text = step(text, tags)
+
+    return text, ''.join(f'#{tag} ' for tag in tags)
+
+
+def normalize_texts(texts: Iterable[str], steps: Sequence[NormalizationStep]) -> list[tuple[str, str] | None]:
+    normalized_texts = []
+
+    for text in texts:
+        try:
+            normalized_texts.append(normalize_text(text, steps))
+        except AssertionError as error:
+            # the message tells why, e.g. which junk tag has been found
+            logger.info('Rejected %r: %s', text, error)
+            normalized_texts.append(None)
+
+    return normalized_texts
 
 
 class GenericQuote:
     channel_link: str = ''
     channel_name: str = ''
-    MAX_QUOTE_LEN: int = 100_000
+    steps: tuple[NormalizationStep, ...] = ()
 
     def __init__(self, text: str):
-        self.text = text.strip()
-        assert self.text, 'Text is empty!'
-        assert '#' in self.text, 'Text is most likely not a quote (does not contain hashtag)!'
-
-        self.tags = ''
-
-        self.refactor()
-
-    # Refactor approaches
-    def _unify_dashes(self):
-        self.text = re.sub(r'^ *[-–—−‒⁃]+ *', r'— ', self.text, flags=re.MULTILINE)
-
-    def _remove_dangling_dash(self):
-        if self.text.count('—') == 1:
-            self.text = re.sub(r'^— ', r'', self.text, flags=re.MULTILINE)
-
-    def _separate_tags(self):
-        while '#' in self.text:
-            start = self.text.find('#') + 1
-            stop_symbols = (' ', '\n', '\t', '#')
-            next_stop = [self.text.find(symbol, start) % self.MAX_QUOTE_LEN for symbol in stop_symbols]
-            end = min(next_stop)
-
-            author = self.text[start:end].capitalize().replace('ё', 'е')
-
-            self.tags += f'#{author} '
-            self.text = self.text[:start - 1].strip() + self.text[end:].strip()
-
-    def _prohibit_links(self):
-        # Implementation borrowed from the `validators` library
-        assert not re.search(
-            # First character of the domain
-            rf"(?:[a-z0-9]"
-            # Sub-domain
-            + rf"(?:[a-z0-9-]{{0,61}}"
-            # Hostname
-            + rf"[a-z0-9])?\.)"
-            # First 61 characters of the gTLD
-            + r"+[a-z0-9][a-z0-9-_]{0,61}"
-            # Last character of the gTLD
-            + rf"[a-z]",
-            self.text,
-            re.IGNORECASE
-        ), 'Link found!'
-
-    def _remove_quotation_marks(self):
-        self.text = re.sub(r'^"([^"]+)"$', r'\1', self.text)
-        self.text = re.sub(r"^'([^'])+'$", r'\1', self.text)
-
-    def refactor(self):
-        pass
+        self.text, self.tags = normalize_text(text, self.steps)
+
+    @classmethod
+    def from_normalized(cls, text: str, tags: str) -> Self:
+        # for texts that have already gone through `normalize_text` (e.g. in another process)
+        quote = cls.__new__(cls)
+        quote.text, quote.tags = text, tags
+
+        return quote
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str]) -> list[Self]:
+        # rejected texts are skipped
+        return [cls.from_normalized(*normalized_text) for normalized_text in normalize_texts(texts, cls.steps)
+                if normalized_text is not None]
 
     def __str__(self) -> str:
         return self.text
@@ -75,193 +175,91 @@ class GenericQuote:
 class LetovoQuote(GenericQuote):
     channel_link: str = 'https://t.me/letovo_quotes'
     channel_name: str = 'Забавные цитаты Летово'
-
-    def _remove_junk_tags(self):
-        junk_tags = ['встречакоманд', 'я', '"]', '\'"]}', 'aa', 'fuckers', 'heheheha', 'meow', 'rus_8_26', 'studentseng_8_ph4point1',
-                     'test', 'aboba', 'artificial_intelligence', 'bro', 'lasttest', 'meow', 'new', 'sorry', 'test', 'testmeow',
-                     'английский', 'аноним', 'анонимно', 'богдан', 'бординг', 'боря_бука_а_мисюрий_отклоняет_цитаты', 'ведущий',
-                     'выездколоменское', 'выпускник', 'дебаты', 'девятиклассник', 'знаменитый_учитель_по_информатике', 'какойточел',
-                     'летовожабы', 'майскийкросс', 'мисюрий_бука_и_отклоняет_цитаты', 'мнепожалуйста', 'мостюф', 'мюзикл',
-                     'наш_лучший_учитель', 'неизвестныйгений', 'ну_а_че_глебу_можно_а_мне_нельзя', 'одобряю', 'поднятиефлага', 'почему?',
-                     'прекратитьпроизволадминов', 'простите',
-                     'степанов\n\n\nадмины простите думаю нужны пояснения. это он говорит про осадок, который обозначается стрелкой вниз',
-                     'ура_обнова', 'ученики', 'учитель', 'фотосессич', 'хаусмастер', 'хаусмастер_6', 'хватит', 'цитатник', 'широкийкость',
-                     'ярмаркасообществ', 'авторнеизвестен', 'аноним', 'бот', 'бот говно', 'вопрос', 'восьмойкласс', 'вселидома?',
-                     'деньвыездов', 'жестокаяправда', 'задержкавразвитии', 'кашинкалязин', 'кринж', 'кто-то с летовской среды', 'кчау',
-                     'лютыйбот', 'не', 'некринж', 'остановкавразвитии', 'отклонениеотнормы', 'отклониевпользунормы', 'пожалуйста',
-                     'простите', 'профматы', 'рабочие', 'тест', 'тест предложки', 'тяжело', 'ужас', 'ученики8базыхимии', 'хехе', 'хештег',
-                     'хуй', 'цитата (сейчас отклоню)', 'я', 'калимуллина-нечаева']
-
-        assert not any(f'#{tag}' in self.text.lower() for tag in junk_tags), 'Found junk tags!'
-
-    def refactor(self):
-        self._remove_junk_tags()
-        self._unify_dashes()
-        self._remove_dangling_dash()
-        self._separate_tags()
+    steps = LETOVO_STEPS
 
 
 class MyxaQuote(GenericQuote):
     channel_link: str = 'https://vk.com/citatnik_myxa'
     channel_name: str = 'Цитаты преподавателей Штиглица (Мухи)'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class HSEQuote(GenericQuote):
     channel_link: str = 'https://vk.com/hseteachers'
     channel_name: str = 'Цитатник ВШЭ'
-
-    def _remove_brace_tag(self):
-        self.text = re.sub(r'\([^)]+\)$', r'', self.text)
-        self.text = self.text.strip()
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_brace_tag()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = HSE_STEPS
 
 
 class FEFUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/fefu_quotes'
     channel_name: str = 'Цитаты преподавателей ДВФУ'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class KSUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/glagolit_ksu'
     channel_name: str = 'Цитаты преподавателей КФУ'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class ISUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/isu_quotes'
     channel_name: str = 'Цитаты преподавателей ИГУ'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class MGTUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/mgtupage'
     channel_name: str = 'Цитаты преподавателей МГТУ им. Н.Э. Баумана'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class MIPTQuote(GenericQuote):
     channel_link: str = 'https://vk.com/prepod_mipt'
     channel_name: str = 'Цитаты преподавателей МФТИ'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class SGUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/public80867350'
     channel_name: str = 'Цитаты великих преподавателей СГУ'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class VKLetovoQuote(GenericQuote):
     channel_link: str = 'https://vk.com/public170539958'
     channel_name: str = 'Цитаты преподавателей Летово'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class NSTUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/quotes_nstu'
     channel_name: str = 'Цитаты преподавателей НГТУ'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class SFEDUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/sfeduquotes'
     channel_name: str = 'Цитаты преподавателей ЮФУ (SFEDU)'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class URFUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/urfusay'
     channel_name: str = 'Цитаты преподавателей УрФУ'
-
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+    steps = VK_STEPS
 
 
 class MSUQuote(GenericQuote):
     channel_link: str = 'https://vk.com/ustami_msu'
     channel_name: str = 'Цитаты преподавателей МГУ'
+    steps = VK_STEPS
+
 
-    def refactor(self):
-        self._prohibit_links()
-        self._separate_tags()
-        self._remove_quotation_marks()
-        self._unify_dashes()
-        self._remove_dangling_dash()
+def score_profanity(dataset: list[GenericQuote]) -> list[float]:
+    return score_texts([quote.text for quote in dataset])
 
 
 def search_profanity(dataset: list[GenericQuote], exclude: bool = True) -> list[GenericQuote]:
-    dataset_prediction = profanity_checker.predict(list(map(lambda quote: quote.text, dataset)))
+    dataset_prediction = [score >= PROFANITY_THRESHOLD for score in score_profanity(dataset)]
     return [dataset[index] for index, verdict in enumerate(dataset_prediction) if verdict ^ exclude]
@@ -0,0 +1,114 @@
+import json
+from collections import Counter
+from datetime import timedelta
+
+import msgpack
+import redis
+from flask import Flask, Request, Response
+from flask_session.redis import RedisSession, RedisSessionInterface
+
+__all__ = ['SESSION_KEY_PREFIX', 'decode_fields', 'queue_migration', 'read_session', 'RedisHashSession',
+           'RedisHashSessionInterface']
+
+SESSION_KEY_PREFIX = 'session:'  # default `key_prefix` of Flask-Session
+
+
+# every session is a Redis hash with a JSON value per key, so integers are stored as plain numbers and can be `HINCRBY`-ed
+def decode_fields(fields: dict[bytes, bytes]) -> dict:
+    return {field.decode(): json.loads(value) for field, value in fields.items()}
+
+
+def _encode_fields(value: dict) -> dict[str, str]:
+    return {key: json.dumps(item) for key, item in value.items()}
+
+
+def queue_migration(pipeline: redis.client.Pipeline, store_id: str, value: dict, ttl: int):
+    # replaces a msgpack blob written by the stock Flask-Session backend with a hash, keeping its remaining lifetime
+    pipeline.delete(store_id)
+    pipeline.hset(store_id, mapping=_encode_fields(value))
+    if ttl > 0:
+        pipeline.pexpire(store_id, ttl)
+
+
+def read_session(redis_conn: redis.Redis, store_id: str) -> dict | None:
+    try:
+        fields = redis_conn.hgetall(store_id)
+    except redis.ResponseError:
+        # a msgpack blob written by the stock Flask-Session backend, which has not been requested since the switch
+        raw_value = redis_conn.get(store_id)
+        return None if raw_value is None else msgpack.unpackb(raw_value)
+
+    return decode_fields(fields) or None
+
+
+class RedisHashSession(RedisSession):
+    def __init__(self, initial: dict | None = None, sid: str | None = None, permanent: bool | None = None):
+        # what is stored in Redis, only the keys that differ from it are written back
+        self.stored = dict(initial or {})
+        self.increments = Counter()
+        self.pipeline: redis.client.Pipeline | None = None
+
+        super().__init__(initial, sid, permanent)
+
+    def increment(self, key: str, amount: int = 1):
+        # concurrent requests of the same user do not overwrite each other's increments
+        if key in self.stored and self.stored[key] == self.get(key):
+            self.increments[key] += amount
+            self.stored[key] += amount
+
+        self[key] = self.get(key, 0) + amount
+
+    def queue_update(self, store_id: str, lifetime: timedelta):
+        changed_fields = _encode_fields({key: value for key, value in self.items()
+                                         if key not in self.stored or self.stored[key] != value})
+        removed_fields = [key for key in self.stored if key not in self]
+
+        if changed_fields:
+            self.pipeline.hset(store_id, mapping=changed_fields)
+        if removed_fields:
+            self.pipeline.hdel(store_id, *removed_fields)
+        for key, amount in self.increments.items():
+            self.pipeline.hincrby(store_id, key, amount)
+
+        self.pipeline.expire(store_id, lifetime)
+
+
+class RedisHashSessionInterface(RedisSessionInterface):
+    # unlike the stock backend, which rewrites the whole serialized session on every request, only the changed keys are
+    # written; the writes go into a pipeline together with the Redis work queued by the request on `session.pipeline`
+    session_class = RedisHashSession
+
+    def _retrieve_session_data(self, store_id: str) -> dict | None:
+        try:
+            return decode_fields(self.client.hgetall(store_id)) or None
+        except redis.ResponseError:
+            return self._migrate_session(store_id)
+
+    def _migrate_session(self, store_id: str) -> dict | None:
+        raw_value, ttl = self.client.get(store_id), self.client.pttl(store_id)
+        if raw_value is None:
+            return None
+
+        value = self.serializer.decode(raw_value)
+
+        pipeline = self.client.pipeline()
+        queue_migration(pipeline, store_id, value, ttl)
+        pipeline.execute()
+
+        return value
+
+    def open_session(self, app: Flask, request: Request) -> RedisHashSession:
+        session = super().open_session(app, request)
+        session.pipeline = self.client.pipeline()
+
+        return session
+
+    def _upsert_session(self, session_lifetime: timedelta, session: RedisHashSession, store_id: str):
+        session.queue_update(store_id, session_lifetime)
+
+    def save_session(self, app: Flask, session: RedisHashSession, response: Response):
+        super().save_session(app, session, response)
+
+        # an empty session is not stored, but the work queued by the request still has to be done
+        if session.pipeline is not None and len(session.pipeline):
+            session.pipeline.execute()
@@ -0,0 +1,49 @@
+from threading import RLock
+
+import mongomock
+from mongomock.collection import Cursor
+
+__all__ = ['serialized_mongomock_client']
+
+# mongomock is not thread-safe, so concurrent requests or voters take turns on every command of the stand-in; commands still
+# interleave between each other the way they do on a server, which is what the races of the site are about
+_SERIALIZED_TYPES = (mongomock.MongoClient, mongomock.Database, mongomock.Collection, Cursor)
+
+
+def _serialized(value, lock: RLock):
+    return _Serialized(value, lock) if isinstance(value, _SERIALIZED_TYPES) else value
+
+
+class _Serialized:
+    def __init__(self, target, lock: RLock):
+        self._target = target
+        self._lock = lock
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return _serialized(attribute, self._lock)
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return _serialized(attribute(*args, **kwargs), self._lock)
+
+        return call
+
+    def __getitem__(self, key):
+        with self._lock:
+            return _serialized(self._target[key], self._lock)
+
+    def __iter__(self):
+        # cursors are evaluated lazily, the whole result is fetched under the lock
+        with self._lock:
+            return iter(list(self._target))
+
+    def __next__(self):
+        with self._lock:
+            return next(self._target)
+
+
+def serialized_mongomock_client(*args, **kwargs) -> _Serialized:
+    # accepts the arguments of `pymongo.MongoClient`, so it can stand in for it before the modules of the site are imported
+    return _Serialized(mongomock.MongoClient(*args, **kwargs), RLock())
@@ -0,0 +1,65 @@
+import os
+from datetime import timedelta
+
+import redis
+
+from session_store import read_session, SESSION_KEY_PREFIX
+
+__all__ = ['SYNC_INDEX_PREFIX', 'sync_key', 'index_sync_token', 'resolve_sync_token', 'backfill_sync_index']
+
+SYNC_INDEX_PREFIX = 'sync:'
+
+
+def sync_key(token: str) -> str:
+    return f'{SYNC_INDEX_PREFIX}{token}'
+
+
+def index_sync_token(redis_conn: redis.Redis, token: str, session_key: str, ttl: timedelta | int):
+    # the index entry is refreshed together with the session, so both expire at (roughly) the same time
+    redis_conn.set(sync_key(token), session_key, ex=ttl)
+
+
+def resolve_sync_token(redis_conn: redis.Redis, token: str) -> dict | None:
+    session_key = redis_conn.get(sync_key(token))
+
+    if session_key is None:
+        return None
+
+    value = read_session(redis_conn, session_key)
+
+    if value is None:
+        # session has already expired, the index entry is dangling
+        redis_conn.delete(sync_key(token))
+        return None
+
+    if value.get('name') != token:
+        return None
+
+    return value
+
+
+def backfill_sync_index(redis_conn: redis.Redis, session_key_prefix: str = SESSION_KEY_PREFIX) -> int:
+    indexed_sessions = 0
+
+    for session_key in redis_conn.scan_iter(match=f'{session_key_prefix}*', count=1000):
+        value, ttl = read_session(redis_conn, session_key), redis_conn.ttl(session_key)
+
+        if value is None or ttl == -2:
+            continue
+
+        token = value.get('name')
+        if token is None:
+            continue
+
+        index_sync_token(redis_conn, token, session_key.decode(), ttl if ttl > 0 else None)
+        indexed_sessions += 1
+
+    return indexed_sessions
+
+
+if __name__ == '__main__':
+    REDIS_ADDRESS = os.getenv('REDIS_ADDRESS')
+    REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
+
+    redis_client = redis.from_url(f'redis://default:{REDIS_PASSWORD}@{REDIS_ADDRESS}')
+    print(f'Indexed {backfill_sync_index(redis_client)} sessions')
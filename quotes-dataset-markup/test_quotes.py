@@ -0,0 +1,14 @@
+import pytest
+
+import reference_quotes
+from bench_quotes import DATA_DIR, load_texts, mismatches, tagged_variants
+
+
+# every source normalizes (or rejects) the quotes of both pickles exactly like the reference does, with the tags at the start,
+# in the middle and glued together, as they appear in the raw dumps
+@pytest.mark.parametrize('dataset', ['funny_quotes', 'not_funny_quotes'])
+def test_normalization_matches_reference(dataset: str):
+    texts = tagged_variants(load_texts(DATA_DIR / f'{dataset}.pkl'))
+    differences = mismatches(texts, reference_quotes)
+
+    assert not differences, f'{len(differences)} of {len(texts)} texts differ from the reference, e.g. {differences[:5]}'
@@ -0,0 +1,121 @@
+import os
+import random
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import pytest
+
+# `db` creates its client on import, the tests only use the collections of their own database
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:1/')
+
+import db  # noqa: E402
+import quote_queries  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+from stand_ins import serialized_mongomock_client  # noqa: E402
+
+# concurrent `db.apply_vote` calls against the server of `TEST_MONGO_URI`, or against mongomock executing one command at a time
+TEST_MONGO_URI = os.getenv('TEST_MONGO_URI')
+TEST_DATABASE = 'quotes-dataset-test'
+
+QUOTES = 100
+WORKERS = 32
+
+
+class _RecordedCollection:
+    # records what the concurrent voters get back from the collection, the votes are checked against it afterwards
+    def __init__(self, collection):
+        self.collection = collection
+        self.vote_totals = defaultdict(list)
+        self.inserts = Counter()
+        self.lock = Lock()
+
+    def __getattr__(self, name: str):
+        return getattr(self.collection, name)
+
+    def find_one_and_update(self, query: dict, *args, **kwargs):
+        quote = self.collection.find_one_and_update(query, *args, **kwargs)
+
+        if quote is not None:
+            with self.lock:
+                self.vote_totals[str(quote['_id'])].append(quote['positive_votes'] + quote['negative_votes'])
+
+        return quote
+
+    def update_one(self, *args, **kwargs):
+        result = self.collection.update_one(*args, **kwargs)
+
+        if result.upserted_id is not None:
+            with self.lock:
+                self.inserts[str(result.upserted_id)] += 1
+
+        return result
+
+
+@pytest.fixture
+def recorded() -> tuple[_RecordedCollection, _RecordedCollection]:
+    mongo_client = MongoClient(TEST_MONGO_URI) if TEST_MONGO_URI else serialized_mongomock_client()
+    database = mongo_client[TEST_DATABASE]
+
+    for name in ('current-quotes', 'processed-quotes', 'reported-quotes'):
+        database[name].delete_many({})
+
+    current_quotes = _RecordedCollection(database['current-quotes'])
+    processed_quotes = _RecordedCollection(database['processed-quotes'])
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(db, 'current_quotes_collection', current_quotes)
+        monkeypatch.setattr(db, 'processed_quotes_collection', processed_quotes)
+        monkeypatch.setattr(db, 'reported_quotes_collection', database['reported-quotes'])
+
+        yield current_quotes, processed_quotes
+
+    mongo_client.drop_database(TEST_DATABASE)
+
+
+def _insert_quotes() -> list[str]:
+    inserted = db.current_quotes_collection.insert_many(
+        [{'text': f'quote #{index}', 'positive_votes': 0, 'negative_votes': 0, 'nsfw': 0, 'channel_link': '', 'channel_name': '',
+          'content_hash': db.content_hash(f'quote #{index}')} for index in range(QUOTES)])
+
+    return [str(quote_id) for quote_id in inserted.inserted_ids]
+
+
+def _vote(vote: tuple[str, str]) -> bool:
+    # whether the vote has been counted, the ones that come after the finalization are reported to the voter
+    try:
+        db.apply_vote(*vote)
+    except db.QuoteProcessedError:
+        return False
+
+    return True
+
+
+# a quote is decided by a majority of `VOTES_THRESHOLD` votes, so some of the votes always race with its finalization
+@pytest.mark.parametrize('votes_per_quote', [quote_queries.VOTES_THRESHOLD, 2 * quote_queries.VOTES_THRESHOLD])
+def test_concurrent_votes(recorded: tuple[_RecordedCollection, _RecordedCollection], votes_per_quote: int):
+    current_quotes, processed_quotes = recorded
+    rng = random.Random(42)
+    quote_ids = _insert_quotes()
+
+    votes = [(rng.choice(('positive', 'negative')), quote_id) for quote_id in quote_ids for _ in range(votes_per_quote)]
+    rng.shuffle(votes)
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        counted = list(executor.map(_vote, votes))
+
+    assert not all(counted), 'no vote has come after the finalization of its quote'
+
+    # no lost votes: every vote is either counted by its own increment or reported to the voter as too late
+    counted_votes = Counter(quote_id for (_, quote_id), is_counted in zip(votes, counted) if is_counted)
+    for quote_id in quote_ids:
+        assert sorted(current_quotes.vote_totals[quote_id]) == list(range(1, counted_votes[quote_id] + 1)), \
+            f'votes of {quote_id} were lost'
+
+    # finalization happens exactly once: every quote is moved, and inserted into the processed quotes by one voter only
+    assert current_quotes.count_documents({}) == 0, 'finalized quotes were left in the current collection'
+    assert sorted(str(quote['_id']) for quote in processed_quotes.find()) == sorted(quote_ids)
+    assert processed_quotes.inserts == Counter(quote_ids), 'a quote was inserted more than once'
+
+    for quote in processed_quotes.find():
+        assert quote['positive_votes'] + quote['negative_votes'] == quote_queries.VOTES_THRESHOLD
@@ -0,0 +1,89 @@
+import os
+import secrets
+from dataclasses import dataclass
+
+import redis
+import redis.asyncio
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from quote_queries import TOUCH
+
+# the layout of the write-behind buffer in Redis, shared by `vote_buffer` and `async_vote_buffer`, so that both serving modes
+# can buffer into and flush the same batches
+
+__all__ = ['WRITE_BEHIND', 'FLUSH_SIZE', 'FLUSH_INTERVAL', 'BUFFER_KEY', 'FLUSHING_KEY', 'BATCH_ID_FIELD', 'LOCK_KEY',
+           'LOCK_TIMEOUT', 'VOTE_FIELDS', 'vote_field', 'queue_increment', 'buffer_full', 'new_batch_id', 'VoteBatch']
+
+WRITE_BEHIND = os.getenv('VOTES_WRITE_BEHIND') is not None
+FLUSH_SIZE = int(os.getenv('VOTES_FLUSH_SIZE', 500))
+FLUSH_INTERVAL = float(os.getenv('VOTES_FLUSH_INTERVAL', 5))
+
+# increments are accumulated in a Redis hash, which doubles as the replay log: it survives restarts of the web
+# process, and a batch that was taken for flushing stays under FLUSHING_KEY until it has been written to Mongo;
+# every batch carries an id, which is recorded on the quotes it has been applied to, so a replayed batch (after a crash
+# between the write and the cleanup, or by a flusher that has taken over an expired lock) is not applied twice
+BUFFER_KEY = 'votes-buffer'
+FLUSHING_KEY = 'votes-buffer:flushing'
+BATCH_ID_FIELD = 'batch'
+LOCK_KEY = 'votes-buffer:lock'
+LOCK_TIMEOUT = 60
+# only the batch being flushed can be replayed, a few of the latest ids per quote are enough
+APPLIED_BATCHES_KEPT = 8
+
+VOTE_FIELDS = {'positive': 'positive_votes', 'negative': 'negative_votes'}
+
+
+def vote_field(vote: str) -> str:
+    if vote not in VOTE_FIELDS:
+        raise ValueError(f'Unknown vote type: {vote}')
+
+    return VOTE_FIELDS[vote]
+
+
+def queue_increment(pipeline: redis.client.Pipeline | redis.asyncio.client.Pipeline, internal_id: str, field: str):
+    ObjectId(internal_id)  # reject malformed ids before they get into the buffer
+
+    pipeline.hincrby(BUFFER_KEY, f'{internal_id}:{field}', 1)
+    pipeline.hlen(BUFFER_KEY)
+
+
+def buffer_full(results: list) -> bool:
+    # the replies of the pipeline of `queue_increment`
+    return results[-1] >= FLUSH_SIZE
+
+
+def new_batch_id() -> str:
+    return secrets.token_hex(8)
+
+
+@dataclass
+class VoteBatch:
+    batch_id: str
+    increments: dict[ObjectId, dict[str, int]]
+
+    @classmethod
+    def from_fields(cls, fields: dict[bytes, bytes]) -> 'VoteBatch':
+        # the buffered `HINCRBY` counters of the hash taken for flushing, which has been given its id by then
+        batch_id, increments = None, {}
+
+        for key, value in fields.items():
+            if key.decode() == BATCH_ID_FIELD:
+                batch_id = value.decode()
+                continue
+
+            internal_id, field = key.decode().split(':')
+            increments.setdefault(ObjectId(internal_id), {})[field] = int(value)
+
+        return cls(batch_id, increments)
+
+    def operations(self) -> list[UpdateOne]:
+        applied_batch = {'applied_batches': {'$each': [self.batch_id], '$slice': -APPLIED_BATCHES_KEPT}}
+
+        return [UpdateOne({'_id': internal_id, 'applied_batches': {'$ne': self.batch_id}},
+                          {'$inc': fields, '$push': applied_batch, **TOUCH})
+                for internal_id, fields in self.increments.items()]
+
+    def voted_ids(self) -> list[ObjectId]:
+        # the quotes that may have collected enough votes to be finalized
+        return [internal_id for internal_id, fields in self.increments.items() if fields.keys() & VOTE_FIELDS.values()]
@@ -0,0 +1,112 @@
+import logging
+import os
+from contextlib import suppress
+from threading import Event, Thread
+
+import redis
+from redis.exceptions import LockNotOwnedError
+
+from db import current_quotes_collection, settle_quote
+from metrics import InstrumentedRedisConnection
+from vote_batches import (BATCH_ID_FIELD, buffer_full, BUFFER_KEY, FLUSH_INTERVAL, FLUSHING_KEY, LOCK_KEY, LOCK_TIMEOUT,
+                          new_batch_id, queue_increment, vote_field, VoteBatch, WRITE_BEHIND)
+
+__all__ = ['WRITE_BEHIND', 'buffer_vote', 'buffer_nsfw', 'request_flush', 'flush_votes', 'start_flusher']
+
+REDIS_ADDRESS = os.getenv('REDIS_ADDRESS')
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
+
+redis_conn = redis.from_url(f'redis://default:{REDIS_PASSWORD}@{REDIS_ADDRESS}', connection_class=InstrumentedRedisConnection)
+
+logger = logging.getLogger(__name__)
+
+# wakes up the flusher of the process before its interval when the buffer is full, however many votes notice it
+_flush_requested = Event()
+
+
+def _buffer_increment(internal_id: str, field: str):
+    pipeline = redis_conn.pipeline()
+    queue_increment(pipeline, internal_id, field)
+
+    if buffer_full(pipeline.execute()):
+        request_flush()
+
+
+def buffer_vote(vote: str, internal_id: str) -> bool:
+    _buffer_increment(internal_id, vote_field(vote))
+
+    # the outcome of the vote is only known at flush time, so the client simply moves on
+    return True
+
+
+def buffer_nsfw(internal_id: str):
+    _buffer_increment(internal_id, 'nsfw')
+
+
+def request_flush():
+    _flush_requested.set()
+
+
+def _discard_batch(batch_id: str):
+    # only the batch that has been applied, a flusher that has lost its lock must not delete the next one
+    with redis_conn.pipeline() as pipeline:
+        try:
+            pipeline.watch(FLUSHING_KEY)
+            if pipeline.hget(FLUSHING_KEY, BATCH_ID_FIELD) == batch_id.encode():
+                pipeline.multi()
+                pipeline.delete(FLUSHING_KEY)
+                pipeline.execute()
+        except redis.WatchError:  # taken over and discarded by another flusher
+            pass
+
+
+def flush_votes() -> int:
+    lock = redis_conn.lock(LOCK_KEY, timeout=LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+
+    try:
+        # a leftover batch means that the previous flush has crashed, so it is replayed first
+        if not redis_conn.exists(FLUSHING_KEY):
+            try:
+                redis_conn.rename(BUFFER_KEY, FLUSHING_KEY)
+            except redis.ResponseError:  # nothing has been buffered
+                return 0
+
+        # a replayed batch keeps the id it was given the first time
+        redis_conn.hsetnx(FLUSHING_KEY, BATCH_ID_FIELD, new_batch_id())
+        batch = VoteBatch.from_fields(redis_conn.hgetall(FLUSHING_KEY))
+
+        if batch.increments:
+            current_quotes_collection.bulk_write(batch.operations(), ordered=False)
+            # the lock is extended after every step, so that a slow flush is not taken over midway
+            lock.reacquire()
+
+        if voted_ids := batch.voted_ids():
+            for current_quote in current_quotes_collection.find({'_id': {'$in': voted_ids}}):
+                settle_quote(current_quote)
+            lock.reacquire()
+
+        _discard_batch(batch.batch_id)
+
+        return len(batch.increments)
+    finally:
+        # the lock may have expired and been taken over
+        with suppress(LockNotOwnedError):
+            lock.release()
+
+
+def _flush_periodically():
+    while True:
+        # a full buffer cuts the wait short
+        _flush_requested.wait(FLUSH_INTERVAL)
+        _flush_requested.clear()
+
+        try:
+            flush_votes()
+        except Exception:
+            logger.exception('Flushing of buffered votes failed')
+
+
+def start_flusher():
+    Thread(target=_flush_periodically, daemon=True).start()
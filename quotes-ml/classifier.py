@@ -0,0 +1,47 @@
+import os
+from hashlib import file_digest, sha1
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import torch
+from transformers import BertForSequenceClassification, BertTokenizerFast
+
+__all__ = ['MODEL_DIR', 'MAX_LENGTH', 'load_tokenizer', 'load_model', 'model_fingerprint', 'predict_proba']
+
+MODEL_DIR = Path(os.getenv('MODEL_DIR', Path(__file__).parent.parent / 'model'))
+MAX_LENGTH = 200
+
+
+def load_tokenizer(model_dir: Path = MODEL_DIR) -> BertTokenizerFast:
+    return BertTokenizerFast.from_pretrained(model_dir)
+
+
+def load_model(model_dir: Path = MODEL_DIR) -> BertForSequenceClassification:
+    # weights (`model.safetensors`) are not stored in the repository, see README
+    model = BertForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+
+    return model
+
+
+def model_fingerprint(model_dir: Path = MODEL_DIR) -> str:
+    # changes whenever the contents of any file of the model do, so that the results computed with another model can be
+    # told apart, while a fresh copy of the same model (e.g. after a deploy) keeps its fingerprint
+    fingerprint = sha1()
+
+    for path in sorted(path for path in model_dir.iterdir() if path.is_file()):
+        with open(path, 'rb') as model_file:
+            fingerprint.update(f'{path.name}:{file_digest(model_file, "sha1").hexdigest()}\n'.encode('utf-8'))
+
+    return fingerprint.hexdigest()[:12]
+
+
+@torch.inference_mode()
+def predict_proba(texts: Sequence[str], model: torch.nn.Module, tokenizer: BertTokenizerFast,
+                  max_length: int = MAX_LENGTH) -> np.ndarray:
+    # probability of every text being funny; the batch is only padded up to its longest text
+    inputs = tokenizer(list(texts), padding='longest', truncation=True, max_length=max_length, return_tensors='pt')
+    logits = model(**inputs).logits
+
+    return torch.softmax(logits, dim=-1)[:, 1].numpy()
@@ -0,0 +1,176 @@
+import argparse
+import os
+import pickle
+from hashlib import file_digest
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from sklearn.model_selection import train_test_split
+
+from near_duplicates import minhash_signatures, NearDuplicateIndex
+
+__all__ = ['DATA_DIR', 'DATASET_PATH', 'clean_text', 'list2clean_list', 'convert', 'open_dataset', 'iter_batches', 'load_split',
+           'dataset_fingerprint']
+
+DATA_DIR = Path(__file__).parent.parent / 'data'
+DATASET_PATH = Path(os.getenv('QUOTES_DATASET_PATH', DATA_DIR / 'quotes.arrow'))
+# the index persisted by the ingestion of the markup site, see `near_duplicates.INDEX_PATH`
+NEAR_DUPLICATES_INDEX_PATH = Path(os.getenv('NEAR_DUPLICATES_INDEX_PATH', DATA_DIR / 'near-duplicates.npz'))
+
+# pickled lists of quotes the dataset is converted from, with their labels
+SOURCES = {
+    'funny_quotes': 1,
+    'not_funny_quotes': 0
+}
+
+# the split of the training notebook, except for the test quotes that are near-duplicates of the training data (see
+# `convert`), so `export.py parity` compares against a smaller test split than the notebook unless `--keep-near-duplicates`
+TEST_SIZE = {1: 0.3, 0: 0.15}
+SPLIT_SEED = 17
+
+RECORD_BATCH_SIZE = 4096
+
+SCHEMA = pa.schema([
+    ('text', pa.string()),
+    ('label', pa.int8()),
+    ('source', pa.dictionary(pa.int8(), pa.string())),
+    ('split', pa.dictionary(pa.int8(), pa.string()))
+])
+
+EXCLAMATION_TABLE = str.maketrans('!', '.')
+QUOTATION_MARKS_TABLE = str.maketrans('', '', '"\'')
+# the order matters, e.g. `?..` has to be collapsed before `..`
+PUNCTUATION_REPLACEMENTS = (('?..', '?'), ('?.', '?'), ('\n\n', '\n'), ('...', '.'), ('..', '.'), ('  ', ' '))
+
+
+def clean_text(quote: str) -> str:
+    # the cleaning of the notebook; quotation marks are removed at the very end, since that can bring dots together
+    clean_quote = quote + '.' if quote[-1].isalpha() else quote
+    clean_quote = clean_quote.translate(EXCLAMATION_TABLE)
+
+    for old, new in PUNCTUATION_REPLACEMENTS:
+        clean_quote = clean_quote.replace(old, new)
+
+    return clean_quote.translate(QUOTATION_MARKS_TABLE)
+
+
+def list2clean_list(quotes: list[str]) -> list[str]:
+    return [clean_text(quote) for quote in quotes]
+
+
+def _split_rows(source: str, label: int) -> Iterator[tuple[str, int, str, str]]:
+    with open(DATA_DIR / f'{source}.pkl', 'rb') as data_file:
+        quotes = list2clean_list(pickle.load(data_file))
+
+    train_quotes, test_quotes = train_test_split(quotes, test_size=TEST_SIZE[label], random_state=SPLIT_SEED)
+
+    for split, split_quotes in (('train', train_quotes), ('test', test_quotes)):
+        # `drop_duplicates` of the notebook
+        for quote in dict.fromkeys(split_quotes):
+            yield quote, label, source, split
+
+
+def _dictionary_array(values: tuple[str, ...]) -> pa.DictionaryArray:
+    categories = list(dict.fromkeys(values))
+    codes = {category: code for code, category in enumerate(categories)}
+
+    return pa.DictionaryArray.from_arrays(pa.array([codes[value] for value in values], pa.int8()), pa.array(categories, pa.string()))
+
+
+def _training_index(train_texts: list[str], index_path: Path) -> NearDuplicateIndex:
+    # the ingested quotes reach the training data too, through the annotated quotes of `votes_export.py`
+    index = NearDuplicateIndex.load(index_path) if index_path.exists() else NearDuplicateIndex()
+    index.add([f'train:{position}' for position in range(len(train_texts))], minhash_signatures(train_texts))
+
+    return index
+
+
+def _without_leaked_near_duplicates(rows: list[tuple[str, int, str, str]],
+                                    index_path: Path = NEAR_DUPLICATES_INDEX_PATH) -> list[tuple[str, int, str, str]]:
+    # `drop_duplicates` only catches exact copies, reposts of a training quote would still be scored as unseen
+    index = _training_index([text for text, _, _, split in rows if split == 'train'], index_path)
+
+    test_positions = [position for position, (_, _, _, split) in enumerate(rows) if split == 'test']
+    matches = index.query(minhash_signatures([rows[position][0] for position in test_positions]))
+    leaked = {position: match[0] for position, match in zip(test_positions, matches) if match is not None}
+
+    train_matches = sum(key.startswith('train:') for key in leaked.values())
+    print(f'Dropped {len(leaked)} test quotes that are near-duplicates of the training data: {train_matches} of train quotes, '
+          f'{len(leaked) - train_matches} of ingested ones')
+
+    return [row for position, row in enumerate(rows) if position not in leaked]
+
+
+def convert(dataset_path: Path = DATASET_PATH, drop_near_duplicates: bool = True) -> int:
+    # the quotes are cleaned and split once, the result is an uncompressed Arrow file that can be memory-mapped
+    rows = [row for source, label in SOURCES.items() for row in _split_rows(source, label)]
+    if drop_near_duplicates:
+        rows = _without_leaked_near_duplicates(rows)
+
+    texts, labels, sources, splits = zip(*rows)
+
+    table = pa.table([
+        pa.array(texts, pa.string()),
+        pa.array(labels, pa.int8()),
+        _dictionary_array(sources),
+        _dictionary_array(splits)
+    ], schema=SCHEMA)
+
+    with pa.OSFile(str(dataset_path), 'wb') as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+        writer.write_table(table, max_chunksize=RECORD_BATCH_SIZE)
+
+    return table.num_rows
+
+
+def _check_converted(dataset_path: Path):
+    if not dataset_path.exists():
+        raise FileNotFoundError(f'{dataset_path} does not exist, run `python dataset.py` to convert the pickled quotes')
+
+
+def _open_reader(dataset_path: Path) -> pa.ipc.RecordBatchFileReader:
+    _check_converted(dataset_path)
+    return pa.ipc.open_file(pa.memory_map(str(dataset_path)))
+
+
+def open_dataset(dataset_path: Path = DATASET_PATH) -> pa.Table:
+    # the columns point into the memory-mapped file, nothing is copied until it is accessed
+    return _open_reader(dataset_path).read_all()
+
+
+def _filter_split(batch: pa.RecordBatch | pa.Table, split: str | None):
+    return batch if split is None else batch.filter(pc.equal(batch['split'].cast(pa.string()), split))
+
+
+def iter_batches(dataset_path: Path = DATASET_PATH, split: str | None = None) -> Iterator[pa.RecordBatch]:
+    reader = _open_reader(dataset_path)
+
+    for index in range(reader.num_record_batches):
+        yield _filter_split(reader.get_batch(index), split)
+
+
+def load_split(split: str, dataset_path: Path = DATASET_PATH) -> tuple[list[str], np.ndarray]:
+    table = _filter_split(open_dataset(dataset_path), split)
+
+    return table['text'].to_pylist(), table['label'].to_numpy().astype(np.int64)
+
+
+def dataset_fingerprint(dataset_path: Path = DATASET_PATH) -> str:
+    # changes whenever the converted quotes do, so the caches computed from a split are not reused after a new conversion,
+    # while converting the same quotes once more keeps them
+    _check_converted(dataset_path)
+
+    with open(dataset_path, 'rb') as dataset_file:
+        return file_digest(dataset_file, 'sha1').hexdigest()[:12]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the pickled quotes into a memory-mappable Arrow dataset')
+    parser.add_argument('--output', type=Path, default=DATASET_PATH)
+    parser.add_argument('--keep-near-duplicates', action='store_true',
+                        help='keep the test quotes similar to the training data, which is the split of the notebook')
+    args = parser.parse_args()
+
+    print(f'Converted {convert(args.output, not args.keep_near_duplicates)} quotes into {args.output}')
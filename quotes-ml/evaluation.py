@@ -0,0 +1,124 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from classifier import load_model, load_tokenizer, model_fingerprint, MODEL_DIR
+from dataset import DATASET_PATH, dataset_fingerprint
+from training import DynamicPaddingCollator, LengthBucketSampler, load_tokenized_split, TokenizedQuotes, TOKENS_CACHE_DIR
+
+__all__ = ['softmax', 'compute_logits', 'load_logits', 'threshold_metrics', 'sweep_thresholds', 'roc_auc', 'choose_threshold']
+
+EVAL_BATCH_SIZE = 64
+# thresholds of the notebook
+THRESHOLDS_GRID = np.arange(0, 1, 0.05)
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exponents = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exponents / exponents.sum(axis=-1, keepdims=True)
+
+
+@torch.inference_mode()
+def compute_logits(model: torch.nn.Module, quotes: TokenizedQuotes, batch_size: int = EVAL_BATCH_SIZE) -> np.ndarray:
+    collator = DynamicPaddingCollator()
+    logits = np.empty((len(quotes), model.config.num_labels), dtype=np.float32)
+
+    for indices in LengthBucketSampler(quotes.lengths, batch_size, shuffle=False):
+        batch = collator([quotes[index] for index in indices])
+        del batch['labels']
+        logits[indices] = model(**batch).logits.numpy()
+
+    return logits
+
+
+def load_logits(split: str, model_dir: Path = MODEL_DIR, cache_dir: Path = TOKENS_CACHE_DIR,
+                dataset_path: Path = DATASET_PATH) -> tuple[np.ndarray, np.ndarray]:
+    # the model only runs over the split once, every later evaluation of the same model and dataset reads the logits from the cache
+    quotes = load_tokenized_split(split, load_tokenizer(model_dir), cache_dir, dataset_path)
+    cache_path = cache_dir / f'{split}-logits-{dataset_fingerprint(dataset_path)}-{model_fingerprint(model_dir)}.npy'
+
+    if cache_path.exists():
+        return np.load(cache_path), quotes.labels
+
+    logits = compute_logits(load_model(model_dir), quotes)
+    np.save(cache_path, logits)
+
+    return logits, quotes.labels
+
+
+def threshold_metrics(probabilities: np.ndarray, labels: np.ndarray, thresholds: np.ndarray) -> dict[str, np.ndarray]:
+    # metrics of `probability >= threshold` for all thresholds at once: after sorting the probabilities, the quotes
+    # predicted as funny are a suffix, and its true positives are a suffix sum of the labels
+    order = np.argsort(probabilities, kind='stable')
+    sorted_probabilities = probabilities[order]
+    positives_from = np.concatenate([np.cumsum(labels[order][::-1])[::-1], [0]])
+
+    total = len(labels)
+    positives = int(labels.sum())
+    negatives = total - positives
+
+    start = np.searchsorted(sorted_probabilities, thresholds, side='left')
+    predicted = total - start
+    true_positives = positives_from[start]
+    false_positives = predicted - true_positives
+
+    return {
+        'threshold': thresholds,
+        'accuracy': (true_positives + negatives - false_positives) / total,
+        'precision': np.divide(true_positives, predicted, out=np.ones(len(thresholds)), where=predicted > 0),
+        'recall': true_positives / max(positives, 1),
+        'f1': 2 * true_positives / np.maximum(predicted + positives, 1),
+        'fpr': false_positives / max(negatives, 1)
+    }
+
+
+def sweep_thresholds(probabilities: np.ndarray, labels: np.ndarray) -> dict[str, np.ndarray]:
+    # every distinct probability is a threshold, anything in between gives the same predictions
+    return threshold_metrics(probabilities, labels, np.unique(probabilities))
+
+
+def roc_auc(sweep: dict[str, np.ndarray]) -> float:
+    # the sweep goes from the lowest threshold (everything is funny) to the highest one
+    tpr = np.concatenate([sweep['recall'], [0]])[::-1]
+    fpr = np.concatenate([sweep['fpr'], [0]])[::-1]
+
+    return float(np.trapz(tpr, fpr))
+
+
+def choose_threshold(sweep: dict[str, np.ndarray], metric: str = 'f1') -> float:
+    return float(sweep['threshold'][np.argmax(sweep[metric])])
+
+
+def _print_metrics(metrics: dict[str, np.ndarray]):
+    columns = ('threshold', 'accuracy', 'precision', 'recall', 'f1')
+    print(''.join(f'{column:>11}' for column in columns))
+
+    for row in range(len(metrics['threshold'])):
+        print(''.join(f'{metrics[column][row]:>11.4f}' for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Metrics of the classifier over every decision threshold')
+    parser.add_argument('--split', choices=('train', 'test'), default='test')
+    parser.add_argument('--model-dir', type=Path, default=MODEL_DIR)
+    parser.add_argument('--metric', choices=('f1', 'accuracy', 'precision', 'recall'), default='f1',
+                        help='metric the operating threshold is chosen by')
+    args = parser.parse_args()
+
+    initial_time = time.perf_counter()
+    split_logits, split_labels = load_logits(args.split, args.model_dir)
+    print(f'Loaded the logits of {len(split_labels)} quotes in {time.perf_counter() - initial_time:.2f} seconds')
+
+    initial_time = time.perf_counter()
+    split_probabilities = softmax(split_logits)[:, 1]
+    threshold_sweep = sweep_thresholds(split_probabilities, split_labels)
+    operating_threshold = choose_threshold(threshold_sweep, args.metric)
+    sweep_time = time.perf_counter() - initial_time
+
+    _print_metrics(threshold_metrics(split_probabilities, split_labels, THRESHOLDS_GRID))
+    _print_metrics(threshold_metrics(split_probabilities, split_labels, np.array([operating_threshold])))
+    print(f'ROC-AUC {roc_auc(threshold_sweep):.4f}, best {args.metric} at the threshold {operating_threshold:.4f} '
+          f'({len(threshold_sweep["threshold"])} thresholds swept in {sweep_time * 1000:.1f} ms)')
@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Sequence
+
+import numpy as np
+import torch
+from sklearn.metrics import f1_score
+
+from classifier import load_model, load_tokenizer, MAX_LENGTH, MODEL_DIR, predict_proba
+from dataset import load_split
+
+__all__ = ['VARIANTS', 'EXPORT_DIR', 'quantize_int8', 'export_variants', 'load_predictor', 'check_parity']
+
+VARIANTS = ('fp32', 'int8', 'onnx', 'onnx-int8')
+EXPORT_DIR = Path(os.getenv('EXPORT_DIR', MODEL_DIR / 'export'))
+
+VARIANT_FILES = {
+    'int8': 'model-int8.pt',
+    'onnx': 'model.onnx',
+    'onnx-int8': 'model-int8.onnx'
+}
+
+ONNX_OPSET = 14
+ONNX_INPUTS = ('input_ids', 'attention_mask', 'token_type_ids')
+
+PARITY_BATCH_SIZE = 64
+# the largest drop of the test F1 compared to the fp32 model that is still considered a match
+MAX_F1_DROP = 0.01
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    # the linear layers get int8 weights with activations quantized on the fly, the embedding tables (most of the
+    # weights because of the 83k vocabulary) are stored as 8-bit rows with their own scale
+    return torch.ao.quantization.quantize_dynamic(model, {
+        torch.nn.Linear: torch.ao.quantization.default_dynamic_qconfig,
+        torch.nn.Embedding: torch.ao.quantization.float_qparams_weight_only_qconfig
+    }, dtype=torch.qint8)
+
+
+def _export_onnx(model: torch.nn.Module, tokenizer, path: Path):
+    # tuples instead of `ModelOutput`, the tracer does not handle dictionaries as outputs
+    model.config.return_dict = False
+    inputs = tokenizer(['Пример цитаты для трассировки.'], return_tensors='pt')
+
+    torch.onnx.export(model, tuple(inputs[name] for name in ONNX_INPUTS), path, input_names=list(ONNX_INPUTS),
+                      output_names=['logits'], opset_version=ONNX_OPSET,
+                      dynamic_axes={**{name: {0: 'batch', 1: 'sequence'} for name in ONNX_INPUTS}, 'logits': {0: 'batch'}})
+
+
+def export_variants(export_dir: Path = EXPORT_DIR):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    export_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = load_tokenizer()
+
+    # the whole module is pickled, so loading it does not allocate the fp32 weights first
+    torch.save(quantize_int8(load_model()), export_dir / VARIANT_FILES['int8'])
+    _export_onnx(load_model(), tokenizer, export_dir / VARIANT_FILES['onnx'])
+    quantize_dynamic(export_dir / VARIANT_FILES['onnx'], export_dir / VARIANT_FILES['onnx-int8'], weight_type=QuantType.QInt8)
+
+    for variant, filename in VARIANT_FILES.items():
+        print(f'{variant:<10} {(export_dir / filename).stat().st_size / 2 ** 20:>8.1f} MB')
+
+
+def _softmax_positive(logits: np.ndarray) -> np.ndarray:
+    exponents = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exponents[:, 1] / exponents.sum(axis=-1)
+
+
+def _onnx_predictor(path: Path, tokenizer, threads: int) -> Callable[[Sequence[str]], np.ndarray]:
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    session = onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+    def predict(texts: Sequence[str]) -> np.ndarray:
+        inputs = tokenizer(list(texts), padding='longest', truncation=True, max_length=MAX_LENGTH, return_tensors='np')
+        logits, = session.run(['logits'], {name: inputs[name].astype(np.int64) for name in ONNX_INPUTS})
+
+        return _softmax_positive(logits)
+
+    return predict
+
+
+def load_predictor(variant: str, export_dir: Path = EXPORT_DIR,
+                   threads: int = torch.get_num_threads()) -> Callable[[Sequence[str]], np.ndarray]:
+    # every variant is wrapped into the same interface as `classifier.predict_proba`
+    if variant not in VARIANTS:
+        raise ValueError(f'Unknown model variant: {variant}')
+
+    tokenizer = load_tokenizer()
+
+    if variant.startswith('onnx'):
+        return _onnx_predictor(export_dir / VARIANT_FILES[variant], tokenizer, threads)
+
+    torch.set_num_threads(threads)
+    model = load_model() if variant == 'fp32' else torch.load(export_dir / VARIANT_FILES[variant], weights_only=False)
+
+    return lambda texts: predict_proba(texts, model, tokenizer)
+
+
+def _predict_in_batches(predict: Callable[[Sequence[str]], np.ndarray], texts: list[str]) -> np.ndarray:
+    return np.concatenate([predict(texts[start:start + PARITY_BATCH_SIZE]) for start in range(0, len(texts), PARITY_BATCH_SIZE)])
+
+
+def check_parity(export_dir: Path = EXPORT_DIR) -> bool:
+    texts, labels = load_split('test')
+    reference = _predict_in_batches(load_predictor('fp32', export_dir), texts)
+    reference_f1 = f1_score(labels, reference >= 0.5)
+    matches = True
+
+    print(f'{"variant":<10}{"F1":>8}{"accuracy":>10}{"agreement":>11}{"max diff":>10}')
+
+    for variant in VARIANTS:
+        probabilities = reference if variant == 'fp32' else _predict_in_batches(load_predictor(variant, export_dir), texts)
+        predictions = probabilities >= 0.5
+        variant_f1 = f1_score(labels, predictions)
+
+        print(f'{variant:<10}{variant_f1:>8.4f}{np.mean(predictions == labels):>10.4f}'
+              f'{np.mean(predictions == (reference >= 0.5)):>11.4f}{np.abs(probabilities - reference).max():>10.4f}')
+
+        if reference_f1 - variant_f1 > MAX_F1_DROP:
+            print(f'{variant} loses {reference_f1 - variant_f1:.4f} F1 compared to fp32')
+            matches = False
+
+    return matches
+
+
+def _current_rss() -> int:
+    # resident pages of the process, linux only
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _measure_variant(variant: str, export_dir: Path, quotes: int, threads: int) -> dict:
+    texts, _ = load_split('test')
+    texts = texts[:quotes]
+
+    initial_time = time.perf_counter()
+    predict = load_predictor(variant, export_dir, threads)
+    load_seconds = time.perf_counter() - initial_time
+
+    # warm-up, the first calls allocate the buffers of the runtime
+    for text in texts[:10]:
+        predict([text])
+
+    latencies = []
+    for text in texts:
+        initial_time = time.perf_counter()
+        predict([text])
+        latencies.append(time.perf_counter() - initial_time)
+
+    return {
+        'load_seconds': load_seconds,
+        'rss_mb': _current_rss() / 2 ** 20,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1000
+    }
+
+
+def run_benchmark(export_dir: Path, quotes: int, threads: int):
+    print(f'{"variant":<10}{"load, s":>9}{"RSS, MB":>9}{"peak, MB":>10}{"p50, ms":>9}{"p99, ms":>9}')
+
+    for variant in VARIANTS:
+        # a fresh interpreter per variant, otherwise the memory of the previous ones is counted as well
+        output = subprocess.run([sys.executable, __file__, 'measure', variant, '--export-dir', str(export_dir),
+                                 '--quotes', str(quotes), '--threads', str(threads)], check=True, capture_output=True, text=True)
+        metrics = json.loads(output.stdout.splitlines()[-1])
+
+        print(f'{variant:<10}{metrics["load_seconds"]:>9.2f}{metrics["rss_mb"]:>9.0f}{metrics["peak_rss_mb"]:>10.0f}'
+              f'{metrics["p50_ms"]:>9.2f}{metrics["p99_ms"]:>9.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantized and ONNX Runtime variants of the classifier')
+    parser.add_argument('command', choices=('export', 'parity', 'benchmark', 'measure'))
+    parser.add_argument('variant', nargs='?', choices=VARIANTS, help='variant to measure, used by `benchmark` internally')
+    parser.add_argument('--export-dir', type=Path, default=EXPORT_DIR)
+    parser.add_argument('--quotes', type=int, default=500, help='number of test quotes to measure the latency on')
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_variants(args.export_dir)
+    elif args.command == 'parity':
+        if not check_parity(args.export_dir):
+            raise SystemExit(1)
+    elif args.command == 'benchmark':
+        run_benchmark(args.export_dir, args.quotes, args.threads)
+    else:
+        if args.variant is None:
+            parser.error('the variant to measure is required')
+
+        print(json.dumps(_measure_variant(args.variant, args.export_dir, args.quotes, args.threads)))
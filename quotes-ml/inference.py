@@ -0,0 +1,148 @@
+import os
+import queue
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from threading import Thread
+from typing import Callable
+
+import numpy as np
+from flask import abort, Flask, jsonify, request
+
+from export import load_predictor
+
+__all__ = ['MicroBatcher', 'app']
+
+MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', 32))
+MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', 5))
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', os.cpu_count()))
+# `fp32`, `int8`, `onnx` or `onnx-int8`, the quantized ones have to be produced by `export.py export` first
+INFERENCE_VARIANT = os.getenv('INFERENCE_VARIANT', 'fp32')
+
+
+@dataclass
+class _PendingRequest:
+    texts: list[str]
+    future: Future = field(default_factory=Future)
+    # a request split across batches gets its result once the last of its texts is predicted
+    probabilities: list[float] = field(default_factory=list)
+
+
+class MicroBatcher:
+    # collects the requests that arrive within `max_wait_ms` of each other into a single forward pass
+    def __init__(self, predict: Callable[[list[str]], np.ndarray], max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        # the request that did not fit into the previous batch and the position of its first text left out
+        self.carried_over: tuple[_PendingRequest, int] | None = None
+
+        Thread(target=self._run, daemon=True).start()
+
+    def submit(self, texts: list[str]) -> Future:
+        pending_request = _PendingRequest(texts)
+        self.requests.put(pending_request)
+
+        return pending_request.future
+
+    def _next_request(self, timeout: float | None) -> tuple[_PendingRequest, int]:
+        if self.carried_over is not None:
+            carried_over, self.carried_over = self.carried_over, None
+            return carried_over
+
+        return self.requests.get(timeout=timeout), 0
+
+    def _collect_batch(self) -> list[tuple[_PendingRequest, int, int]]:
+        # the texts of every request in the batch from `start` to `stop`, at most `max_batch_size` of them in total;
+        # whatever does not fit is carried over to the next batch, ahead of the queued requests
+        batch = []
+        batch_size = 0
+        deadline = None
+
+        while batch_size < self.max_batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+
+            try:
+                pending_request, start = self._next_request(timeout)
+            except queue.Empty:
+                break
+
+            if deadline is None:
+                deadline = time.monotonic() + self.max_wait
+
+            stop = min(len(pending_request.texts), start + self.max_batch_size - batch_size)
+            if stop < len(pending_request.texts):
+                self.carried_over = pending_request, stop
+
+            batch.append((pending_request, start, stop))
+            batch_size += stop - start
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+
+            try:
+                probabilities = self.predict([text for pending_request, start, stop in batch
+                                              for text in pending_request.texts[start:stop]])
+            except Exception as error:
+                for pending_request, _, _ in batch:
+                    pending_request.future.set_exception(error)
+
+                # the rest of a failed request is not predicted
+                self.carried_over = None
+                continue
+
+            offset = 0
+            for pending_request, start, stop in batch:
+                pending_request.probabilities.extend(probabilities[offset:offset + stop - start].tolist())
+                offset += stop - start
+
+                if stop == len(pending_request.texts):
+                    pending_request.future.set_result(pending_request.probabilities)
+
+
+batcher = MicroBatcher(load_predictor(INFERENCE_VARIANT, threads=INFERENCE_THREADS))
+
+app = Flask(__name__)
+
+
+@app.route('/predict_internal', methods=['POST'])
+def predict_single():
+    text = (request.get_json(silent=True) or {}).get('text')
+
+    if not isinstance(text, str):
+        abort(400)
+
+    # same response format as the Hugging Face Space
+    return str(batcher.submit([text]).result()[0])
+
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_bulk():
+    texts = (request.get_json(silent=True) or {}).get('texts')
+
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        abort(400)
+
+    # texts of similar length end up in the same micro-batch, so there is less padding
+    order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+    chunks = [order[start:start + MAX_BATCH_SIZE] for start in range(0, len(order), MAX_BATCH_SIZE)]
+    futures = [batcher.submit([texts[index] for index in chunk]) for chunk in chunks]
+
+    probabilities = [0.0] * len(texts)
+    for chunk, future in zip(chunks, futures):
+        for index, probability in zip(chunk, future.result()):
+            probabilities[index] = probability
+
+    return jsonify(probabilities)
+
+
+if __name__ == '__main__':
+    # the batcher lives in the process, so the server should run a single process with many threads
+    app.run('0.0.0.0', int(os.getenv('PORT', 8000)), threaded=True)
@@ -0,0 +1,57 @@
+import argparse
+import json
+import pickle
+import random
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DEFAULT_DATASET = Path(__file__).parent.parent / 'data' / 'funny_quotes.pkl'
+
+
+def _post(url: str, payload: dict) -> float:
+    data = json.dumps(payload).encode('utf-8')
+    inference_request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+
+    initial_time = time.perf_counter()
+    with urllib.request.urlopen(inference_request) as response:
+        response.read()
+
+    return time.perf_counter() - initial_time
+
+
+def run_load(server_url: str, texts: list[str], requests_count: int, concurrency: int, bulk_size: int):
+    if bulk_size > 1:
+        url = f'{server_url}/predict_batch'
+        payloads = [{'texts': random.sample(texts, bulk_size)} for _ in range(requests_count)]
+    else:
+        url = f'{server_url}/predict_internal'
+        payloads = [{'text': random.choice(texts)} for _ in range(requests_count)]
+
+    initial_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda payload: _post(url, payload), payloads))
+    elapsed_time = time.perf_counter() - initial_time
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f'{requests_count} requests of {max(bulk_size, 1)} quotes with {concurrency} concurrent clients')
+    print(f'p50 {percentiles[49] * 1000:.1f} ms, p99 {percentiles[98] * 1000:.1f} ms')
+    print(f'{requests_count / elapsed_time:.1f} requests/sec, {requests_count * max(bulk_size, 1) / elapsed_time:.1f} quotes/sec')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load generator for the local inference server')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--dataset', type=Path, default=DEFAULT_DATASET)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--bulk-size', type=int, default=1, help='quotes per request, values above 1 use the bulk endpoint')
+    args = parser.parse_args()
+
+    with open(args.dataset, 'rb') as dataset_file:
+        dataset_texts = pickle.load(dataset_file)
+
+    random.seed(42)
+    run_load(args.url, dataset_texts, args.requests, args.concurrency, args.bulk_size)
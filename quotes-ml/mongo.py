@@ -0,0 +1,16 @@
+import os
+
+from pymongo import MongoClient
+
+__all__ = ['client', 'current_quotes_collection', 'processed_quotes_collection', 'reported_quotes_collection']
+
+# same database as the markup site, see `quotes-dataset-markup/db.py`
+MONGO_CLUSTER_ADDRESS = os.getenv('MONGO_CLUSTER_ADDRESS')
+MONGO_ADMIN_PASSWORD = os.getenv('MONGO_ADMIN_PASSWORD')
+MONGO_URI = os.getenv('MONGO_URI', f'mongodb+srv://admin:{MONGO_ADMIN_PASSWORD}@{MONGO_CLUSTER_ADDRESS}/')
+
+client = MongoClient(MONGO_URI)
+
+current_quotes_collection = client['quotes-dataset']['current-quotes']
+processed_quotes_collection = client['quotes-dataset']['processed-quotes']
+reported_quotes_collection = client['quotes-dataset']['reported-quotes']
@@ -0,0 +1,291 @@
+import argparse
+import os
+import random
+import time
+from itertools import chain
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import torch
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+from transformers import BertForSequenceClassification, BertTokenizerFast, Trainer, TrainingArguments
+
+from classifier import MAX_LENGTH
+from dataset import DATASET_PATH, dataset_fingerprint, load_split
+
+__all__ = ['BASE_MODEL', 'TokenizedQuotes', 'load_tokenized_split', 'LengthBucketSampler', 'DynamicPaddingCollator',
+           'BucketedTrainer', 'compute_metrics', 'train']
+
+BASE_MODEL = 'cointegrated/rubert-tiny2'
+TOKENS_CACHE_DIR = Path(os.getenv('TOKENS_CACHE_DIR', Path(__file__).parent / 'cache'))
+
+# every bucket holds that many batches of quotes with close lengths
+BUCKET_BATCHES = 50
+# tensor cores and the vectorized CPU kernels prefer widths divisible by 8
+PAD_TO_MULTIPLE_OF = 8
+
+
+def seed_all(seed_value: int):
+    random.seed(seed_value)
+    np.random.seed(seed_value)
+    torch.manual_seed(seed_value)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed_value)
+
+
+class TokenizedQuotes(torch.utils.data.Dataset):
+    # token ids of all quotes live in one flat array, the quote `i` is `token_ids[offsets[i]:offsets[i + 1]]`
+    def __init__(self, token_ids: np.ndarray, offsets: np.ndarray, labels: np.ndarray):
+        self.token_ids = token_ids
+        self.offsets = offsets
+        self.labels = labels
+        self.lengths = np.diff(offsets)
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str], labels: np.ndarray, tokenizer: BertTokenizerFast, max_length: int = MAX_LENGTH):
+        encoded = tokenizer(list(texts), truncation=True, max_length=max_length)['input_ids']
+
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        token_ids = np.fromiter(chain.from_iterable(encoded), dtype=np.int32, count=int(lengths.sum()))
+
+        return cls(token_ids, np.concatenate([[0], np.cumsum(lengths)]), np.asarray(labels, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as arrays:
+            return cls(arrays['token_ids'], arrays['offsets'], arrays['labels'])
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, token_ids=self.token_ids, offsets=self.offsets, labels=self.labels)
+
+    def __getitem__(self, index: int) -> tuple[np.ndarray, int]:
+        return self.token_ids[self.offsets[index]:self.offsets[index + 1]], self.labels[index]
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+def load_tokenized_split(split: str, tokenizer: BertTokenizerFast, cache_dir: Path = TOKENS_CACHE_DIR,
+                         dataset_path: Path = DATASET_PATH) -> TokenizedQuotes:
+    # the split of a dataset is only tokenized once, remove the cache after changing the tokenizer
+    cache_path = cache_dir / f'{split}-tokens-{dataset_fingerprint(dataset_path)}.npz'
+
+    if cache_path.exists():
+        return TokenizedQuotes.load(cache_path)
+
+    quotes = TokenizedQuotes.from_texts(*load_split(split, dataset_path), tokenizer)
+    quotes.save(cache_path)
+
+    return quotes
+
+
+class LengthBucketSampler(torch.utils.data.Sampler):
+    # yields batches of indices: the shuffled quotes are cut into buckets, every bucket is sorted by length and split
+    # into batches, and the batches are shuffled again, so a batch holds quotes of similar length but stays random
+    def __init__(self, lengths: np.ndarray, batch_size: int, shuffle: bool = True, bucket_batches: int = BUCKET_BATCHES,
+                 seed: int = 0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_batches
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _split(self, indices: np.ndarray) -> list[np.ndarray]:
+        return [indices[start:start + self.batch_size] for start in range(0, len(indices), self.batch_size)]
+
+    def __iter__(self):
+        if not self.shuffle:
+            yield from (batch.tolist() for batch in self._split(np.argsort(self.lengths, kind='stable')))
+            return
+
+        generator = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+
+        # the buckets are multiples of the batch size, so only the very last batch can be incomplete
+        order = generator.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start:start + self.bucket_size]
+            batches.extend(self._split(bucket[np.argsort(self.lengths[bucket], kind='stable')]))
+
+        yield from (batches[index].tolist() for index in generator.permutation(len(batches)))
+
+    def __len__(self) -> int:
+        return -(-len(self.lengths) // self.batch_size)
+
+
+class DynamicPaddingCollator:
+    # pads a batch up to its longest quote instead of `max_length`, or to `pad_to` when it is given
+    def __init__(self, pad_token_id: int = 0, pad_to_multiple_of: int = PAD_TO_MULTIPLE_OF, pad_to: int | None = None):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.pad_to = pad_to
+
+    def __call__(self, items: list[tuple[np.ndarray, int]]) -> dict[str, torch.Tensor]:
+        width = self.pad_to or max(len(token_ids) for token_ids, _ in items)
+        width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = np.full((len(items), width), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(items), width), dtype=np.int64)
+        for row, (token_ids, _) in enumerate(items):
+            input_ids[row, :len(token_ids)] = token_ids
+            attention_mask[row, :len(token_ids)] = 1
+
+        return {
+            'input_ids': torch.from_numpy(input_ids),
+            'attention_mask': torch.from_numpy(attention_mask),
+            'token_type_ids': torch.zeros_like(torch.from_numpy(input_ids)),
+            'labels': torch.tensor([label for _, label in items])
+        }
+
+
+class BucketedTrainer(Trainer):
+    # the data loaders of `Trainer` pad every quote of `TokenizedQuotes` separately and do not group them by length
+    def _bucketed_dataloader(self, dataset: TokenizedQuotes, batch_size: int, shuffle: bool) -> torch.utils.data.DataLoader:
+        sampler = LengthBucketSampler(dataset.lengths, batch_size, shuffle=shuffle, seed=self.args.seed)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=sampler, collate_fn=self.data_collator,
+                                                 num_workers=self.args.dataloader_num_workers,
+                                                 pin_memory=self.args.dataloader_pin_memory)
+
+        return self.accelerator.prepare(dataloader)
+
+    def get_train_dataloader(self) -> torch.utils.data.DataLoader:
+        return self._bucketed_dataloader(self.train_dataset, self._train_batch_size, shuffle=True)
+
+    def get_eval_dataloader(self, eval_dataset: TokenizedQuotes | None = None) -> torch.utils.data.DataLoader:
+        eval_dataset = self.eval_dataset if eval_dataset is None else eval_dataset
+        return self._bucketed_dataloader(eval_dataset, self.args.eval_batch_size, shuffle=False)
+
+    def get_test_dataloader(self, test_dataset: TokenizedQuotes) -> torch.utils.data.DataLoader:
+        return self._bucketed_dataloader(test_dataset, self.args.eval_batch_size, shuffle=False)
+
+    def predict(self, test_dataset: TokenizedQuotes, *args, **kwargs):
+        # the quotes are evaluated sorted by length, the predictions are returned in the order of the dataset
+        output = super().predict(test_dataset, *args, **kwargs)
+
+        restore = np.empty(len(test_dataset), dtype=np.int64)
+        restore[np.argsort(test_dataset.lengths, kind='stable')] = np.arange(len(test_dataset))
+
+        return output._replace(predictions=output.predictions[restore],
+                               label_ids=output.label_ids[restore] if output.label_ids is not None else None)
+
+
+def compute_metrics(pred) -> dict[str, float]:
+    labels = pred.label_ids
+    preds = pred.predictions.argmax(-1)
+
+    return {'acc': accuracy_score(labels, preds), 'f1': f1_score(labels, preds), 'recall': recall_score(labels, preds),
+            'precision': precision_score(labels, preds), 'roc_auc': roc_auc_score(labels, preds)}
+
+
+def train(output_dir: Path, epochs: int, batch_size: int, learning_rate: float) -> BucketedTrainer:
+    seed_all(42)
+
+    tokenizer = BertTokenizerFast.from_pretrained(BASE_MODEL)
+    model = BertForSequenceClassification.from_pretrained(BASE_MODEL, num_labels=2)
+
+    # same arguments as in the notebook
+    training_args = TrainingArguments(
+        output_dir=str(output_dir),
+        num_train_epochs=epochs,
+        learning_rate=learning_rate,
+        per_device_train_batch_size=batch_size,
+        per_device_eval_batch_size=batch_size,
+        eval_strategy='epoch',
+        load_best_model_at_end=True,
+        save_strategy='epoch',
+        seed=17
+    )
+
+    trainer = BucketedTrainer(
+        model=model,
+        tokenizer=tokenizer,
+        args=training_args,
+        train_dataset=load_tokenized_split('train', tokenizer),
+        eval_dataset=load_tokenized_split('test', tokenizer),
+        data_collator=DynamicPaddingCollator(tokenizer.pad_token_id),
+        compute_metrics=compute_metrics
+    )
+    trainer.train()
+
+    return trainer
+
+
+def _padding_ratio(dataloader: torch.utils.data.DataLoader) -> tuple[float, int]:
+    real_tokens = padded_tokens = 0
+
+    for batch in dataloader:
+        real_tokens += int(batch['attention_mask'].sum())
+        padded_tokens += batch['attention_mask'].numel()
+
+    return 1 - real_tokens / padded_tokens, real_tokens
+
+
+def _measure_steps(model: torch.nn.Module, dataloader: torch.utils.data.DataLoader, steps: int, training: bool) -> float:
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    model.train(training)
+    batches = iter(dataloader)
+
+    initial_time = time.perf_counter()
+    real_tokens = 0
+
+    for _, batch in zip(range(steps), batches):
+        real_tokens += int(batch['attention_mask'].sum())
+
+        with torch.set_grad_enabled(training):
+            loss = model(**batch).loss
+
+        if training:
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+
+    return real_tokens / (time.perf_counter() - initial_time)
+
+
+def run_benchmark(batch_size: int, steps: int):
+    # the notebook pads every quote to `max_length` and feeds them in a random order
+    tokenizer = BertTokenizerFast.from_pretrained(BASE_MODEL)
+    model = BertForSequenceClassification.from_pretrained(BASE_MODEL, num_labels=2)
+
+    datasets = {split: load_tokenized_split(split, tokenizer) for split in ('train', 'test')}
+    pipelines = {
+        'max_length': lambda dataset, shuffle: torch.utils.data.DataLoader(
+            dataset, batch_size=batch_size, shuffle=shuffle,
+            collate_fn=DynamicPaddingCollator(tokenizer.pad_token_id, pad_to=MAX_LENGTH)),
+        'bucketed': lambda dataset, shuffle: torch.utils.data.DataLoader(
+            dataset, batch_sampler=LengthBucketSampler(dataset.lengths, batch_size, shuffle=shuffle),
+            collate_fn=DynamicPaddingCollator(tokenizer.pad_token_id))
+    }
+
+    print(f'{"pipeline":<12}{"split":<7}{"padding":>9}{"tokens/sec":>12}{"epoch, s":>10}')
+
+    for name, make_dataloader in pipelines.items():
+        for split, dataset in datasets.items():
+            training = split == 'train'
+            padding_ratio, real_tokens = _padding_ratio(make_dataloader(dataset, training))
+            tokens_per_second = _measure_steps(model, make_dataloader(dataset, training), steps, training)
+
+            print(f'{name:<12}{split:<7}{padding_ratio:>9.1%}{tokens_per_second:>12,.0f}{real_tokens / tokens_per_second:>10.0f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fine-tuning of the classifier with length-bucketed batches')
+    parser.add_argument('command', choices=('train', 'benchmark'))
+    parser.add_argument('--output-dir', type=Path, default=Path('./results'))
+    parser.add_argument('--epochs', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--learning-rate', type=float, default=1e-5)
+    parser.add_argument('--steps', type=int, default=50, help='number of batches the benchmark is timed on')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        train(args.output_dir, args.epochs, args.batch_size, args.learning_rate)
+    else:
+        run_benchmark(args.batch_size, args.steps)
@@ -0,0 +1,86 @@
+import argparse
+import os
+import time
+from typing import Callable, Sequence
+
+import numpy as np
+from pymongo import UpdateOne
+
+from classifier import model_fingerprint
+from export import load_predictor, VARIANTS
+from mongo import current_quotes_collection
+
+__all__ = ['UNCERTAINTY_SCALE', 'ROUND_SPAN', 'uncertainty', 'score_quotes']
+
+SCORING_BATCH_SIZE = int(os.getenv('SCORING_BATCH_SIZE', 256))
+SCORING_VARIANT = os.getenv('SCORING_VARIANT', 'fp32')
+
+# the markup site sorts by the integer distance from the decision boundary, `0` being the least certain quote
+UNCERTAINTY_SCALE = 10 ** 6
+# the quotes are served by `serving_rank`, the scoring round followed by the uncertainty: every run that scores quotes starts
+# a new round, so they are served after the rounds the annotators are walking through instead of behind their positions;
+# a new model rescores every quote into a new round, which sends the annotators through the whole queue once again
+ROUND_SPAN = 10 ** 7
+TOUCH = {'$currentDate': {'updated_at': True}}
+
+
+def uncertainty(probabilities: np.ndarray) -> np.ndarray:
+    return np.rint(np.abs(probabilities - 0.5) * 2 * UNCERTAINTY_SCALE).astype(np.int64)
+
+
+def _next_round() -> int:
+    last_ranked = current_quotes_collection.find_one({'serving_rank': {'$exists': True}}, {'serving_rank': 1},
+                                                     sort=[('serving_rank', -1)])
+
+    return 1 if last_ranked is None else last_ranked['serving_rank'] // ROUND_SPAN + 1
+
+
+def score_quotes(predict: Callable[[Sequence[str]], np.ndarray], fingerprint: str, batch_size: int = SCORING_BATCH_SIZE) -> int:
+    # only the quotes that have not been scored by the current model yet, so new quotes are picked up incrementally
+    # and everything is rescored once after the model is replaced; the scored quotes leave the range of the `scored_by`
+    # index that is queried, so every batch only reads the quotes it scores (the indexes are created by
+    # `quotes-dataset-markup/indexes.py`)
+    query = {'scored_by': {'$ne': fingerprint}}
+    scoring_round = None
+    scored = 0
+
+    while quotes := list(current_quotes_collection.find(query, {'text': 1}).limit(batch_size)):
+        probabilities = predict([quote['text'] for quote in quotes])
+        uncertainties = uncertainty(probabilities)
+
+        if scoring_round is None:
+            scoring_round = _next_round()
+
+        # quotes that have been finalized in the meantime are simply not matched
+        current_quotes_collection.bulk_write([
+            UpdateOne({'_id': quote['_id']}, {'$set': {'probability': float(probability), 'uncertainty': int(quote_uncertainty),
+                                                       'serving_rank': scoring_round * ROUND_SPAN + int(quote_uncertainty),
+                                                       'scored_by': fingerprint}, **TOUCH})
+            for quote, probability, quote_uncertainty in zip(quotes, probabilities, uncertainties)
+        ], ordered=False)
+
+        scored += len(quotes)
+
+    return scored
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score the quotes waiting for the markup by the uncertainty of the classifier')
+    parser.add_argument('--variant', choices=VARIANTS, default=SCORING_VARIANT)
+    parser.add_argument('--batch-size', type=int, default=SCORING_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, help='keep scoring the new quotes every that many seconds')
+    args = parser.parse_args()
+
+    model_predict = load_predictor(args.variant)
+    # the model is not reloaded, so neither is its fingerprint recomputed
+    current_fingerprint = model_fingerprint()
+
+    while True:
+        initial_time = time.perf_counter()
+        scored_quotes = score_quotes(model_predict, current_fingerprint, args.batch_size)
+        print(f'Scored {scored_quotes} quotes in {time.perf_counter() - initial_time:.2f} seconds')
+
+        if args.interval is None:
+            break
+
+        time.sleep(args.interval)
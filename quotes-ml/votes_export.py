@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from bson import ObjectId
+
+from classifier import load_tokenizer
+from mongo import client, processed_quotes_collection, reported_quotes_collection
+from training import TokenizedQuotes
+
+__all__ = ['SHARDS_DIR', 'vote_label', 'export_votes', 'load_shards']
+
+SHARDS_DIR = Path(os.getenv('SHARDS_DIR', Path(__file__).parent / 'shards'))
+SHARD_SIZE = int(os.getenv('SHARD_SIZE', 10000))
+CHECKPOINT_FILENAME = 'checkpoint.json'
+
+# same as in the markup site, quotes marked as NSFW at least that many times are hidden from the annotators
+NSFW_THRESHOLD = 1
+REPORTED_LOOKUP_BATCH_SIZE = 1000
+
+
+def vote_label(positive_votes: int, negative_votes: int) -> int | None:
+    # quotes without a clear majority are left out
+    if positive_votes == negative_votes:
+        return None
+
+    return int(positive_votes > negative_votes)
+
+
+def _load_checkpoint(shards_dir: Path) -> dict:
+    checkpoint_path = shards_dir / CHECKPOINT_FILENAME
+
+    if not checkpoint_path.exists():
+        return {'since': None, 'started_at': None, 'last_id': None, 'next_shard': 0}
+
+    with open(checkpoint_path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def _save_checkpoint(shards_dir: Path, checkpoint: dict):
+    # written next to the file and renamed, so an interrupted export never leaves a truncated checkpoint
+    temporary_path = shards_dir / f'{CHECKPOINT_FILENAME}.tmp'
+
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+
+    os.replace(temporary_path, shards_dir / CHECKPOINT_FILENAME)
+
+
+def _reported_ids(ids: list[ObjectId]) -> set[ObjectId]:
+    return {document['_id'] for document in reported_quotes_collection.find({'_id': {'$in': ids}}, {'_id': 1})}
+
+
+def _iter_labelled_quotes(checkpoint: dict) -> Iterator[tuple[ObjectId, str, int]]:
+    # a quote gets into `processed-quotes` when it is finalized, which can happen long after its `_id` was created,
+    # so every run only takes the quotes that have been written since the previous run started, in `_id` order
+    query = {'nsfw': {'$lt': NSFW_THRESHOLD}}
+    if checkpoint['since'] is not None:
+        query['updated_at'] = {'$gte': datetime.fromisoformat(checkpoint['since'])}
+    if checkpoint['last_id'] is not None:
+        query['_id'] = {'$gt': ObjectId(checkpoint['last_id'])}
+
+    quotes = processed_quotes_collection.find(query, {'text': 1, 'positive_votes': 1, 'negative_votes': 1}).sort('_id', 1)
+
+    batch = []
+    for quote in quotes:
+        batch.append(quote)
+
+        if len(batch) == REPORTED_LOOKUP_BATCH_SIZE:
+            yield from _labelled(batch)
+            batch = []
+
+    yield from _labelled(batch)
+
+
+def _labelled(quotes: list[dict]) -> Iterator[tuple[ObjectId, str, int]]:
+    reported_ids = _reported_ids([quote['_id'] for quote in quotes]) if quotes else set()
+
+    for quote in quotes:
+        label = vote_label(quote['positive_votes'], quote['negative_votes'])
+
+        if label is not None and quote['_id'] not in reported_ids:
+            yield quote['_id'], quote['text'], label
+
+
+def _write_shard(shards_dir: Path, shard_index: int, quotes: list[tuple[ObjectId, str, int]], tokenizer) -> Path:
+    ids, texts, labels = zip(*quotes)
+    tokenized_quotes = TokenizedQuotes.from_texts(texts, np.array(labels), tokenizer)
+
+    shard_path = shards_dir / f'shard-{shard_index:05d}.npz'
+    temporary_path = shards_dir / f'shard-{shard_index:05d}.tmp.npz'
+    np.savez(temporary_path, token_ids=tokenized_quotes.token_ids, offsets=tokenized_quotes.offsets,
+             labels=tokenized_quotes.labels, ids=np.array([str(quote_id) for quote_id in ids]))
+    os.replace(temporary_path, shard_path)
+
+    return shard_path
+
+
+def export_votes(shards_dir: Path = SHARDS_DIR, shard_size: int = SHARD_SIZE) -> list[Path]:
+    shards_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = _load_checkpoint(shards_dir)
+    tokenizer = load_tokenizer()
+
+    # an interrupted run is resumed with the same time window
+    if checkpoint['started_at'] is None:
+        checkpoint['started_at'] = client.admin.command('hello')['localTime'].isoformat()
+
+    new_shards = []
+    pending_quotes = []
+
+    def flush():
+        new_shards.append(_write_shard(shards_dir, checkpoint['next_shard'], pending_quotes, tokenizer))
+        checkpoint['next_shard'] += 1
+        checkpoint['last_id'] = str(pending_quotes[-1][0])
+        _save_checkpoint(shards_dir, checkpoint)
+        pending_quotes.clear()
+
+    for quote in _iter_labelled_quotes(checkpoint):
+        pending_quotes.append(quote)
+
+        if len(pending_quotes) == shard_size:
+            flush()
+
+    if pending_quotes:
+        flush()
+
+    checkpoint.update(since=checkpoint['started_at'], started_at=None, last_id=None)
+    _save_checkpoint(shards_dir, checkpoint)
+
+    return new_shards
+
+
+def _latest_rows(quotes: TokenizedQuotes, ids: np.ndarray) -> TokenizedQuotes:
+    # a processed quote is exported once more when its votes change (a duplicate merged into it), only its latest row is kept
+    _, last_reversed = np.unique(ids[::-1], return_index=True)
+    keep = np.zeros(len(ids), dtype=bool)
+    keep[len(ids) - 1 - last_reversed] = True
+
+    if keep.all():
+        return quotes
+
+    token_ids = quotes.token_ids[np.repeat(keep, quotes.lengths)]
+    return TokenizedQuotes(token_ids, np.concatenate([[0], np.cumsum(quotes.lengths[keep])]), quotes.labels[keep])
+
+
+def load_shards(shards_dir: Path = SHARDS_DIR, first_shard: int = 0) -> TokenizedQuotes:
+    # `first_shard` allows to only pick up the shards written since the previous training
+    token_ids, offsets, labels, ids = [], [np.zeros(1, dtype=np.int64)], [], []
+    total_tokens = 0
+
+    for shard_path in sorted(shards_dir.glob('shard-[0-9]*[0-9].npz')):
+        if int(shard_path.stem.removeprefix('shard-')) < first_shard:
+            continue
+
+        with np.load(shard_path) as shard:
+            offsets.append(shard['offsets'][1:] + total_tokens)
+            token_ids.append(shard['token_ids'])
+            labels.append(shard['labels'])
+            ids.append(shard['ids'])
+
+        total_tokens += len(token_ids[-1])
+
+    quotes = TokenizedQuotes(np.concatenate(token_ids or [np.zeros(0, dtype=np.int32)]), np.concatenate(offsets),
+                             np.concatenate(labels or [np.zeros(0, dtype=np.int64)]))
+
+    return _latest_rows(quotes, np.concatenate(ids or [np.zeros(0, dtype=str)]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the annotated quotes into pre-tokenized training shards')
+    parser.add_argument('--shards-dir', type=Path, default=SHARDS_DIR)
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    args = parser.parse_args()
+
+    exported_shards = export_votes(args.shards_dir, args.shard_size)
+    print(f'Exported {len(exported_shards)} new shards into {args.shards_dir}')